@@ -0,0 +1,88 @@
+# RandTalkBot Bot matching you with a random person on Telegram.
+# Copyright (C) 2016 quasiyoke
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Measures wall time of modules import in fresh interpreters. On Python 3.7+ also prints the
+slowest imports reported by `python -X importtime`.
+
+Usage:
+  import_time.py [--repeat=N] [--top=N] [MODULE...]
+  import_time.py -h | --help
+
+Arguments:
+  MODULE      Module to import [default: randtalkbot.i18n].
+
+Options:
+  --repeat=N  Number of measurements [default: 10].
+  --top=N     Number of the slowest imports to print [default: 10].
+"""
+
+import os
+import statistics
+import subprocess
+import sys
+from docopt import docopt
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+MEASURE = '''
+import time
+start = time.perf_counter()
+import {}
+print(time.perf_counter() - start)
+'''
+
+def measure(module):
+    output = subprocess.check_output(
+        [sys.executable, '-c', MEASURE.format(module)],
+        cwd=ROOT,
+        universal_newlines=True,
+        )
+    return float(output)
+
+def get_slowest_imports(module, top):
+    """Returns:
+        list: Tuples (cumulative time in us, self time in us, imported module) of the slowest
+            imports.
+    """
+    output = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import {}'.format(module)],
+        cwd=ROOT,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+        ).stderr
+    imports = []
+
+    for line in output.splitlines():
+        try:
+            self_time, cumulative_time, imported_module = line.split('|')
+            imports.append(
+                (int(cumulative_time), int(self_time.split(':')[1]), imported_module.rstrip()),
+                )
+        except ValueError: # Header.
+            continue
+
+    return sorted(imports, reverse=True)[:top]
+
+def main():
+    arguments = docopt(__doc__)
+    modules = arguments['MODULE'] or ['randtalkbot.i18n']
+    repeat = int(arguments['--repeat'])
+
+    for module in modules:
+        times = [measure(module) for unused_i in range(repeat)]
+        print('{}: median {:.1f} ms, min {:.1f} ms'.format(
+            module,
+            statistics.median(times) * 1000,
+            min(times) * 1000,
+            ))
+
+        if sys.version_info >= (3, 7):
+            for cumulative_time, self_time, imported_module in \
+                    get_slowest_imports(module, int(arguments['--top'])):
+                print('  {:>8} us {:>8} us {}'.format(cumulative_time, self_time, imported_module))
+
+if __name__ == '__main__':
+    main()
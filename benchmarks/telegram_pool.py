@@ -0,0 +1,90 @@
+# RandTalkBot Bot matching you with a random person on Telegram.
+# Copyright (C) 2016 quasiyoke
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Measures throughput, latency and opened connections of Bot API requests sent through the
+shared Telegram session to the local stand-in server for several pool sizes. Pool of 10
+connections is what telepot uses by default.
+
+Usage:
+  telegram_pool.py [--requests=N] [--concurrency=N] [--latency=SECONDS] [POOL_SIZE...]
+  telegram_pool.py -h | --help
+
+Arguments:
+  POOL_SIZE            Connections pool size [default: 10 100].
+
+Options:
+  --requests=N         Number of requests [default: 2000].
+  --concurrency=N      Number of requests in flight [default: 50].
+  --latency=SECONDS    Stand-in server's response latency [default: 0.02].
+"""
+
+import asyncio
+import os
+import sys
+import time
+from docopt import docopt
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+# pylint: disable=wrong-import-position
+import telepot.aio
+from randtalkbot.telegram_session import TelegramSession
+from tests.telegram_stand_in import TelegramStandIn
+
+def get_quantile(sorted_values, quantile):
+    return sorted_values[min(int(len(sorted_values) * quantile), len(sorted_values) - 1)]
+
+async def measure(pool_size, requests_count, concurrency, latency):
+    """Returns:
+        tuple: Requests per second, sorted requests' latencies and number of opened connections.
+    """
+    stand_in = TelegramStandIn(latency=latency)
+    await stand_in.start()
+    telegram_session = TelegramSession(api_url=stand_in.get_api_url(), pool_size=pool_size)
+    telegram_session.install()
+    bot = telepot.aio.Bot('benchmark')
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def send(chat_id):
+        async with semaphore:
+            start = time.perf_counter()
+            await bot.sendMessage(chat_id, 'Hello')
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+
+    try:
+        await asyncio.gather(*[send(chat_id) for chat_id in range(requests_count)])
+    finally:
+        await telegram_session.close()
+        await stand_in.stop()
+
+    return requests_count / (time.perf_counter() - start), sorted(latencies), \
+        stand_in.connections_count
+
+def main():
+    arguments = docopt(__doc__)
+    pools_sizes = [int(pool_size) for pool_size in arguments['POOL_SIZE'] or (10, 100)]
+    loop = asyncio.get_event_loop()
+
+    for pool_size in pools_sizes:
+        throughput, latencies, connections_count = loop.run_until_complete(measure(
+            pool_size,
+            int(arguments['--requests']),
+            int(arguments['--concurrency']),
+            float(arguments['--latency']),
+            ))
+        print('pool {:>4}: {:>7.0f} req/s, p50 {:>6.1f} ms, p99 {:>6.1f} ms, {} connections'.format(
+            pool_size,
+            throughput,
+            get_quantile(latencies, 0.5) * 1000,
+            get_quantile(latencies, 0.99) * 1000,
+            connections_count,
+            ))
+
+if __name__ == '__main__':
+    main()
@@ -6,13 +6,47 @@
 
 import logging
 import re
-from .errors import StrangerServiceError
+from .broadcast_service import BroadcastService
+from .errors import BroadcastServiceError, StrangerServiceError
 from .stranger_handler import StrangerHandler
 from .stranger_service import StrangerService
 
 LOGGER = logging.getLogger('randtalkbot.admin_handler')
 
 class AdminHandler(StrangerHandler):
+    async def _handle_command_broadcast(self, message):
+        broadcast_service = BroadcastService.get_instance()
+
+        if not message.command_args:
+            broadcast = broadcast_service.get_broadcast()
+
+            if broadcast is None:
+                await self._sender.send_notification(
+                    'Use it this way: `/broadcast Hello everyone!` Markdown is supported.',
+                    )
+            else:
+                await self._sender.send_notification(
+                    '{0}',
+                    broadcast_service.get_progress_report(broadcast),
+                    )
+
+            return
+
+        try:
+            broadcast = await broadcast_service.start(
+                message.command_args,
+                self._stranger.telegram_id,
+                )
+        except BroadcastServiceError as err:
+            await self._sender.send_notification('Can\'t start broadcast: {0}', err)
+            return
+
+        await self._sender.send_notification(
+            'Broadcast {0} was started. Send /broadcast to see its progress.',
+            broadcast.id,
+            )
+        LOGGER.debug('Broadcast: %d -> %d', self._stranger.id, broadcast.id)
+
     async def _handle_command_clear(self, message):
         someone_was_cleared = False
         for telegram_id in re.split(r'\s+', message.command_args):
@@ -6,10 +6,16 @@
 
 import logging
 import telepot
+from telepot.exception import TelegramError
 from telepot.delegate import per_from_id_in, per_from_id_except
 from telepot.aio.delegate import create_open, pave_event_space
 from .admin_handler import AdminHandler
+from .broadcast_service import BroadcastService
+from .outbound_queue import OutboundQueue
+from .rate_limiter import RateLimiter
 from .stranger_handler import StrangerHandler
+from .stranger_sender_service import StrangerSenderService
+from .webhook_server import WebhookServer
 
 LOGGER = logging.getLogger('randtalkbot.bot')
 
@@ -38,7 +44,78 @@ class Bot:
                     ),
                 ],
             )
+        # Strangers' messages and broadcasts share rate limits.
+        outbound_queue = OutboundQueue(
+            rate_limiter=RateLimiter(
+                global_rate=configuration.global_rate_limit,
+                chat_rate=configuration.chat_rate_limit,
+                chat_burst=configuration.chat_burst_limit,
+                ),
+            max_attempts=configuration.sending_max_attempts,
+            )
+        StrangerSenderService(
+            self._delegator_bot,
+            cache_capacity=configuration.senders_cache_capacity,
+            cache_ttl=configuration.senders_cache_ttl,
+            outbound_queue=outbound_queue,
+            )
+        BroadcastService(
+            self._delegator_bot,
+            outbound_queue=outbound_queue,
+            rate=configuration.broadcast_rate,
+            )
+        self._webhook_url = configuration.webhook_url
+        self._webhook_secret_token = configuration.webhook_secret_token
+        self._webhook_max_connections = configuration.webhook_max_connections
+
+        if self._webhook_url is None:
+            self._webhook_server = None
+        else:
+            self._webhook_server = WebhookServer(
+                host=configuration.webhook_host,
+                port=configuration.webhook_port,
+                path=configuration.webhook_path,
+                secret_token=self._webhook_secret_token,
+                queue_size=configuration.webhook_queue_size,
+                )
 
     async def run(self):
-        LOGGER.info('Listening')
-        await self._delegator_bot.message_loop()
+        if self._webhook_server is None:
+            try:
+                # getUpdates doesn't work while the webhook is set.
+                await self._delegator_bot.deleteWebhook()
+            except TelegramError as err:
+                LOGGER.warning('Can\'t delete webhook. %s', err)
+
+            LOGGER.info('Listening')
+            await self._delegator_bot.message_loop()
+        else:
+            await self._webhook_server.run()
+
+            try:
+                await self._set_webhook()
+            except TelegramError as err:
+                # Webhook could be set earlier, so the updates may still come.
+                LOGGER.error('Can\'t set webhook. %s', err)
+
+            LOGGER.info('Listening on webhook %s', self._webhook_url)
+            # Telegram doesn't send the next update from the chat until the previous one was
+            # accepted, so reordering across chats isn't needed. Besides ordered loop would
+            # discard the updates retried after "429 Too Many Requests".
+            await self._delegator_bot.message_loop(
+                source=self._webhook_server.queue,
+                ordered=False,
+                )
+
+    async def _set_webhook(self):
+        params = {'url': self._webhook_url}
+
+        if self._webhook_secret_token is not None:
+            params['secret_token'] = self._webhook_secret_token
+
+        if self._webhook_max_connections is not None:
+            params['max_connections'] = self._webhook_max_connections
+
+        # telepot's setWebhook() doesn't know about secret token.
+        # pylint: disable=protected-access
+        await self._delegator_bot._api_request('setWebhook', params)
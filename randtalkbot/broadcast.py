@@ -0,0 +1,46 @@
+# RandTalkBot Bot matching you with a random person on Telegram.
+# Copyright (C) 2016 quasiyoke
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import datetime
+import logging
+from peewee import DateTimeField, IntegerField, Model, Proxy, TextField
+
+LOGGER = logging.getLogger('randtalkbot.broadcast')
+DATABASE_PROXY = Proxy()
+
+
+class Broadcast(Model):
+    text = TextField()
+    admin_telegram_id = IntegerField()
+    # ID of the last stranger whose message was processed. Strangers are walked in the order of
+    # their IDs, so the broadcast can be resumed from the cursor after restart.
+    cursor = IntegerField(default=0)
+    delivered_count = IntegerField(default=0)
+    failed_count = IntegerField(default=0)
+    blocked_count = IntegerField(default=0)
+    created = DateTimeField(default=datetime.datetime.utcnow)
+    finished = DateTimeField(index=True, null=True)
+
+    class Meta:
+        database = DATABASE_PROXY
+
+    @classmethod
+    def get_unfinished(cls):
+        """Raises:
+            DoesNotExist: If there's no unfinished broadcast.
+
+        Returns:
+            Broadcast: The earliest unfinished broadcast.
+        """
+        # pylint: disable=singleton-comparison
+        return cls.select().where(cls.finished == None).order_by(cls.id).get()
+
+    def get_processed_count(self):
+        return self.delivered_count + self.failed_count + self.blocked_count
+
+    def finish(self):
+        self.finished = datetime.datetime.utcnow()
+        self.save()
@@ -0,0 +1,257 @@
+# RandTalkBot Bot matching you with a random person on Telegram.
+# Copyright (C) 2016 quasiyoke
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import logging
+from peewee import DatabaseError, DoesNotExist
+from telepot.exception import TelegramError
+from .broadcast import Broadcast
+from .errors import BroadcastServiceError, TransientSendingError
+from .metrics import BROADCAST_MESSAGES
+from .notification_catalog import NOTIFICATION_PREFIX
+from .rate_limiter import PRIORITY_BROADCAST, PRIORITY_NOTIFICATION
+from .stranger import Stranger
+
+LOGGER = logging.getLogger('randtalkbot.broadcast_service')
+OUTCOME_BLOCKED = 'blocked'
+OUTCOME_DELIVERED = 'delivered'
+OUTCOME_FAILED = 'failed'
+
+def get_outcome(err):
+    """Returns:
+        str: Outcome of the sending which has failed with the error.
+    """
+    if not isinstance(err, TransientSendingError) and isinstance(err, TelegramError) and \
+            err.error_code == 403:
+        # The stranger has blocked the bot or has deactivated the account.
+        return OUTCOME_BLOCKED
+
+    return OUTCOME_FAILED
+
+
+class BroadcastService:
+    """Sends admin's message to all strangers. Strangers are read from the DB page by page in the
+    order of their IDs and messages are sent at the configured rate with the lowest priority, so
+    chat relay isn't starved. The cursor and the counters are saved after every page, so the
+    broadcast is resumed after restart. Strangers from the page which was interrupted by restart
+    may receive the message twice.
+    """
+
+    PAGE_SIZE = 100
+    RATE = 10
+    REPORT_INTERVAL = 60
+
+    def __init__(self, bot, outbound_queue=None, rate=None):
+        """Args:
+            bot (telepot.aio.Bot): Bot sending the messages.
+            outbound_queue (OutboundQueue): Queue pacing and retrying sent messages. Messages are
+                sent directly if it's `None`.
+            rate (float): Messages per second. Should be noticeably lower than the global rate
+                limit to leave room for chat relay.
+        """
+        type(self)._instance = self
+        self._bot = bot
+        self._outbound_queue = outbound_queue
+        self._interval = 1 / (type(self).RATE if rate is None else rate)
+        self._broadcast = None
+        self._recipients_count = None
+
+    @classmethod
+    def get_instance(cls):
+        try:
+            return cls._instance
+        except AttributeError:
+            raise RuntimeError('BroadcastService was not initialized')
+
+    def get_broadcast(self):
+        """Returns:
+            Broadcast: Broadcast in progress or `None`.
+        """
+        return self._broadcast
+
+    def get_progress_report(self, broadcast):
+        return 'Broadcast {0}: {1} of {2} strangers were processed. Delivered: {3}, failed: {4}, ' \
+            'blocked: {5}.'.format(
+                broadcast.id,
+                broadcast.get_processed_count(),
+                self._recipients_count if broadcast is self._broadcast else '?',
+                broadcast.delivered_count,
+                broadcast.failed_count,
+                broadcast.blocked_count,
+                )
+
+    def resume(self):
+        """Resumes the broadcast which was interrupted by restart.
+
+        Raises:
+            BroadcastServiceError: If there're some DB troubles.
+        """
+        try:
+            broadcast = Broadcast.get_unfinished()
+        except DoesNotExist:
+            return
+        except DatabaseError as err:
+            raise BroadcastServiceError('Can\'t obtain unfinished broadcast: {}'.format(err)) \
+                from err
+
+        LOGGER.info('Resuming broadcast %d after stranger %d', broadcast.id, broadcast.cursor)
+        self._start(broadcast)
+
+    async def start(self, text, admin_telegram_id):
+        """Sends the message to the admin first, so the broadcast isn't started if Telegram can't
+        parse it and every recipient would fail.
+
+        Raises:
+            BroadcastServiceError: If another broadcast is in progress, if Telegram has rejected
+                the message or if there're some DB troubles.
+
+        Returns:
+            Broadcast: Started broadcast.
+        """
+        self._check_not_in_progress()
+
+        try:
+            await self._send(admin_telegram_id, NOTIFICATION_PREFIX + text, PRIORITY_NOTIFICATION)
+        except TelegramError as err:
+            if not isinstance(err, TransientSendingError) and err.error_code == 400:
+                raise BroadcastServiceError(
+                    'Telegram has rejected the message: {}'.format(err.description),
+                    ) from err
+
+            LOGGER.warning('Can\'t send broadcast to admin %d first. %s', admin_telegram_id, err)
+
+        # Another broadcast could be started while the message was being sent to the admin.
+        self._check_not_in_progress()
+
+        try:
+            broadcast = Broadcast.create(text=text, admin_telegram_id=admin_telegram_id)
+        except DatabaseError as err:
+            raise BroadcastServiceError('Can\'t create broadcast: {}'.format(err)) from err
+
+        LOGGER.info('Starting broadcast %d by %d', broadcast.id, admin_telegram_id)
+        self._start(broadcast)
+        return broadcast
+
+    def _check_not_in_progress(self):
+        """Raises:
+            BroadcastServiceError: If another broadcast is in progress.
+        """
+        if self._broadcast is not None:
+            raise BroadcastServiceError(
+                'Broadcast {} is in progress already'.format(self._broadcast.id),
+                )
+
+    def _start(self, broadcast):
+        self._broadcast = broadcast
+        asyncio.get_event_loop().create_task(self._run(broadcast))
+
+    def _get_recipients(self, cursor):
+        """Returns:
+            list: Tuples (stranger ID, Telegram ID) of the page following the cursor.
+        """
+        return list(
+            Stranger.select(Stranger.id, Stranger.telegram_id)
+            .where(Stranger.id > cursor)
+            .order_by(Stranger.id)
+            .limit(type(self).PAGE_SIZE)
+            .tuples()
+            )
+
+    async def _run(self, broadcast):
+        loop = asyncio.get_event_loop()
+
+        try:
+            self._recipients_count = broadcast.get_processed_count() + \
+                Stranger.select().where(Stranger.id > broadcast.cursor).count()
+            next_sending_time = loop.time()
+            next_report_time = loop.time() + type(self).REPORT_INTERVAL
+
+            while True:
+                recipients = self._get_recipients(broadcast.cursor)
+
+                if not recipients:
+                    break
+
+                sendings = []
+
+                for unused_stranger_id, telegram_id in recipients:
+                    delay = next_sending_time - loop.time()
+
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+
+                    next_sending_time = max(next_sending_time, loop.time()) + self._interval
+                    sendings.append(loop.create_task(self._send_broadcast(broadcast, telegram_id)))
+
+                for outcome in await asyncio.gather(*sendings):
+                    if outcome == OUTCOME_DELIVERED:
+                        broadcast.delivered_count += 1
+                    elif outcome == OUTCOME_BLOCKED:
+                        broadcast.blocked_count += 1
+                    else:
+                        broadcast.failed_count += 1
+
+                broadcast.cursor = recipients[-1][0]
+                broadcast.save()
+
+                if loop.time() >= next_report_time:
+                    next_report_time = loop.time() + type(self).REPORT_INTERVAL
+                    loop.create_task(self._report(broadcast, self.get_progress_report(broadcast)))
+
+            broadcast.finish()
+        except DatabaseError as err:
+            LOGGER.error(
+                'Broadcast %d was interrupted by DB troubles and will be resumed after restart. %s',
+                broadcast.id,
+                err,
+                )
+            report = 'Broadcast {0} was interrupted by DB troubles and will be resumed after ' \
+                'restart.'.format(broadcast.id)
+        else:
+            LOGGER.info('Broadcast %d was finished', broadcast.id)
+            report = self.get_progress_report(broadcast) + ' Finished.'
+        finally:
+            self._broadcast = None
+
+        await self._report(broadcast, report)
+
+    async def _send_broadcast(self, broadcast, telegram_id):
+        """Returns:
+            str: Outcome of the sending.
+        """
+        try:
+            await self._send(
+                telegram_id,
+                NOTIFICATION_PREFIX + broadcast.text,
+                PRIORITY_BROADCAST,
+                )
+        except TelegramError as err:
+            outcome = get_outcome(err)
+            LOGGER.debug('Broadcast %d to %d: %s. %s', broadcast.id, telegram_id, outcome, err)
+        else:
+            outcome = OUTCOME_DELIVERED
+
+        BROADCAST_MESSAGES.inc(outcome=outcome)
+        return outcome
+
+    async def _report(self, broadcast, report):
+        try:
+            await self._send(
+                broadcast.admin_telegram_id,
+                NOTIFICATION_PREFIX + report,
+                PRIORITY_NOTIFICATION,
+                )
+        except TelegramError as err:
+            LOGGER.warning('Can\'t report broadcast %d progress to admin. %s', broadcast.id, err)
+
+    async def _send(self, telegram_id, text, priority):
+        async def send_function():
+            return await self._bot.sendMessage(telegram_id, text, parse_mode='Markdown')
+
+        if self._outbound_queue is None:
+            return await send_function()
+
+        return await self._outbound_queue.send(telegram_id, send_function, priority)
@@ -0,0 +1,142 @@
+# RandTalkBot Bot matching you with a random person on Telegram.
+# Copyright (C) 2016 quasiyoke
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from collections import OrderedDict
+import logging
+import time
+
+LOGGER = logging.getLogger('randtalkbot.cache')
+
+
+class Cache:
+    """Dict-like cache with LRU eviction of the entries which exceed capacity or which weren't
+    accessed for longer than TTL. Entries for which `is_pinned` returns `True` are never evicted,
+    so the cache may grow above its capacity if all of them are pinned.
+
+    Eviction happens only on insertion (or on explicit `evict()` call), so an idle cache keeps
+    its expired entries until somebody puts something to it.
+    """
+
+    def __init__(self, capacity, ttl, is_pinned=None, on_evict=None):
+        """Args:
+            capacity (int): Number of entries after which the least recently used ones are evicted.
+            ttl (float): Number of seconds after last access after which an entry is evicted.
+            is_pinned (callable): Receives cached value and tells if it shouldn't be evicted.
+            on_evict (callable): Receives key and value of every evicted entry.
+        """
+        self._capacity = max(capacity, 1)
+        self._ttl = ttl
+        self._is_pinned = is_pinned
+        self._on_evict = on_evict
+        # Maps keys to `(value, last_access_time)` in order from the least recently used entry.
+        self._entries = OrderedDict()
+        self.hits_count = 0
+        self.misses_count = 0
+        self.evictions_count = 0
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __delitem__(self, key):
+        del self._entries[key]
+
+    def __getitem__(self, key):
+        """Raises:
+            KeyError: If there's no such entry in the cache.
+
+        Returns:
+            Cached value. The entry is refreshed.
+        """
+        try:
+            value, unused_last_access_time = self._entries[key]
+        except KeyError:
+            self.misses_count += 1
+            raise
+
+        self.hits_count += 1
+        self._entries[key] = (value, time.monotonic())
+        self._entries.move_to_end(key) # pylint: disable=no-member
+        return value
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __setitem__(self, key, value):
+        self._entries[key] = (value, time.monotonic())
+        self._entries.move_to_end(key) # pylint: disable=no-member
+        self.evict()
+
+    def clear(self):
+        self._entries.clear()
+
+    def discard(self, key):
+        """Evicts the entry if it's present."""
+        try:
+            value, unused_last_access_time = self._entries.pop(key)
+        except KeyError:
+            return
+
+        self.evictions_count += 1
+
+        if self._on_evict is not None:
+            self._on_evict(key, value)
+
+    def evict(self):
+        """Evicts expired entries and least recently used entries exceeding the capacity. The most
+        recently used entry is never evicted here to let the caller use the value it has just put.
+        """
+        now = time.monotonic()
+        checks_count = len(self._entries) - 1
+
+        while checks_count > 0:
+            checks_count -= 1
+            key, (value, last_access_time) = next(iter(self._entries.items()))
+
+            if len(self._entries) <= self._capacity and now - last_access_time <= self._ttl:
+                # Remaining entries were accessed later, so they aren't expired too.
+                break
+
+            if self._is_pinned is not None and self._is_pinned(value):
+                self._entries[key] = (value, now)
+                self._entries.move_to_end(key) # pylint: disable=no-member
+                continue
+
+            del self._entries[key]
+            self.evictions_count += 1
+
+            if self._on_evict is not None:
+                self._on_evict(key, value)
+
+    def get_stats(self):
+        return {
+            'evictions': self.evictions_count,
+            'hits': self.hits_count,
+            'misses': self.misses_count,
+            'size': len(self._entries),
+            }
+
+    def values(self):
+        """Returns:
+            list: Cached values. Entries aren't refreshed.
+        """
+        return [value for value, unused_last_access_time in self._entries.values()]
+
+    def peek(self, key, default=None):
+        """Returns the value without counting a hit and refreshing the entry."""
+        try:
+            value, unused_last_access_time = self._entries[key]
+        except KeyError:
+            return default
+
+        return value
+
+    def pop(self, key, default=None):
+        try:
+            value, unused_last_access_time = self._entries.pop(key)
+        except KeyError:
+            return default
+
+        return value
@@ -67,3 +67,47 @@ class Configuration:
             raise ConfigurationObtainingError(reason) from err
 
         self.admins_telegram_ids = configuration_json.get('admins', [])
+        cache_json = configuration_json.get('cache', {})
+        self.strangers_cache_capacity = cache_json.get('strangers_capacity')
+        self.strangers_cache_ttl = cache_json.get('strangers_ttl')
+        self.senders_cache_capacity = cache_json.get('senders_capacity')
+        self.senders_cache_ttl = cache_json.get('senders_ttl')
+        rate_limits_json = configuration_json.get('rate_limits', {})
+        self.global_rate_limit = rate_limits_json.get('global_rate')
+        self.chat_rate_limit = rate_limits_json.get('chat_rate')
+        self.chat_burst_limit = rate_limits_json.get('chat_burst')
+        broadcast_json = configuration_json.get('broadcast', {})
+        self.broadcast_rate = broadcast_json.get('rate')
+        sending_json = configuration_json.get('sending', {})
+        self.sending_max_attempts = sending_json.get('max_attempts')
+        telegram_json = configuration_json.get('telegram', {})
+        self.telegram_api_url = telegram_json.get('api_url')
+        self.telegram_pool_size = telegram_json.get('pool_size')
+        self.telegram_per_host_limit = telegram_json.get('per_host_limit')
+        self.telegram_keepalive_timeout = telegram_json.get('keepalive_timeout')
+        self.telegram_dns_cache_ttl = telegram_json.get('dns_cache_ttl')
+        self.telegram_connect_timeout = telegram_json.get('connect_timeout')
+        self.telegram_timeout = telegram_json.get('timeout')
+        webhook_json = configuration_json.get('webhook', {})
+        # Long polling is used if the webhook URL isn't specified.
+        self.webhook_url = webhook_json.get('url')
+        self.webhook_host = webhook_json.get('host')
+        self.webhook_port = webhook_json.get('port')
+        self.webhook_path = webhook_json.get('path')
+        self.webhook_secret_token = get_secret('webhook_secret_token')
+
+        if self.webhook_secret_token is None:
+            self.webhook_secret_token = webhook_json.get('secret_token')
+
+        self.webhook_queue_size = webhook_json.get('queue_size')
+        self.webhook_max_connections = webhook_json.get('max_connections')
+        stats_json = configuration_json.get('stats', {})
+        self.sex_ratio_smoothing = stats_json.get('sex_ratio_smoothing')
+        loop_monitor_json = configuration_json.get('loop_monitor', {})
+        self.loop_monitor_interval = loop_monitor_json.get('interval')
+        # Slow callbacks aren't reported if the threshold isn't specified.
+        self.slow_callback_threshold = loop_monitor_json.get('slow_callback_threshold')
+        metrics_json = configuration_json.get('metrics', {})
+        self.metrics_host = metrics_json.get('host')
+        # Metrics endpoint is disabled if the port isn't specified.
+        self.metrics_port = metrics_json.get('port')
@@ -7,9 +7,12 @@
 import logging
 import time
 from peewee import DatabaseError, MySQLDatabase
+from playhouse.migrate import migrate, MySQLMigrator
 from playhouse.shortcuts import RetryOperationalError
-from randtalkbot import stats, stranger, talk
+from randtalkbot import broadcast, stats, stranger, talk
+from .broadcast import Broadcast
 from .errors import DBError
+from .metrics import DB_QUERY_SECONDS
 from .stats import Stats
 from .stranger import Stranger
 from .talk import Talk
@@ -20,7 +23,14 @@ class RetryingDB(RetryOperationalError, MySQLDatabase):
     """Automatically reconnecting database class.
     @see http://docs.peewee-orm.com/en/latest/peewee/database.html#automatic-reconnect
     """
-    pass
+
+    def execute_sql(self, *args, **kwargs):
+        start = time.monotonic()
+
+        try:
+            return super(RetryingDB, self).execute_sql(*args, **kwargs)
+        finally:
+            DB_QUERY_SECONDS.observe(time.monotonic() - start)
 
 class DB:
     def __init__(self, configuration):
@@ -35,6 +45,7 @@ class DB:
             password=configuration.database_password,
             )
         self._assert_configuration_ok()
+        broadcast.DATABASE_PROXY.initialize(self._db)
         stats.DATABASE_PROXY.initialize(self._db)
         stranger.DATABASE_PROXY.initialize(self._db)
         talk.DATABASE_PROXY.initialize(self._db)
@@ -71,11 +82,25 @@ class DB:
             attempt_index += 1
 
     def install(self):
-        """Raises:
+        """Creates missing tables and columns, so it can be executed on every start.
+
+        Raises:
             DBError: If there're some troubles during creating tables.
 
         """
         try:
-            self._db.create_tables([Stats, Stranger, Talk])
+            self._db.create_tables([Broadcast, Stats, Stranger, Talk], safe=True)
+            # pylint: disable=protected-access
+            stats_columns_names = [
+                column.name
+                for column in self._db.get_columns(Stats._meta.db_table)
+                ]
+
+            if Stats.period.db_column not in stats_columns_names:
+                LOGGER.info('Adding stats\' period column')
+                migrator = MySQLMigrator(self._db)
+                migrate(
+                    migrator.add_column(Stats._meta.db_table, Stats.period.db_column, Stats.period),
+                    )
         except DatabaseError as err:
             raise DBError('DatabaseError during creating tables') from err
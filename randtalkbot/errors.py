@@ -4,6 +4,11 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+from telepot.exception import TelegramError
+
+class BroadcastServiceError(Exception):
+    pass
+
 class DBError(Exception):
     pass
 
@@ -41,6 +46,15 @@ class StrangerSenderServiceError(Exception):
 class StrangerServiceError(Exception):
     pass
 
+class TransientSendingError(TelegramError):
+    """Message wasn't delivered because of temporary troubles (rate limits, network) which
+    persisted after all retries. Unlike other `TelegramError`s it doesn't mean that the recipient
+    has blocked the bot.
+    """
+
+    # telepot looks through `TelegramError` subclasses to recognize API errors.
+    DESCRIPTION_PATTERNS = []
+
 class UnknownCommandError(Exception):
     def __init__(self, command):
         super(UnknownCommandError, self).__init__()
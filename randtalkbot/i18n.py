@@ -5,14 +5,23 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from collections import OrderedDict
+import functools
 import gettext
 import logging
 import os
-import pycountry
+from .trie import Trie
 from .utils import LOCALE_DIR
 
 LOGGER = logging.getLogger('randtalkbot.i18n')
 QUOTES = '\"\'“”«»'
+QUOTES_TRANSLATION_TABLE = str.maketrans('', '', QUOTES)
+# Maximum edit distance of misspelt language name by name length. Short names are mostly codes
+# which would be confused with each other.
+LANGUAGE_NAME_MAX_DISTANCES = (
+    (3, 0),
+    (6, 1),
+    )
+LANGUAGE_NAME_MAX_DISTANCE = 2
 
 class LanguageNotFoundError(Exception):
     def __init__(self, name):
@@ -27,18 +36,50 @@ def _get_deduplicated(list_instance):
     """
     return list(OrderedDict.fromkeys(list_instance))
 
+def _get_max_distance(name):
+    for max_length, max_distance in LANGUAGE_NAME_MAX_DISTANCES:
+        if len(name) <= max_length:
+            return max_distance
+
+    return LANGUAGE_NAME_MAX_DISTANCE
+
 def _get_language_code(name):
-    """Raises:
-        LanguageNotFoundError: If unable to recognize the language.
+    """Recognizes slightly misspelt languages names too.
+
+    Raises:
+        LanguageNotFoundError: If unable to recognize the language or if several languages are
+            equally close to the name.
 
     Returns:
         str: Language code.
     """
+    lowercased_name = name.lower()
+    languages_names_to_codes, unused_languages_codes_to_names = _get_languages_tables()
+
     try:
-        return LANGUAGES_NAMES_TO_CODES[name.lower()]
+        return languages_names_to_codes[lowercased_name]
     except KeyError:
+        pass
+
+    max_distance = _get_max_distance(lowercased_name)
+
+    if not max_distance:
+        raise LanguageNotFoundError(name)
+
+    matches = _get_languages_trie().search(lowercased_name, max_distance)
+
+    if not matches:
+        raise LanguageNotFoundError(name)
+
+    best_distance = matches[0][0]
+    codes = {code for distance, unused_key, code in matches if distance == best_distance}
+
+    if len(codes) > 1:
+        LOGGER.debug('Language name \"%s\" is ambiguous: %s', name, codes)
         raise LanguageNotFoundError(name)
 
+    return codes.pop()
+
 def _get_language_name(code):
     """Raises:
         LanguageNotFoundError: If unable to recognize the language.
@@ -46,8 +87,10 @@ def _get_language_name(code):
     Returns:
         str: Language name.
     """
+    unused_languages_names_to_codes, languages_codes_to_names = _get_languages_tables()
+
     try:
-        return LANGUAGES_CODES_TO_NAMES[code]
+        return languages_codes_to_names[code]
     except KeyError:
         raise LanguageNotFoundError(code)
 
@@ -68,9 +111,9 @@ def get_languages_codes(names):
     Returns:
         list<str>: Deduplicated list of languages' codes.
     """
-    names = ''.join([c for c in names if c not in QUOTES])
+    names = names.translate(QUOTES_TRANSLATION_TABLE)
 
-    if names.strip().lower() in SAME_LANGUAGE_NAMES:
+    if names.strip().lower() in _get_same_language_names():
         return ['same']
 
     names = [name.strip() for name in names.split(',')]
@@ -79,15 +122,12 @@ def get_languages_codes(names):
     unique_languages_codes = _get_deduplicated(languages_codes)
     return unique_languages_codes
 
-def get_translation(languages):
-    if not languages:
-        languages = ['en']
-
+def _load_translation(languages):
     try:
         translation_instance = gettext.translation(
             'randtalkbot',
             localedir=LOCALE_DIR,
-            languages=languages,
+            languages=list(languages),
             )
     except OSError:
         translation_instance = gettext.translation(
@@ -98,11 +138,89 @@ def get_translation(languages):
 
     return translation_instance.gettext
 
+def get_translation_languages(languages):
+    """Leaves only languages having locales, so all lists of languages resolving to the same
+    catalog give the same tuple.
+
+    Returns:
+        tuple: Deduplicated codes of available locales in the order of `languages` or `('en', )`
+            if there're no such codes.
+    """
+    locales = get_locales()
+    languages = _get_deduplicated(language for language in languages or () if language in locales)
+    return tuple(languages) or ('en', )
+
+def get_translation(languages):
+    """Translations are memoized per normalized languages tuple so gettext doesn't look for `.mo`
+    files and parse them every time. The memo is limited by the number of locales combinations.
+
+    Returns:
+        callable: `gettext` function of the translation.
+    """
+    languages = get_translation_languages(languages)
+
+    try:
+        return TRANSLATIONS[languages]
+    except KeyError:
+        translation_function = _load_translation(languages)
+        TRANSLATIONS[languages] = translation_function
+        return translation_function
+
+@functools.lru_cache(maxsize=None)
+def get_locales():
+    """Returns:
+        tuple: Sorted codes of available locales.
+    """
+    return tuple(
+        filename
+        for filename in sorted(os.listdir(LOCALE_DIR))
+        if os.path.isdir(os.path.join(LOCALE_DIR, filename))
+        )
+
 def get_translations():
-    for filename in os.listdir(LOCALE_DIR):
-        if os.path.isdir(os.path.join(LOCALE_DIR, filename)):
-            yield get_translation([filename])
+    for locale in get_locales():
+        yield get_translation([locale])
+
+def load_translations():
+    """Loads translations for all available locales. Should be called at startup to avoid
+    loading them during handling of the first messages.
+    """
+    locales = get_locales()
+
+    for locale in locales:
+        get_translation([locale])
+
+    LOGGER.info('Translations for %d locales were loaded', len(locales))
 
+def reload_translations():
+    """Drops memoized translations and everything built from them and loads them again. Can be
+    used to apply new translations without restarting the bot.
+    """
+    from .errors import StrangerSenderServiceError
+    from .stranger import get_sex_names_to_codes
+    from .stranger_sender import TRANSLATED_ARTICLES
+    from .stranger_sender_service import StrangerSenderService
+
+    TRANSLATIONS.clear()
+    # gettext keeps its own cache of parsed `.mo` files and has no public API to drop it, so
+    # private `gettext._translations` dict is cleared. Without it `gettext.translation()` would
+    # return old catalogs. Check this line when upgrading Python.
+    gettext._translations.clear() # pylint: disable=protected-access
+    get_locales.cache_clear()
+    _get_same_language_names.cache_clear()
+    get_sex_names_to_codes.cache_clear()
+    TRANSLATED_ARTICLES.clear()
+    load_translations()
+
+    try:
+        stranger_sender_service = StrangerSenderService.get_instance()
+    except StrangerSenderServiceError:
+        return
+
+    # Live senders keep old translations until their strangers change languages or partners.
+    stranger_sender_service.reload_translations()
+
+TRANSLATIONS = {}
 SUPPORTED_LANGUAGES_NAMES_CHOICES = (
     ('en', 'English'),
     ('ru', 'Русский'),
@@ -113,27 +231,58 @@ SUPPORTED_LANGUAGES_NAMES_CHOICES = (
     ('es', 'Español'),
     ('pt', 'Português'),
     )
-LANGUAGES_CODES_TO_NAMES = \
-    {item[0].lower(): item[1] for item in SUPPORTED_LANGUAGES_NAMES_CHOICES}
 SUPPORTED_LANGUAGES_NAMES = list(zip(*SUPPORTED_LANGUAGES_NAMES_CHOICES))[1]
-LANGUAGES_NAMES_TO_CODES = \
-    {item[1].lower(): item[0] for item in SUPPORTED_LANGUAGES_NAMES_CHOICES}
-SAME_LANGUAGE_NAMES = []
-for translation in get_translations():
-    SAME_LANGUAGE_NAMES.append(translation('Leave the language unchanged').lower())
-    SAME_LANGUAGE_NAMES.append(translation('Leave the languages unchanged').lower())
-
-for language in pycountry.languages:
-    try:
-        LANGUAGES_NAMES_TO_CODES[language.name.lower()] = language.iso639_1_code
-        LANGUAGES_NAMES_TO_CODES[language.iso639_1_code] = language.iso639_1_code
-        # Not override previosly specified native name.
-        if language.iso639_1_code not in LANGUAGES_CODES_TO_NAMES:
-            LANGUAGES_CODES_TO_NAMES[language.iso639_1_code] = language.name
-    # If it has'n even simplest fields, that's not the languages we are interested in.
-    except AttributeError:
-        continue
-    try:
-        LANGUAGES_NAMES_TO_CODES[language.iso639_2T_code] = language.iso639_1_code
-    except AttributeError:
-        pass
+
+@functools.lru_cache(maxsize=None)
+def _get_languages_tables():
+    """Builds languages tables on the first lookup because iterating over all pycountry languages
+    takes noticeable time and memory which isn't needed by most of processes importing the module.
+
+    Returns:
+        tuple: Dict of languages names and codes to ISO 639-1 codes and dict of ISO 639-1 codes to
+            languages names.
+    """
+    import pycountry
+    languages_codes_to_names = \
+        {item[0].lower(): item[1] for item in SUPPORTED_LANGUAGES_NAMES_CHOICES}
+    languages_names_to_codes = \
+        {item[1].lower(): item[0] for item in SUPPORTED_LANGUAGES_NAMES_CHOICES}
+
+    for language in pycountry.languages:
+        try:
+            languages_names_to_codes[language.name.lower()] = language.iso639_1_code
+            languages_names_to_codes[language.iso639_1_code] = language.iso639_1_code
+            # Not override previosly specified native name.
+            if language.iso639_1_code not in languages_codes_to_names:
+                languages_codes_to_names[language.iso639_1_code] = language.name
+        # If it has'n even simplest fields, that's not the languages we are interested in.
+        except AttributeError:
+            continue
+        try:
+            languages_names_to_codes[language.iso639_2T_code] = language.iso639_1_code
+        except AttributeError:
+            pass
+
+    return languages_names_to_codes, languages_codes_to_names
+
+@functools.lru_cache(maxsize=None)
+def _get_languages_trie():
+    """Returns:
+        Trie: Trie of lowercased languages names, native names and codes to ISO 639-1 codes.
+    """
+    languages_trie = Trie()
+
+    for name, code in _get_languages_tables()[0].items():
+        languages_trie[name] = code
+
+    return languages_trie
+
+@functools.lru_cache(maxsize=None)
+def _get_same_language_names():
+    same_language_names = set()
+
+    for translation in get_translations():
+        same_language_names.add(translation('Leave the language unchanged').lower())
+        same_language_names.add(translation('Leave the languages unchanged').lower())
+
+    return frozenset(same_language_names)
@@ -0,0 +1,91 @@
+# RandTalkBot Bot matching you with a random person on Telegram.
+# Copyright (C) 2016 quasiyoke
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from .metrics import EVENT_LOOP_LAG_SECONDS, SLOW_CALLBACKS
+
+LOGGER = logging.getLogger('randtalkbot.loop_monitor')
+
+def get_current_task(loop):
+    try:
+        return asyncio.current_task(loop)
+    except AttributeError:
+        # Python 3.6.
+        return asyncio.Task.current_task(loop)
+
+def get_task_name(task):
+    if task is None:
+        return 'callback'
+
+    coroutine = getattr(task, '_coro', None) # pylint: disable=protected-access
+    return getattr(coroutine, '__qualname__', repr(coroutine))
+
+
+class LoopMonitor:
+    """Measures event loop lag periodically and publishes it as metrics. If slow callback threshold
+    is specified, watchdog thread checks that the loop isn't blocked for longer than the threshold
+    and logs the task and the stack which block it.
+    """
+
+    LAG_PROBE_INTERVAL = 1
+
+    def __init__(self, lag_probe_interval=None, slow_callback_threshold=None):
+        self._lag_probe_interval = type(self).LAG_PROBE_INTERVAL \
+            if lag_probe_interval is None else lag_probe_interval
+        self._slow_callback_threshold = slow_callback_threshold
+        self._heartbeat = None
+        self._loop = None
+        self._loop_thread_id = None
+
+    async def run(self):
+        self._loop = asyncio.get_event_loop()
+        self._loop_thread_id = threading.get_ident()
+
+        if self._slow_callback_threshold is not None:
+            self._beat()
+            watchdog = threading.Thread(target=self._watch, name='loop_monitor', daemon=True)
+            watchdog.start()
+
+        while True:
+            start = self._loop.time()
+            await asyncio.sleep(self._lag_probe_interval)
+            EVENT_LOOP_LAG_SECONDS.observe(
+                max(self._loop.time() - start - self._lag_probe_interval, 0),
+                )
+
+    def _beat(self):
+        self._heartbeat = time.monotonic()
+        self._loop.call_later(self._slow_callback_threshold / 2, self._beat)
+
+    def _watch(self):
+        reported_heartbeat = None
+
+        while True:
+            time.sleep(self._slow_callback_threshold / 2)
+            heartbeat = self._heartbeat
+            blocked_for = time.monotonic() - heartbeat
+
+            # Reports every stall only once.
+            if blocked_for > self._slow_callback_threshold and heartbeat != reported_heartbeat:
+                reported_heartbeat = heartbeat
+                self._report_slow_callback(blocked_for)
+
+    def _report_slow_callback(self, blocked_for):
+        task_name = get_task_name(get_current_task(self._loop))
+        frame = sys._current_frames().get(self._loop_thread_id) # pylint: disable=protected-access
+        stack = '' if frame is None else ''.join(traceback.format_stack(frame))
+        SLOW_CALLBACKS.inc(task=task_name)
+        LOGGER.warning(
+            'Event loop is blocked for more than %.3f s by %s:\n%s',
+            blocked_for,
+            task_name,
+            stack,
+            )
@@ -14,7 +14,8 @@ from .errors import UnsupportedContentError
 LOGGER = logging.getLogger('randtalkbot.message')
 
 class Message:
-    COMMAND_RE_PATTERN = re.compile(r'^/([a-z_]+)\b\s*(.*)$')
+    # Args may span several lines, e.g. admin's broadcast.
+    COMMAND_RE_PATTERN = re.compile(r'^/([a-z_]+)\b\s*(.*)$', re.DOTALL)
 
     def __init__(self, message_json):
         try:
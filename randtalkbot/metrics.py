@@ -0,0 +1,303 @@
+# RandTalkBot Bot matching you with a random person on Telegram.
+# Copyright (C) 2016 quasiyoke
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Live metrics in Prometheus text exposition format.
+@see https://prometheus.io/docs/instrumenting/exposition_formats/
+"""
+
+import logging
+import threading
+
+LOGGER = logging.getLogger('randtalkbot.metrics')
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+def escape_label_value(value):
+    return str(value) \
+        .replace('\\', '\\\\') \
+        .replace('"', '\\"') \
+        .replace('\n', '\\n')
+
+def format_labels(labels_names, labels_values, extra_labels=()):
+    labels = list(zip(labels_names, labels_values)) + list(extra_labels)
+
+    if not labels:
+        return ''
+
+    return '{{{}}}'.format(','.join(
+        '{}="{}"'.format(name, escape_label_value(value))
+        for name, value in labels
+        ))
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+
+    def render(self):
+        """Returns:
+            str: All registered metrics in Prometheus text format.
+        """
+        lines = []
+
+        for metric in self._metrics:
+            lines.append('# HELP {} {}'.format(metric.name, metric.help_text))
+            lines.append('# TYPE {} {}'.format(metric.name, metric.TYPE))
+            lines.extend(metric.get_samples())
+
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+class Metric:
+    """Metric's values can be changed from any thread."""
+
+    TYPE = None
+
+    def __init__(self, name, help_text, labels_names=(), registry=REGISTRY):
+        self.name = name
+        self.help_text = help_text
+        self._labels_names = tuple(labels_names)
+        self._values = {}
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def _get_key(self, labels):
+        """Raises:
+            ValueError: If labels don't match metric's labels names.
+
+        Returns:
+            tuple: Labels values in order of metric's labels names.
+        """
+        if set(labels) != set(self._labels_names):
+            raise ValueError(
+                'Metric {} expects labels {}, got {}'.format(self.name, self._labels_names, labels),
+                )
+
+        return tuple(labels[name] for name in self._labels_names)
+
+    def get_samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+
+        for labels_values, value in items:
+            if callable(value):
+                try:
+                    value = value()
+                except Exception: # pylint: disable=broad-except
+                    LOGGER.exception('Can\'t obtain value of metric %s', self.name)
+                    continue
+
+            yield '{}{} {}'.format(
+                self.name,
+                format_labels(self._labels_names, labels_values),
+                format_value(value),
+                )
+
+
+class Counter(Metric):
+    TYPE = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._get_key(labels)
+
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set_function(self, function, **labels):
+        """Makes the counter to obtain its value by calling the function during every rendering.
+        The function should return the total which never decreases, e.g. the count kept by some
+        object.
+        """
+        key = self._get_key(labels)
+
+        with self._lock:
+            self._values[key] = function
+
+
+class Gauge(Metric):
+    TYPE = 'gauge'
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def inc(self, amount=1, **labels):
+        key = self._get_key(labels)
+
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set(self, value, **labels):
+        key = self._get_key(labels)
+
+        with self._lock:
+            self._values[key] = value
+
+    def set_function(self, function, **labels):
+        """Makes the gauge to obtain its value by calling the function during every rendering."""
+        self.set(function, **labels)
+
+
+class Histogram(Metric):
+    TYPE = 'histogram'
+
+    def __init__(self, name, help_text, labels_names=(), buckets=LATENCY_BUCKETS, **kwargs):
+        super(Histogram, self).__init__(name, help_text, labels_names, **kwargs)
+        self._buckets = tuple(buckets) + (float('inf'), )
+
+    def observe(self, value, **labels):
+        key = self._get_key(labels)
+
+        with self._lock:
+            try:
+                counts, total = self._values[key]
+            except KeyError:
+                counts, total = [0] * len(self._buckets), 0
+
+            for i, bucket in enumerate(self._buckets):
+                if value <= bucket:
+                    counts[i] += 1
+                    break
+
+            self._values[key] = (counts, total + value)
+
+    def get_samples(self):
+        with self._lock:
+            items = sorted(
+                (key, (list(counts), total))
+                for key, (counts, total) in self._values.items()
+                )
+
+        for labels_values, (counts, total) in items:
+            cumulative_count = 0
+
+            for bucket, count in zip(self._buckets, counts):
+                cumulative_count += count
+                yield '{}_bucket{} {}'.format(
+                    self.name,
+                    format_labels(
+                        self._labels_names,
+                        labels_values,
+                        extra_labels=(('le', format_value(bucket)), ),
+                        ),
+                    cumulative_count,
+                    )
+
+            labels = format_labels(self._labels_names, labels_values)
+            yield '{}_sum{} {}'.format(self.name, labels, format_value(total))
+            yield '{}_count{} {}'.format(self.name, labels, cumulative_count)
+
+
+BROADCAST_MESSAGES = Counter(
+    'randtalkbot_broadcast_messages_total',
+    'Messages sent to strangers during admin broadcasts by outcome.',
+    ('outcome', ),
+    )
+CACHE_EVICTIONS = Counter(
+    'randtalkbot_cache_evictions_total',
+    'Entries evicted from the cache.',
+    ('cache', ),
+    )
+CACHE_HITS = Counter(
+    'randtalkbot_cache_hits_total',
+    'Lookups which have found the entry in the cache.',
+    ('cache', ),
+    )
+CACHE_MISSES = Counter(
+    'randtalkbot_cache_misses_total',
+    'Lookups which haven\'t found the entry in the cache.',
+    ('cache', ),
+    )
+CACHE_SIZE = Gauge(
+    'randtalkbot_cache_size',
+    'Number of entries in the cache.',
+    ('cache', ),
+    )
+DB_QUERY_SECONDS = Histogram(
+    'randtalkbot_db_query_seconds',
+    'DB queries latency.',
+    )
+EVENT_LOOP_LAG_SECONDS = Histogram(
+    'randtalkbot_event_loop_lag_seconds',
+    'Delays of event loop lag probes.',
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+    )
+INLINE_QUERY_ANSWERS = Counter(
+    'randtalkbot_inline_query_answers_total',
+    'Inline query articles by whether their translation was taken from the cache.',
+    ('cache', ),
+    )
+MESSAGES_RELAYED = Counter(
+    'randtalkbot_messages_relayed_total',
+    'Messages relayed between partners.',
+    ('content_type', ),
+    )
+NOTIFICATIONS_COALESCED = Counter(
+    'randtalkbot_notifications_coalesced_total',
+    'Notifications joined to the previous ones instead of sending separate messages.',
+    )
+RATE_LIMIT_DELAY_SECONDS = Histogram(
+    'randtalkbot_rate_limit_delay_seconds',
+    'Delays of outgoing messages caused by Telegram rate limits pacing.',
+    ('priority', ),
+    )
+SLOW_CALLBACKS = Counter(
+    'randtalkbot_slow_callbacks_total',
+    'Event loop stalls longer than the threshold by blocking task.',
+    ('task', ),
+    )
+STATS_UPDATE_SECONDS = Gauge(
+    'randtalkbot_stats_update_seconds',
+    'Duration of the last stats update.',
+    )
+STRANGERS_WAITING = Gauge(
+    'randtalkbot_strangers_waiting',
+    'Strangers looking for partner.',
+    )
+TALKS_ACTIVE = Gauge(
+    'randtalkbot_talks_active',
+    'Talks which are going on.',
+    )
+TELEGRAM_REQUEST_ERRORS = Counter(
+    'randtalkbot_telegram_request_errors_total',
+    'Failed Bot API requests by method and error code.',
+    ('method', 'code'),
+    )
+TELEGRAM_REQUEST_SECONDS = Histogram(
+    'randtalkbot_telegram_request_seconds',
+    'Latency of Bot API requests by method including failed ones.',
+    ('method', ),
+    )
+TELEGRAM_REQUESTS_IN_FLIGHT = Gauge(
+    'randtalkbot_telegram_requests_in_flight',
+    'Bot API requests which are being performed by method.',
+    ('method', ),
+    )
+TELEGRAM_SEND_RETRIES = Counter(
+    'randtalkbot_telegram_send_retries_total',
+    'Retries of sending messages to strangers through Telegram by reason.',
+    ('reason', ),
+    )
+TELEGRAM_SEND_SECONDS = Histogram(
+    'randtalkbot_telegram_send_seconds',
+    'Latency of sending messages to strangers through Telegram.',
+    ('kind', ),
+    )
+WEBHOOK_UPDATES = Counter(
+    'randtalkbot_webhook_updates_total',
+    'Updates received through the webhook by outcome.',
+    ('outcome', ),
+    )
@@ -0,0 +1,69 @@
+# RandTalkBot Bot matching you with a random person on Telegram.
+# Copyright (C) 2016 quasiyoke
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import logging
+from .metrics import REGISTRY
+
+LOGGER = logging.getLogger('randtalkbot.metrics_server')
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class MetricsServer:
+    """Minimal HTTP listener which serves metrics to Prometheus at `/metrics`. It's meant to be
+    bound to a local address, so it doesn't try to be a complete HTTP server.
+    """
+
+    HOST = '127.0.0.1'
+    REQUEST_TIMEOUT = 10
+
+    def __init__(self, host, port, registry=REGISTRY):
+        self._host = type(self).HOST if host is None else host
+        self._port = port
+        self._registry = registry
+
+    async def run(self):
+        await asyncio.start_server(self._handle_connection, self._host, self._port)
+        LOGGER.info('Serving metrics on %s:%d', self._host, self._port)
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), self.REQUEST_TIMEOUT)
+
+            # Skip headers.
+            while True:
+                header_line = await asyncio.wait_for(reader.readline(), self.REQUEST_TIMEOUT)
+
+                if header_line in (b'\r\n', b'\n', b''):
+                    break
+
+            status, body = self._get_response(request_line)
+            body = body.encode('utf-8')
+            writer.write(
+                'HTTP/1.0 {}\r\nContent-Type: {}\r\nContent-Length: {}\r\n\r\n'
+                .format(status, CONTENT_TYPE, len(body))
+                .encode('ascii')
+                )
+            writer.write(body)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError) as err:
+            LOGGER.debug('Troubles with serving metrics request. %s', err)
+        finally:
+            writer.close()
+
+    def _get_response(self, request_line):
+        try:
+            method, path, unused_version = request_line.decode('ascii').split()
+        except ValueError:
+            # `UnicodeDecodeError` is `ValueError` too.
+            return '400 Bad Request', 'Bad request\n'
+
+        if method != 'GET':
+            return '405 Method Not Allowed', 'Method not allowed\n'
+        elif path.split('?')[0] != '/metrics':
+            return '404 Not Found', 'Not found\n'
+
+        return '200 OK', self._registry.render()
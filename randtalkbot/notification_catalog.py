@@ -0,0 +1,112 @@
+# RandTalkBot Bot matching you with a random person on Telegram.
+# Copyright (C) 2016 quasiyoke
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import re
+import string
+import weakref
+from .cache import Cache
+
+LOGGER = logging.getLogger('randtalkbot.notification_catalog')
+MARKDOWN_RE = re.compile(r'([\[\*_`])')
+NOTIFICATION_PREFIX = '*Rand Talk:* '
+_FORMATTER = string.Formatter()
+
+def escape_markdown(value):
+    """Escapes string to prevent injecting Markdown into notifications.
+    @see https://core.telegram.org/bots/api#using-markdown
+    """
+    return MARKDOWN_RE.sub(r'\\\1', str(value))
+
+
+class NotificationTemplate:
+    """Translated notification compiled into literal chunks and slots for positional arguments.
+    Notification without placeholders is rendered once during compilation.
+    """
+
+    def __init__(self, text):
+        self._text = None
+        self._format = None
+        self._chunks = []
+        auto_index = 0
+
+        for literal, field_name, format_spec, conversion in _FORMATTER.parse(text):
+            if literal:
+                self._chunks.append((literal, None))
+
+            if field_name is None:
+                continue
+            elif field_name == '' and not format_spec and not conversion:
+                self._chunks.append(('', auto_index))
+                auto_index += 1
+            elif field_name.isdigit() and not format_spec and not conversion:
+                self._chunks.append(('', int(field_name)))
+            else:
+                # Complex fields are left to str.format.
+                self._format = text.format
+                return
+
+        if all(slot is None for unused_literal, slot in self._chunks):
+            self._text = ''.join(literal for literal, unused_slot in self._chunks)
+
+    def render(self, args):
+        """Raises:
+            IndexError: If there's not enough args for the template.
+
+        Returns:
+            str: Notification with escaped args.
+        """
+        if self._text is not None:
+            return self._text
+        elif self._format is not None:
+            return self._format(*[escape_markdown(arg) for arg in args])
+
+        return ''.join(
+            literal if slot is None else escape_markdown(args[slot])
+            for literal, slot in self._chunks
+            )
+
+
+class NotificationCatalog:
+    """Templates of notifications translated with the same translation. Templates are compiled
+    on the first usage. Some notifications are composed of already formatted sentences, so
+    templates are kept in the bounded cache to not let such one-off messages pile up.
+    """
+
+    TEMPLATES_CAPACITY = 1000
+    TEMPLATES_TTL = 60 * 60
+
+    def __init__(self, translation, templates_capacity=None, templates_ttl=None):
+        self._translation = translation
+        self._templates = Cache(
+            capacity=type(self).TEMPLATES_CAPACITY
+            if templates_capacity is None else templates_capacity,
+            ttl=type(self).TEMPLATES_TTL if templates_ttl is None else templates_ttl,
+            )
+
+    def render(self, message, args=()):
+        try:
+            template = self._templates[message]
+        except KeyError:
+            template = NotificationTemplate(NOTIFICATION_PREFIX + self._translation(message))
+            self._templates[message] = template
+
+        return template.render(args)
+
+
+def get_notification_catalog(translation):
+    """Catalogs are shared by all senders using the same memoized translation and are dropped
+    together with the translation after translations reload.
+    """
+    try:
+        return CATALOGS[translation]
+    except KeyError:
+        catalog = NotificationCatalog(translation)
+        CATALOGS[translation] = catalog
+        return catalog
+
+
+CATALOGS = weakref.WeakKeyDictionary()
@@ -0,0 +1,159 @@
+# RandTalkBot Bot matching you with a random person on Telegram.
+# Copyright (C) 2016 quasiyoke
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import logging
+import random
+import aiohttp
+from telepot.exception import BadHTTPResponse, TelegramError
+from .errors import TransientSendingError
+from .metrics import TELEGRAM_SEND_RETRIES
+from .rate_limiter import PRIORITY_NOTIFICATION
+
+LOGGER = logging.getLogger('randtalkbot.outbound_queue')
+# telepot reports connection troubles as API error with this description.
+CONNECTION_ERROR_DESCRIPTION = 'Connection Error'
+DEFAULT_RETRY_AFTER = 1
+
+def get_error_code(err):
+    """Returns:
+        str: Error code to label metrics with: HTTP status, `5xx` for any server error or `network`
+            for connection troubles and timeouts.
+    """
+    if isinstance(err, TelegramError):
+        if err.description == CONNECTION_ERROR_DESCRIPTION:
+            return 'network'
+
+        code = err.error_code
+    elif isinstance(err, BadHTTPResponse):
+        code = err.status
+    else:
+        return 'network' if isinstance(err, (aiohttp.ClientError, asyncio.TimeoutError, OSError)) \
+            else 'unknown'
+
+    if not isinstance(code, int):
+        return 'unknown'
+
+    return '5xx' if code >= 500 else str(code)
+
+def get_retry_after(err):
+    """Returns:
+        float: Number of seconds Telegram asks to wait before the next request or `None` if the
+            error isn't caused by flood limits.
+    """
+    if not isinstance(err, TelegramError) or err.error_code != 429:
+        return None
+
+    try:
+        return err.json['parameters']['retry_after']
+    except (KeyError, TypeError):
+        return DEFAULT_RETRY_AFTER
+
+def is_transient_error(err):
+    """Returns:
+        bool: `True` if sending could succeed later. `False` for permanent errors, e.g. if the
+            recipient has blocked the bot or has deactivated the account.
+    """
+    if isinstance(err, TelegramError):
+        return err.description == CONNECTION_ERROR_DESCRIPTION or \
+            (isinstance(err.error_code, int) and err.error_code >= 500)
+    elif isinstance(err, BadHTTPResponse):
+        return isinstance(err.status, int) and err.status >= 500
+
+    return isinstance(err, (aiohttp.ClientError, asyncio.TimeoutError, OSError))
+
+
+class OutboundQueue:
+    """Sends messages to every chat one by one in the order of `send()` calls. Every attempt is
+    paced by the rate limiter. When Telegram asks to slow down, the chat's queue waits for
+    `retry_after`. Transient network and server errors are retried with exponential backoff and
+    full jitter.
+    """
+
+    MAX_ATTEMPTS = 5
+    MAX_RETRY_AFTER = 60
+    RETRY_AFTER_JITTER = 0.5
+    BACKOFF_BASE = 0.5
+    BACKOFF_MAX = 10
+
+    def __init__(self, rate_limiter=None, max_attempts=None):
+        self._rate_limiter = rate_limiter
+        self._max_attempts = type(self).MAX_ATTEMPTS if max_attempts is None else max_attempts
+        # Maps chat IDs to `[lock, users_count]`. asyncio.Lock wakes up waiters in FIFO order.
+        self._chats_locks = {}
+
+    async def send(self, chat_id, send_function, priority=PRIORITY_NOTIFICATION):
+        """Args:
+            send_function (callable): Coroutine function performing the API request.
+
+        Raises:
+            TelegramError: If the message can't be delivered because of permanent error.
+            TransientSendingError: If the message wasn't delivered after all retries.
+
+        Returns:
+            Result of `send_function`.
+        """
+        try:
+            chat_lock = self._chats_locks[chat_id]
+        except KeyError:
+            chat_lock = [asyncio.Lock(), 0]
+            self._chats_locks[chat_id] = chat_lock
+
+        chat_lock[1] += 1
+
+        try:
+            async with chat_lock[0]:
+                return await self._send(chat_id, send_function, priority)
+        finally:
+            chat_lock[1] -= 1
+
+            if not chat_lock[1]:
+                del self._chats_locks[chat_id]
+
+    async def _send(self, chat_id, send_function, priority):
+        attempt = 0
+
+        while True:
+            attempt += 1
+
+            if self._rate_limiter is not None:
+                await self._rate_limiter.acquire(chat_id, priority)
+
+            try:
+                return await send_function()
+            except Exception as err: # pylint: disable=broad-except
+                retry_after = get_retry_after(err)
+
+                if retry_after is None and not is_transient_error(err):
+                    raise
+
+                if attempt >= self._max_attempts or \
+                        (retry_after is not None and retry_after > type(self).MAX_RETRY_AFTER):
+                    raise TransientSendingError(
+                        'Can\'t send to {} after {} attempt(s): {}'.format(chat_id, attempt, err),
+                        getattr(err, 'error_code', None),
+                        getattr(err, 'json', {}),
+                        ) from err
+
+                if retry_after is None:
+                    reason = 'transient'
+                    delay = random.uniform(
+                        0,
+                        min(type(self).BACKOFF_BASE * 2 ** (attempt - 1), type(self).BACKOFF_MAX),
+                        )
+                else:
+                    reason = 'rate_limit'
+                    delay = retry_after + random.uniform(0, type(self).RETRY_AFTER_JITTER)
+
+                TELEGRAM_SEND_RETRIES.inc(reason=reason)
+                LOGGER.info(
+                    'Retrying sending to %d in %.3f s (attempt %d). %s',
+                    chat_id,
+                    delay,
+                    attempt,
+                    err,
+                    )
+                await asyncio.sleep(delay)
@@ -0,0 +1,123 @@
+# RandTalkBot Bot matching you with a random person on Telegram.
+# Copyright (C) 2016 quasiyoke
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import math
+
+class QuantileSketch:
+    """Mergeable sketch of values distribution which estimates quantiles with bounded relative
+    error. Positive values are counted in logarithmic buckets (see DDSketch), so the sketch takes
+    a few hundred counters at most and sketches of several stats intervals are merged by summing
+    their counters. Non-positive values are counted in the separate zero bucket.
+    """
+
+    RELATIVE_ACCURACY = 0.01
+    GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+    LOG_GAMMA = math.log(GAMMA)
+    QUANTILES = (
+        ('p50', 0.5),
+        ('p90', 0.9),
+        ('p99', 0.99),
+        ('p999', 0.999),
+        )
+
+    def __init__(self):
+        self.count = 0
+        self._zero_count = 0
+        self._counts = {}
+
+    @classmethod
+    def from_data(cls, data):
+        """Args:
+            data (dict): Result of `get_data()`.
+
+        Returns:
+            QuantileSketch: Restored sketch.
+        """
+        sketch = cls()
+        sketch.add_to_bucket(None, data['zero_count'])
+
+        for i, count in enumerate(data['counts']):
+            sketch.add_to_bucket(data['offset'] + i, count)
+
+        return sketch
+
+    @classmethod
+    def get_bucket(cls, value):
+        return None if value <= 0 else math.ceil(math.log(value) / cls.LOG_GAMMA)
+
+    def add(self, value):
+        self.add_to_bucket(type(self).get_bucket(value), 1)
+
+    def add_to_bucket(self, bucket, count):
+        """Args:
+            bucket (int): Bucket's index or `None` for the zero bucket.
+            count (int): Number of values to add.
+        """
+        if not count:
+            return
+
+        self.count += count
+
+        if bucket is None:
+            self._zero_count += count
+        else:
+            self._counts[bucket] = self._counts.get(bucket, 0) + count
+
+    def merge(self, other):
+        self.add_to_bucket(None, other._zero_count) # pylint: disable=protected-access
+
+        for bucket, count in other._counts.items(): # pylint: disable=protected-access
+            self.add_to_bucket(bucket, count)
+
+    def get_data(self):
+        """Returns:
+            dict: Compact representation of the sketch suitable for JSON where the counters are
+                listed densely starting from the lowest nonempty bucket.
+        """
+        if self._counts:
+            offset = min(self._counts)
+            counts = [0] * (max(self._counts) - offset + 1)
+
+            for bucket, count in self._counts.items():
+                counts[bucket - offset] = count
+        else:
+            offset = 0
+            counts = []
+
+        return {
+            'counts': counts,
+            'offset': offset,
+            'zero_count': self._zero_count,
+            }
+
+    def get_quantile(self, quantile):
+        """Returns:
+            float: Estimated value of the quantile or `None` if the sketch is empty.
+        """
+        if not self.count:
+            return None
+
+        rank = quantile * (self.count - 1)
+        cumulative_count = self._zero_count
+
+        if cumulative_count > rank:
+            return 0
+
+        gamma = type(self).GAMMA
+
+        for bucket in sorted(self._counts):
+            cumulative_count += self._counts[bucket]
+
+            if cumulative_count > rank:
+                return 2 * gamma ** bucket / (gamma + 1)
+
+        return None
+
+    def get_quantiles(self):
+        return {
+            name: self.get_quantile(quantile)
+            for name, quantile in type(self).QUANTILES
+            }
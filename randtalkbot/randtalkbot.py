@@ -10,13 +10,20 @@ import asyncio
 import logging
 import logging.config
 import os
+import signal
 import sys
 from docopt import docopt
 from .bot import Bot
+from .broadcast_service import BroadcastService
 from .configuration import Configuration, ConfigurationObtainingError
 from .db import DB
-from .errors import DBError
+from .errors import BroadcastServiceError, DBError, StrangerServiceError
+from .i18n import load_translations, reload_translations
+from .loop_monitor import LoopMonitor
+from .metrics_server import MetricsServer
 from .stats_service import StatsService
+from .stranger_service import StrangerService
+from .telegram_session import TelegramSession
 from .utils import __version__
 
 DOC = '''RandTalkBot
@@ -58,13 +65,54 @@ def main():
     else:
         LOGGER.info('Executing RandTalkBot')
         loop = asyncio.get_event_loop()
+        load_translations()
+        # Lets to deploy new translations without restarting the bot.
+        loop.add_signal_handler(signal.SIGHUP, reload_translations)
 
-        stats_service = StatsService()
+        stranger_service = StrangerService(
+            cache_capacity=configuration.strangers_cache_capacity,
+            cache_ttl=configuration.strangers_cache_ttl,
+            )
+
+        try:
+            stranger_service.warm_up()
+        except StrangerServiceError as err:
+            LOGGER.warning('Can\'t warm up strangers cache. %s', err)
+
+        stats_service = StatsService(sex_ratio_smoothing=configuration.sex_ratio_smoothing)
         loop.create_task(stats_service.run())
 
+        telegram_session = TelegramSession(
+            api_url=configuration.telegram_api_url,
+            pool_size=configuration.telegram_pool_size,
+            per_host_limit=configuration.telegram_per_host_limit,
+            keepalive_timeout=configuration.telegram_keepalive_timeout,
+            dns_cache_ttl=configuration.telegram_dns_cache_ttl,
+            connect_timeout=configuration.telegram_connect_timeout,
+            timeout=configuration.telegram_timeout,
+            )
+        telegram_session.install()
+
         bot = Bot(configuration)
         loop.create_task(bot.run())
 
+        try:
+            BroadcastService.get_instance().resume()
+        except BroadcastServiceError as err:
+            LOGGER.warning('Can\'t resume broadcast. %s', err)
+
+        if configuration.metrics_port is not None:
+            metrics_server = MetricsServer(configuration.metrics_host, configuration.metrics_port)
+            loop.create_task(metrics_server.run())
+
+        if configuration.metrics_port is not None or \
+                configuration.slow_callback_threshold is not None:
+            loop_monitor = LoopMonitor(
+                lag_probe_interval=configuration.loop_monitor_interval,
+                slow_callback_threshold=configuration.slow_callback_threshold,
+                )
+            loop.create_task(loop_monitor.run())
+
         try:
             loop.run_forever()
         except KeyboardInterrupt:
@@ -0,0 +1,129 @@
+# RandTalkBot Bot matching you with a random person on Telegram.
+# Copyright (C) 2016 quasiyoke
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import heapq
+import itertools
+import logging
+from .metrics import RATE_LIMIT_DELAY_SECONDS
+
+LOGGER = logging.getLogger('randtalkbot.rate_limiter')
+# Lower values go first.
+PRIORITY_RELAY = 0
+PRIORITY_NOTIFICATION = 1
+PRIORITY_PROMOTION = 2
+PRIORITY_BROADCAST = 3
+PRIORITIES_NAMES = {
+    PRIORITY_RELAY: 'relay',
+    PRIORITY_NOTIFICATION: 'notification',
+    PRIORITY_PROMOTION: 'promotion',
+    PRIORITY_BROADCAST: 'broadcast',
+    }
+
+
+class RateLimiter:
+    """Paces outgoing messages to stay within Telegram limits: about 30 messages per second in
+    total and about 1 message per second in each chat.
+    @see https://core.telegram.org/bots/faq#my-bot-is-hitting-limits-how-do-i-avoid-this
+
+    Messages of every chat are delayed in the order of `acquire()` calls. Then the global bucket
+    tokens are granted to waiting messages according to their priorities: chat relay goes before
+    notifications which go before advertising and bonuses notifications. Admin broadcasts go
+    last.
+    """
+
+    GLOBAL_RATE = 30
+    CHAT_RATE = 1
+    CHAT_BURST = 3
+    # Number of chats after which the chats which are within their limits are forgotten.
+    CHATS_PURGE_THRESHOLD = 10000
+
+    def __init__(self, global_rate=None, chat_rate=None, chat_burst=None):
+        self._global_rate = type(self).GLOBAL_RATE if global_rate is None else global_rate
+        self._global_tokens = self._global_rate
+        self._global_updated = None
+        self._chat_interval = 1 / (type(self).CHAT_RATE if chat_rate is None else chat_rate)
+        chat_burst = type(self).CHAT_BURST if chat_burst is None else chat_burst
+        self._chat_tolerance = (chat_burst - 1) * self._chat_interval
+        # Maps chat IDs to theoretical arrival time of their next message (see GCRA).
+        self._chats_arrival_times = {}
+        self._waiters = []
+        self._waiters_counter = itertools.count()
+        self._dispatching_handle = None
+
+    async def acquire(self, chat_id, priority=PRIORITY_NOTIFICATION):
+        """Waits until a message can be sent to the chat."""
+        loop = asyncio.get_event_loop()
+        start = loop.time()
+        chat_delay = self._reserve_chat(chat_id, start)
+
+        if chat_delay:
+            await asyncio.sleep(chat_delay)
+
+        if self._waiters or not self._take_global_token(loop.time()):
+            future = loop.create_future()
+            heapq.heappush(self._waiters, (priority, next(self._waiters_counter), future))
+            self._schedule_dispatching(loop)
+            await future
+
+        RATE_LIMIT_DELAY_SECONDS.observe(loop.time() - start, priority=PRIORITIES_NAMES[priority])
+
+    def _reserve_chat(self, chat_id, now):
+        """Returns:
+            float: Delay before sending to the chat.
+        """
+        arrival_time = max(self._chats_arrival_times.get(chat_id, now), now)
+        self._chats_arrival_times[chat_id] = arrival_time + self._chat_interval
+
+        if len(self._chats_arrival_times) > type(self).CHATS_PURGE_THRESHOLD:
+            self._chats_arrival_times = {
+                chat_id: arrival_time
+                for chat_id, arrival_time in self._chats_arrival_times.items()
+                if arrival_time > now
+                }
+
+        return max(arrival_time - self._chat_tolerance - now, 0)
+
+    def _refill_global_tokens(self, now):
+        if self._global_updated is not None:
+            self._global_tokens = min(
+                self._global_tokens + (now - self._global_updated) * self._global_rate,
+                self._global_rate,
+                )
+
+        self._global_updated = now
+
+    def _take_global_token(self, now):
+        self._refill_global_tokens(now)
+
+        if self._global_tokens < 1:
+            return False
+
+        self._global_tokens -= 1
+        return True
+
+    def _schedule_dispatching(self, loop):
+        if self._dispatching_handle is not None:
+            return
+
+        self._refill_global_tokens(loop.time())
+        delay = max((1 - self._global_tokens) / self._global_rate, 0)
+        self._dispatching_handle = loop.call_later(delay, self._dispatch, loop)
+
+    def _dispatch(self, loop):
+        self._dispatching_handle = None
+
+        while self._waiters:
+            unused_priority, unused_counter, future = self._waiters[0]
+
+            if future.cancelled():
+                heapq.heappop(self._waiters)
+            elif self._take_global_token(loop.time()):
+                heapq.heappop(self._waiters)
+                future.set_result(None)
+            else:
+                self._schedule_dispatching(loop)
+                break
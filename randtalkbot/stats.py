@@ -4,22 +4,144 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import base64
 import datetime
 import json
 import logging
-from peewee import DateTimeField, Model, Proxy, TextField
+import zlib
+from peewee import CharField, DateTimeField, Model, Proxy, TextField
+from .quantile_sketch import QuantileSketch
 
 LOGGER = logging.getLogger('randtalkbot.stats')
 
 def _(string):
     return string
 
+COMPRESSED_DATA_PREFIX = 'zlib:'
 DATABASE_PROXY = Proxy()
+PERIOD_DAY = 'day'
+PERIOD_INTERVAL = 'interval'
+PERIOD_WEEK = 'week'
+PERIOD_CHOICES = (
+    (PERIOD_DAY, 'day'),
+    (PERIOD_INTERVAL, 'interval'),
+    (PERIOD_WEEK, 'week'),
+    )
+PERIOD_MAX_LENGTH = 8
 RATIO_MAX = 10
+# Rows of the source period older than the age are merged into rows of the target period.
+ROLLUPS = (
+    (PERIOD_INTERVAL, PERIOD_DAY, datetime.timedelta(weeks=1)),
+    (PERIOD_DAY, PERIOD_WEEK, datetime.timedelta(weeks=8)),
+    )
+# Weekly rows older than that are deleted.
+RETENTION = datetime.timedelta(weeks=2 * 52)
+TALKS_STATS_KEYS = ('talks_duration', 'talks_sent', 'talks_waiting')
+
+def decode_data(data_json):
+    if data_json.startswith(COMPRESSED_DATA_PREFIX):
+        data_json = zlib.decompress(base64.b64decode(data_json[len(COMPRESSED_DATA_PREFIX):])) \
+            .decode('utf-8')
+
+    return json.loads(data_json)
+
+def encode_data(data):
+    data_json = json.dumps(data, separators=(',', ':')).encode('utf-8')
+    return COMPRESSED_DATA_PREFIX + base64.b64encode(zlib.compress(data_json, 9)).decode('ascii')
+
+def get_period_start(period, moment):
+    day_start = datetime.datetime.combine(moment.date(), datetime.time())
+
+    if period == PERIOD_DAY:
+        return day_start
+    elif period == PERIOD_WEEK:
+        return day_start - datetime.timedelta(days=moment.weekday())
+    else:
+        raise ValueError('Unknown period: {}'.format(period))
+
+def get_sex_ratio(sex_distribution):
+    """https://en.wikipedia.org/wiki/Human_sex_ratio
+
+    Returns:
+        float: Ratio of males over the females.
+
+    """
+    males_count = sex_distribution.get('male', 0)
+    females_count = sex_distribution.get('female', 0)
+
+    if males_count > 0 and females_count > 0:
+        return males_count / females_count
+    elif males_count > 0:
+        return RATIO_MAX
+    elif females_count > 0:
+        return 1 / RATIO_MAX
+
+    return 1
+
+def merge_talks_stats(talks_stats_list):
+    distribution = {}
+    total = 0
+    count = 0
+    sketch = None
+
+    for talks_stats in talks_stats_list:
+        for interval, interval_count in talks_stats['distribution'].items():
+            distribution[interval] = distribution.get(interval, 0) + interval_count
+
+        total += talks_stats['average'] * talks_stats['count']
+        count += talks_stats['count']
+
+        try:
+            sketch_data = talks_stats['sketch']
+        except KeyError:
+            continue
+
+        if sketch is None:
+            sketch = QuantileSketch()
+
+        sketch.merge(QuantileSketch.from_data(sketch_data))
+
+    merged_talks_stats = {
+        'average': total / count if count else 0,
+        'count': count,
+        'distribution': distribution,
+        }
+
+    if sketch is not None:
+        merged_talks_stats['quantiles'] = sketch.get_quantiles()
+        merged_talks_stats['sketch'] = sketch.get_data()
+
+    return merged_talks_stats
+
+def merge_data(data_list):
+    """Merges data of several consecutive stats. Strangers' part is taken from the latest stats
+    while talks' stats are summed up.
+
+    Args:
+        data_list (list): Stats' data in order of their creation.
+
+    Returns:
+        dict: Merged stats' data.
+    """
+    data = dict(data_list[-1])
+
+    for key in TALKS_STATS_KEYS:
+        data[key] = merge_talks_stats([
+            stats_data[key]
+            for stats_data in data_list
+            if key in stats_data
+            ])
+
+    return data
 
 class Stats(Model):
     data_json = TextField()
     created = DateTimeField(default=datetime.datetime.utcnow, index=True)
+    period = CharField(
+        choices=PERIOD_CHOICES,
+        default=PERIOD_INTERVAL,
+        max_length=PERIOD_MAX_LENGTH,
+        )
 
     class Meta:
         database = DATABASE_PROXY
@@ -28,21 +150,67 @@ class Stats(Model):
         super(Stats, self).__init__(*args, **kwargs)
         self._data_cache = None
 
+    @classmethod
+    def get_latest(cls):
+        """Uses the index on `created`. Rolled up stats are never the latest ones because they're
+        dated by their periods' start.
+
+        Raises:
+            DoesNotExist: If there're no stats.
+
+        Returns:
+            Stats
+        """
+        return cls.select().order_by(cls.created.desc()).get()
+
+    @classmethod
+    def roll_up(cls, now):
+        """Merges old stats into daily and then weekly stats and deletes weekly stats older than
+        the retention period.
+        """
+        for source_period, target_period, age in ROLLUPS:
+            border = get_period_start(target_period, now - age)
+            stats_list = cls.select() \
+                .where((cls.period == source_period) & (cls.created < border)) \
+                .order_by(cls.created)
+            groups = {}
+
+            for stats in stats_list:
+                groups.setdefault(get_period_start(target_period, stats.created), []).append(stats)
+
+            for period_start, group in sorted(groups.items()):
+                with cls._meta.database.atomic():
+                    merged_stats = cls(created=period_start, period=target_period)
+                    merged_stats.set_data(merge_data([stats.get_data() for stats in group]))
+                    merged_stats.save()
+                    cls.delete() \
+                        .where(cls.id << [stats.id for stats in group]) \
+                        .execute()
+
+                LOGGER.debug(
+                    'Stats for %s since %s were rolled up from %d rows',
+                    target_period,
+                    period_start,
+                    len(group),
+                    )
+
+        cls.delete() \
+            .where((cls.period == PERIOD_WEEK) & (cls.created < now - RETENTION)) \
+            .execute()
+
     def get_data(self):
         if self._data_cache is None:
-            self._data_cache = json.loads(self.data_json)
+            self._data_cache = decode_data(self.data_json)
 
         return self._data_cache
 
     def set_data(self, data):
         self._data_cache = data
-        self.data_json = json.dumps(data)
+        self.data_json = encode_data(data)
 
     def get_sex_ratio(self):
-        """https://en.wikipedia.org/wiki/Human_sex_ratio
-
-        Returns:
-            float: Ratio of males over the females.
+        """Returns:
+            float: Ratio of males over the females. See `get_sex_ratio()`.
 
         """
         try:
@@ -50,14 +218,4 @@ class Stats(Model):
         except (KeyError, TypeError):
             return 1
 
-        males_count = sex_data.get('male', 0)
-        females_count = sex_data.get('female', 0)
-
-        if males_count > 0 and females_count > 0:
-            return males_count / females_count
-        elif males_count > 0:
-            return RATIO_MAX
-        elif females_count > 0:
-            return 1 / RATIO_MAX
-
-        return 1
+        return get_sex_ratio(sex_data)
@@ -5,14 +5,23 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import asyncio
+from concurrent.futures import ThreadPoolExecutor
 import datetime
 import logging
-from peewee import DoesNotExist
+import math
+import time
+from peewee import DoesNotExist, fn, MySQLDatabase, SQL
+from playhouse.shortcuts import case
 from .errors import StrangerSenderServiceError
-from .stats import Stats
+from .metrics import STATS_UPDATE_SECONDS
+from .quantile_sketch import QuantileSketch
+from .stats import get_sex_ratio, Stats
+from .strangers_stats import StrangersStats
 
 COUNT_INTERVALS = (4, 16, 64, 256)
+DURATION_INTERVALS = (10, 60, 60 * 5, 60 * 30, )
 LOGGER = logging.getLogger('randtalkbot.stats_service')
+WAITING_INTERVALS = (10, 60, 60 * 5, 60 * 30, 60 * 60 * 3, )
 
 def get_talks_stats(talks, get_value, intervals):
     distribution = {interval: 0 for interval in intervals}
@@ -36,11 +45,90 @@ def get_talks_stats(talks, get_value, intervals):
         'count': count,
         }
 
-def increment(dictionary, key):
+def get_talks_stats_in_db(talks, value, intervals):
+    """Does the same as `get_talks_stats()` but aggregates talks in the DB using single query.
+
+    Args:
+        talks (SelectQuery): Talks to aggregate.
+        value (Expression): SQL expression evaluating talk's value.
+        intervals (tuple): Distribution's intervals.
+
+    Returns:
+        dict: Talks' stats in the same format as `get_talks_stats()` returns.
+    """
+    buckets = {str(interval): interval for interval in intervals}
+    buckets['more'] = 'more'
+    bucket = case(
+        None,
+        [(value <= interval, str(interval)) for interval in intervals],
+        'more',
+        )
+    distribution = {interval: 0 for interval in intervals}
+    distribution['more'] = 0
+    total = 0
+    count = 0
+    rows = talks \
+        .select(bucket.alias('bucket'), fn.COUNT(SQL('*')), fn.SUM(value)) \
+        .group_by(SQL('bucket')) \
+        .tuples()
+
+    for bucket_name, bucket_count, bucket_total in rows:
+        distribution[buckets[bucket_name]] = bucket_count
+        total += int(bucket_total)
+        count += bucket_count
+
     try:
-        dictionary[key] += 1
-    except KeyError:
-        dictionary[key] = 1
+        average = total / count
+    except ZeroDivisionError:
+        average = 0
+    return {
+        'distribution': distribution,
+        'average': average,
+        'count': count,
+        }
+
+def get_talks_sketch(talks, get_value):
+    sketch = QuantileSketch()
+
+    for talk in talks:
+        sketch.add(get_value(talk))
+
+    return sketch
+
+def get_talks_sketch_in_db(talks, value):
+    """Does the same as `get_talks_sketch()` but counts talks in sketch's buckets in the DB."""
+    bucket = case(
+        None,
+        [(value <= 0, None)],
+        fn.CEIL(fn.LN(value) / QuantileSketch.LOG_GAMMA),
+        )
+    rows = talks \
+        .select(bucket.alias('bucket'), fn.COUNT(SQL('*'))) \
+        .group_by(SQL('bucket')) \
+        .tuples()
+    sketch = QuantileSketch()
+
+    for bucket_index, bucket_count in rows:
+        sketch.add_to_bucket(None if bucket_index is None else int(bucket_index), bucket_count)
+
+    return sketch
+
+def is_aggregation_in_db_supported(model):
+    """Talks' durations are computed using MySQL-specific `TIMESTAMPDIFF()`, so other DBs (e.g.
+    SQLite in tests) fall back to aggregation in Python.
+    """
+    database = model._meta.database # pylint: disable=protected-access
+    return isinstance(getattr(database, 'obj', database), MySQLDatabase)
+
+def begin_consistent_snapshot(model):
+    """Starts the transaction on the current thread's connection whose reads see the DB as it was
+    at this moment. SQLite (in tests) runs the worker's queries one at a time anyway, so it's
+    supported on MySQL only.
+    """
+    database = model._meta.database # pylint: disable=protected-access
+
+    if isinstance(getattr(database, 'obj', database), MySQLDatabase):
+        database.execute_sql('START TRANSACTION WITH CONSISTENT SNAPSHOT', require_commit=False)
 
 def increment_distribution(dictionary, value, intervals):
     for interval in intervals:
@@ -51,19 +139,34 @@ def increment_distribution(dictionary, value, intervals):
 
     dictionary[interval] += 1
 
-def first(iterable):
-    return iterable[0]
-
-def second(iterable):
-    return iterable[1]
-
 class StatsService:
     INTERVAL = datetime.timedelta(hours=4)
+    RECONCILIATION_INTERVAL = datetime.timedelta(days=1)
 
-    def __init__(self):
+    def __init__(self, sex_ratio_smoothing=None):
+        """Args:
+            sex_ratio_smoothing (float): Time constant in seconds of exponential smoothing of live
+                sex ratio. Smoothing is disabled if it isn't specified.
+        """
         type(self)._instance = self
+        self._sex_ratio_smoothing = sex_ratio_smoothing
+        self._smoothed_sex_ratio = None
+        self._smoothed_sex_ratio_updated = None
+        # Strangers' stats are maintained incrementally and are reconciled with the DB
+        # occasionally. They're obtained from the DB for the first time during the first stats
+        # update.
+        self._strangers_stats = None
+        self._strangers_stats_reconciled = None
+        # Changes made after the snapshot of the DB which strangers' stats are being obtained
+        # from. They're applied to the obtained stats. Changes made before the snapshot are
+        # already there, so it's `None` when there's no reconciliation.
+        self._strangers_changes = None
+        # Stats are computed in the single worker thread which has its own DB connection because
+        # peewee keeps connections thread-local.
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='stats')
+
         try:
-            self._stats = Stats.select().order_by(Stats.created.desc()).get()
+            self._stats = Stats.get_latest()
         except DoesNotExist:
             self._stats = None
             self._update_stats()
@@ -75,10 +178,66 @@ class StatsService:
         except AttributeError:
             raise RuntimeError('StatsService was not initialized')
 
+    def get_sex_ratio(self):
+        """Obtains live sex ratio of full strangers from strangers' stats maintained incrementally.
+        Falls back to the latest stats until strangers' stats are obtained from the DB.
+
+        Returns:
+            float: Ratio of males over the females.
+        """
+        if self._strangers_stats is None:
+            return self._stats.get_sex_ratio()
+
+        if self._sex_ratio_smoothing:
+            self._smooth_sex_ratio()
+            return self._smoothed_sex_ratio
+
+        return get_sex_ratio(self._strangers_stats.get_sex_distribution())
+
     def get_stats(self):
         return self._stats
 
+    def update_stranger_stats(self, old_profile, new_profile):
+        """Updates strangers' stats when some stranger was created or changed her parameters.
+
+        Args:
+            old_profile (tuple): Stranger's profile before the change. See
+                `Stranger.get_stats_profile()`.
+            new_profile (tuple): Stranger's profile after the change.
+        """
+        if old_profile == new_profile:
+            return
+
+        if self._strangers_changes is not None:
+            self._strangers_changes.append((old_profile, new_profile))
+
+        if self._strangers_stats is not None:
+            if self._sex_ratio_smoothing:
+                self._smooth_sex_ratio()
+
+            self._strangers_stats.update(old_profile, new_profile)
+
+    def _smooth_sex_ratio(self):
+        """Moves smoothed sex ratio towards the ratio which was actual since the previous call.
+        Should be called before every change of strangers' stats.
+        """
+        sex_ratio = get_sex_ratio(self._strangers_stats.get_sex_distribution())
+        now = time.monotonic()
+
+        if self._smoothed_sex_ratio is None:
+            self._smoothed_sex_ratio = sex_ratio
+        else:
+            elapsed = now - self._smoothed_sex_ratio_updated
+            weight = 1 - math.exp(-elapsed / self._sex_ratio_smoothing)
+            self._smoothed_sex_ratio += weight * (sex_ratio - self._smoothed_sex_ratio)
+
+        self._smoothed_sex_ratio_updated = now
+
     async def run(self):
+        if self._strangers_stats is None:
+            # Live stats are needed right after the start.
+            await self._reconcile_strangers_stats_in_thread()
+
         while True:
             next_stats_time = self._stats.created + type(self).INTERVAL
             now = datetime.datetime.utcnow()
@@ -86,110 +245,211 @@ class StatsService:
             if next_stats_time > now:
                 await asyncio.sleep((next_stats_time - now).total_seconds())
 
-            self._update_stats()
+            await self._update_stats_in_thread()
 
-    def _update_stats(self):
-        from .stranger_service import StrangerService
-        from .stranger_sender_service import StrangerSenderService
+    def _compute_stats(self, previous_stats, strangers_data):
+        """Computes and saves new stats. Doesn't touch the service's state, so it can be executed
+        in the worker thread.
+
+        Args:
+            previous_stats (Stats): Last stats. Talks are counted since their creation.
+            strangers_data (dict): Strangers' part of stats' data. If `None`, strangers' stats are
+                reconciled with the DB.
+
+        Returns:
+            tuple: `(stats, strangers_stats)` where `strangers_stats` is `None` if they weren't
+                reconciled.
+        """
         from .talk import Talk
         stats = Stats()
-        stranger_service = StrangerService.get_instance()
-
-        sex_distribution = {}
-        partner_sex_distribution = {}
-        languages_count_distribution = {}
-        languages_popularity = {}
-        total_count = 0
-
-        for stranger in stranger_service.get_full_strangers():
-            total_count += 1
-            increment(sex_distribution, stranger.sex)
-            increment(partner_sex_distribution, stranger.partner_sex)
-            increment(languages_count_distribution, len(stranger.get_languages()))
-
-            for language in stranger.get_languages():
-                increment(languages_popularity, language)
-
-        langs_count_distribution_items = list(languages_count_distribution.items())
-        langs_count_distribution_items.sort(key=first)
-        valuable_count = total_count / 100
-        languages_popularity_items = [
-            (language, popularity)
-            for language, popularity in languages_popularity.items() if popularity >= valuable_count
-            ]
-        languages_popularity_items.sort(key=second, reverse=True)
-
-        languages_to_orientation = {
-            language: {}
-            for language, popularity in languages_popularity_items
-            }
-
-        for stranger in stranger_service.get_full_strangers():
-            orientation = '{} {}'.format(stranger.sex, stranger.partner_sex)
-
-            for language in stranger.get_languages():
-                try:
-                    orientation_distribution = languages_to_orientation[language]
-                except KeyError:
-                    continue
-
-                increment(orientation_distribution, orientation)
-
-        languages_to_orientation_items = [
-            (language, languages_to_orientation[language])
-            for language, popularity in languages_popularity_items
-            ]
-
-        talks_waiting = get_talks_stats(
-            Talk.get_not_ended_talks(after=None if self._stats is None else self._stats.created),
-            lambda talk: (talk.begin - talk.searched_since).total_seconds(),
-            (10, 60, 60 * 5, 60 * 30, 60 * 60 * 3, ),
-            )
 
-        ended_talks = Talk.get_ended_talks(
-            after=None if self._stats is None else self._stats.created,
-            )
-        talks_duration = get_talks_stats(
-            ended_talks,
-            lambda talk: (talk.end - talk.begin).total_seconds(),
-            (10, 60, 60 * 5, 60 * 30, ),
-            )
-        talks_sent = get_talks_stats(
-            ended_talks,
-            lambda talk: talk.partner1_sent + talk.partner2_sent,
-            COUNT_INTERVALS,
-            )
+        if strangers_data is None:
+            strangers_stats = self._obtain_strangers_stats()
+            strangers_data = strangers_stats.get_data()
+        else:
+            strangers_stats = None
+
+        after = None if previous_stats is None else previous_stats.created
+        not_ended_talks = Talk.get_not_ended_talks(after=after)
+        ended_talks = Talk.get_ended_talks(after=after)
+
+        if is_aggregation_in_db_supported(Talk):
+            waiting = fn.TIMESTAMPDIFF(SQL('SECOND'), Talk.searched_since, Talk.begin)
+            talks_waiting = get_talks_stats_in_db(not_ended_talks, waiting, WAITING_INTERVALS)
+            waiting_sketch = get_talks_sketch_in_db(not_ended_talks, waiting)
+            duration = fn.TIMESTAMPDIFF(SQL('SECOND'), Talk.begin, Talk.end)
+            talks_duration = get_talks_stats_in_db(ended_talks, duration, DURATION_INTERVALS)
+            duration_sketch = get_talks_sketch_in_db(ended_talks, duration)
+            talks_sent = get_talks_stats_in_db(
+                ended_talks,
+                Talk.partner1_sent + Talk.partner2_sent,
+                COUNT_INTERVALS,
+                )
+        else:
+            def get_waiting(talk):
+                return (talk.begin - talk.searched_since).total_seconds()
+
+            talks_waiting = get_talks_stats(not_ended_talks, get_waiting, WAITING_INTERVALS)
+            waiting_sketch = get_talks_sketch(not_ended_talks, get_waiting)
+
+            def get_duration(talk):
+                return (talk.end - talk.begin).total_seconds()
+
+            talks_duration = get_talks_stats(ended_talks, get_duration, DURATION_INTERVALS)
+            duration_sketch = get_talks_sketch(ended_talks, get_duration)
+            talks_sent = get_talks_stats(
+                ended_talks,
+                lambda talk: talk.partner1_sent + talk.partner2_sent,
+                COUNT_INTERVALS,
+                )
 
-        if self._stats is not None:
-            Talk.delete_old(before=self._stats.created)
+        if previous_stats is not None:
+            Talk.delete_old(before=previous_stats.created)
 
-        stats_json = {
-            'languages_count_distribution': langs_count_distribution_items,
-            'languages_popularity': languages_popularity_items,
-            'languages_to_orientation': languages_to_orientation_items,
-            'partner_sex_distribution': partner_sex_distribution,
-            'sex_distribution': sex_distribution,
-            'total_count': total_count,
+        # Sketches are stored to estimate quantiles over longer periods by merging them.
+        talks_waiting['quantiles'] = waiting_sketch.get_quantiles()
+        talks_waiting['sketch'] = waiting_sketch.get_data()
+        talks_duration['quantiles'] = duration_sketch.get_quantiles()
+        talks_duration['sketch'] = duration_sketch.get_data()
+        stats_json = dict(strangers_data)
+        stats_json.update({
             'talks_duration': talks_duration,
             'talks_sent': talks_sent,
             'talks_waiting': talks_waiting,
-            }
+            })
         stats.set_data(stats_json)
         stats.save()
+        Stats.roll_up(stats.created)
+        return stats, strangers_stats
+
+    @classmethod
+    def _obtain_strangers_stats(cls):
+        from .stranger_service import StrangerService
+        return StrangersStats.from_profiles(
+            StrangerService.get_instance().get_full_strangers_profiles(),
+            )
+
+    def _obtain_strangers_stats_in_thread(self):
+        try:
+            return self._obtain_strangers_stats()
+        finally:
+            # Closes the connection of the worker thread if it was opened.
+            database = Stats._meta.database # pylint: disable=protected-access
+
+            if not database.is_closed():
+                database.close()
+
+    def _begin_strangers_changes_buffering(self):
+        """Takes the snapshot of the DB in the worker thread and buffers strangers' changes made
+        after it. The loop is blocked until the snapshot is taken, so every change saved on the
+        loop is either seen by the worker or is buffered, but not both.
+        """
+        self._executor.submit(begin_consistent_snapshot, Stats).result()
+        self._strangers_changes = []
+
+    async def _reconcile_strangers_stats_in_thread(self):
+        self._begin_strangers_changes_buffering()
+
+        try:
+            strangers_stats = await asyncio.get_event_loop().run_in_executor(
+                self._executor,
+                self._obtain_strangers_stats_in_thread,
+                )
+            self._set_strangers_stats(strangers_stats)
+        finally:
+            self._strangers_changes = None
+
+    def _set_strangers_stats(self, strangers_stats):
+        if self._sex_ratio_smoothing and self._strangers_stats is not None:
+            self._smooth_sex_ratio()
+
+        for old_profile, new_profile in self._strangers_changes or ():
+            strangers_stats.update(old_profile, new_profile)
+
+        self._strangers_changes = None
+        self._strangers_stats = strangers_stats
+        self._strangers_stats_reconciled = datetime.datetime.utcnow()
+        LOGGER.info('Strangers\' stats were reconciled')
+
+    def _compute_stats_in_thread(self, previous_stats, strangers_data):
+        try:
+            return self._compute_stats(previous_stats, strangers_data)
+        finally:
+            # Closes the connection of the worker thread if it was opened.
+            database = Stats._meta.database # pylint: disable=protected-access
+
+            if not database.is_closed():
+                database.close()
+
+    def _get_strangers_data(self):
+        """Returns:
+            dict: Snapshot of strangers' part of stats' data or `None` if strangers' stats should be
+                reconciled with the DB.
+        """
+        if self._strangers_stats is None or \
+                self._strangers_stats_reconciled + type(self).RECONCILIATION_INTERVAL <= \
+                datetime.datetime.utcnow():
+            return None
+
+        return self._strangers_stats.get_data()
+
+    def _publish_stats(self, stats, strangers_stats, duration):
+        from .stranger_service import StrangerService
+        from .stranger_sender_service import StrangerSenderService
+
+        if strangers_stats is not None:
+            self._set_strangers_stats(strangers_stats)
+
         self._stats = stats
-        LOGGER.info('Stats were updated')
+        STATS_UPDATE_SECONDS.set(duration)
+        LOGGER.info('Stats were updated in %.3f s', duration)
         LOGGER.debug(
             'StrangerService cache size: %d',
             StrangerService.get_instance().get_cache_size(),
             )
+        LOGGER.debug(
+            'StrangerService cache stats: %s',
+            StrangerService.get_instance().get_cache_stats(),
+            )
 
         try:
             LOGGER.debug(
                 'StrangerSenderService cache size: %d',
                 StrangerSenderService.get_instance().get_cache_size(),
                 )
+            LOGGER.debug(
+                'StrangerSenderService cache stats: %s',
+                StrangerSenderService.get_instance().get_cache_stats(),
+                )
         except StrangerSenderServiceError:
             LOGGER.debug(
                 'StrangerSenderService isn\'t initialized and can\'t provide '
                 'its cache size.'
                 )
+
+    def _update_stats(self):
+        """Updates stats blocking the caller. Is used at startup when the loop isn't running yet."""
+        start = time.monotonic()
+        stats, strangers_stats = self._compute_stats(self._stats, self._get_strangers_data())
+        self._publish_stats(stats, strangers_stats, time.monotonic() - start)
+
+    async def _update_stats_in_thread(self):
+        """Updates stats in the worker thread not to block the loop. Stats are published back
+        on the loop when they are ready, so handlers never see partially updated stats.
+        """
+        start = time.monotonic()
+        strangers_data = self._get_strangers_data()
+
+        if strangers_data is None:
+            self._begin_strangers_changes_buffering()
+
+        try:
+            stats, strangers_stats = await asyncio.get_event_loop().run_in_executor(
+                self._executor,
+                self._compute_stats_in_thread,
+                self._stats,
+                strangers_data,
+                )
+            self._publish_stats(stats, strangers_stats, time.monotonic() - start)
+        finally:
+            self._strangers_changes = None
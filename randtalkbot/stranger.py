@@ -7,6 +7,7 @@
 import asyncio
 import base64
 import datetime
+import functools
 import json
 import logging
 import random
@@ -14,8 +15,10 @@ import string
 from peewee import CharField, DateTimeField, ForeignKeyField, IntegerField, Model, Proxy
 from telepot.exception import TelegramError
 from .errors import EmptyLanguagesError, MissingPartnerError, SexError, StrangerError, \
-    StrangerSenderError
+    StrangerSenderError, StrangerServiceError, TransientSendingError
 from .i18n import get_languages_names, get_translations
+from .metrics import MESSAGES_RELAYED
+from .rate_limiter import PRIORITY_PROMOTION
 from .stats_service import StatsService
 from .stranger_sender_service import StrangerSenderService
 
@@ -28,7 +31,20 @@ def _(string_instance):
     return string_instance
 
 
+def get_languages(languages_json):
+    try:
+        return json.loads(languages_json)
+    except ValueError:
+        # If languages field was corrupted, return default language.
+        return ['en']
+    except TypeError:
+        # If languages field wasn't set.
+        return []
+
+
+@functools.lru_cache(maxsize=None)
 def get_sex_names_to_codes():
+    """Is built on the first lookup to not load all translations during the module import."""
     sex_names_to_codes = {}
 
     for translation in get_translations():
@@ -57,7 +73,6 @@ ADDITIONAL_SEX_NAMES_TO_CODES = {
     'women': 'female',
 }
 SEX_MAX_LENGTH = 20
-SEX_NAMES_TO_CODES = get_sex_names_to_codes()
 SEX_NAMES = list(zip(*SEX_CHOICES))[1]
 WIZARD_CHOICES = (
     ('none', 'None'),
@@ -101,7 +116,7 @@ class Stranger(Model):
     def _get_sex_code(cls, sex_name):
         sex = sex_name.strip().lower()
         try:
-            return SEX_NAMES_TO_CODES[sex]
+            return get_sex_names_to_codes()[sex]
         except KeyError:
             raise SexError(sex_name)
 
@@ -125,7 +140,7 @@ class Stranger(Model):
             # Let's not advertise if there's nobody to talk with.
             return
 
-        if StatsService.get_instance().get_stats().get_sex_ratio() >= 1:
+        if StatsService.get_instance().get_sex_ratio() >= 1:
             message = _(
                 'The search is going on. {0} users are looking for partner -- change'
                 ' your preferences (languages, partner\'s sex) using /setup command to talk'
@@ -147,24 +162,28 @@ class Stranger(Model):
         sender = self.get_sender()
 
         try:
-            await sender.send_notification(
-                message,
-                searching_for_partner_count,
-                type(self).REWARD_BIG,
-                type(self).REWARD_SMALL,
-                disable_notification=True,
-                )
-            await sender.send_notification(
-                _(
-                    'Do you want to talk with somebody, practice in foreign languages or you'
-                    ' just want to have some fun? Rand Talk will help you!'
-                    ' It\'s a bot matching you with a random stranger of desired sex'
-                    ' speaking on your language. {0}',
-                    ),
-                self.get_invitation_link(),
-                disable_notification=True,
-                disable_web_page_preview=True,
-                )
+            async with sender.coalescing():
+                await sender.send_notification(
+                    message,
+                    searching_for_partner_count,
+                    type(self).REWARD_BIG,
+                    type(self).REWARD_SMALL,
+                    disable_notification=True,
+                    priority=PRIORITY_PROMOTION,
+                    disable_web_page_preview=True,
+                    )
+                await sender.send_notification(
+                    _(
+                        'Do you want to talk with somebody, practice in foreign languages or you'
+                        ' just want to have some fun? Rand Talk will help you!'
+                        ' It\'s a bot matching you with a random stranger of desired sex'
+                        ' speaking on your language. {0}',
+                        ),
+                    self.get_invitation_link(),
+                    disable_notification=True,
+                    priority=PRIORITY_PROMOTION,
+                    disable_web_page_preview=True,
+                    )
         except TelegramError as err:
             LOGGER.warning('Advertise. Can\'t notify the stranger. %s', err)
 
@@ -199,14 +218,7 @@ class Stranger(Model):
         return f'https://telegram.me/RandTalkBot?start={start_args}'
 
     def get_languages(self):
-        try:
-            return json.loads(self.languages)
-        except ValueError:
-            # If languages field was corrupted, return default language.
-            return ['en']
-        except TypeError:
-            # If languages field wasn't set.
-            return []
+        return get_languages(self.languages)
 
     def get_partner(self):
         try:
@@ -228,6 +240,16 @@ class Stranger(Model):
         serialized_args = base64.urlsafe_b64encode(serialized_args.encode('utf-8'))
         return serialized_args.decode('utf-8')
 
+    def get_stats_profile(self):
+        """Returns:
+            tuple: Sex, partner's sex and languages of full stranger which are counted in stats or
+                `None` if the stranger isn't full.
+        """
+        if not self.is_full():
+            return None
+
+        return (self.sex, self.partner_sex, tuple(self.get_languages()))
+
     def get_talk(self):
         try:
             return self._talk
@@ -237,6 +259,24 @@ class Stranger(Model):
             self._talk = Talk.get_talk(self)
             return self._talk
 
+    def has_talk_loaded(self):
+        return hasattr(self, '_talk')
+
+    def is_active(self):
+        """Returns:
+            bool: `True` if the stranger is talking, looking for partner, passing some wizard
+                or has deferred jobs, so her instance should be kept in memory.
+        """
+        return getattr(self, '_partner', None) is not None or \
+            self.looking_for_partner_from is not None or \
+            self.wizard != 'none' or \
+            getattr(self, '_deferred_advertising', None) is not None or \
+            getattr(self, '_bonuses_notifications_muted', False)
+
+    def is_talking(self):
+        """Tells if the stranger's partner is loaded. Doesn't query the DB."""
+        return getattr(self, '_partner', None) is not None
+
     def is_novice(self):
         return self.languages is None and \
             self.sex is None and \
@@ -282,6 +322,7 @@ class Stranger(Model):
                         'To mute this notifications, use /mute\\_bonuses.'
                         ),
                     self.bonus_count,
+                    priority=PRIORITY_PROMOTION,
                     )
             elif bonuses_delta > 1:
                 await sender.send_notification(
@@ -293,6 +334,7 @@ class Stranger(Model):
                         ),
                     bonuses_delta,
                     self.bonus_count,
+                    priority=PRIORITY_PROMOTION,
                     )
         except TelegramError as err:
             LOGGER.info('Can\'t notify stranger %d about bonuses: %s', self.id, err)
@@ -331,6 +373,7 @@ class Stranger(Model):
     async def notify_partner_found(self, partner):
         """Raises:
             StrangerError: If stranger we're changing has blocked the bot.
+            TransientSendingError: If the stranger can't be notified now.
         """
         self.prevent_advertising()
         sender = self.get_sender()
@@ -393,6 +436,8 @@ class Stranger(Model):
 
         try:
             await sender.send_notification(' '.join(sentences))
+        except TransientSendingError:
+            raise
         except TelegramError as err:
             raise StrangerError(f'Can\'t notify stranger {self.id}') from err
         finally:
@@ -442,17 +487,27 @@ class Stranger(Model):
             return
 
         LOGGER.debug('Rewarding inviter of %d', self.id)
-        self.was_invited_as = self.sex
-        self.save()
-        sex_ratio = StatsService.get_instance().get_stats().get_sex_ratio()
+        from .stranger_service import StrangerService
+
+        try:
+            inviter = StrangerService.get_instance().get_inviter(self)
+        except StrangerServiceError as err:
+            LOGGER.warning('Can\'t reward inviter of %d: %s', self.id, err)
+            return
+
+        sex_ratio = StatsService.get_instance().get_sex_ratio()
 
         if (self.sex == 'female' and sex_ratio >= 1) or (self.sex == 'male' and sex_ratio < 1):
             reward = type(self).REWARD_BIG
         else:
             reward = type(self).REWARD_SMALL
 
-        # pylint: disable=no-member,protected-access
-        await self.invited_by._add_bonuses(reward)
+        # pylint: disable=protected-access
+        await inviter._add_bonuses(reward)
+        # Stranger is marked as invited only after the bonuses were granted to let the inviter be
+        # rewarded later if something went wrong.
+        self.was_invited_as = self.sex
+        self.save()
 
     async def send(self, message):
         """Raises:
@@ -482,9 +537,17 @@ class Stranger(Model):
         except:
             raise
         else:
+            MESSAGES_RELAYED.inc(content_type=message.type)
             self.get_talk().increment_sent(self)
             await self._reward_inviter()
 
+    def set_loaded_talk(self, talk, partner):
+        """Sets current talk and partner which were obtained beforehand to not query them later."""
+        # pylint: disable=attribute-defined-outside-init
+        self._talk = talk
+        # pylint: disable=attribute-defined-outside-init
+        self._partner = partner
+
     def set_languages(self, languages):
         """Raises:
             EmptyLanguagesError: If no languages were specified.
@@ -513,6 +576,13 @@ class Stranger(Model):
             await self.get_sender().send_notification(
                 _('Looking for a stranger for you.'),
                 )
+        except TransientSendingError as err:
+            # The stranger hasn't blocked the bot, so the search goes on.
+            LOGGER.warning(
+                'Set looking for partner. Can\'t notify stranger %d now. %s',
+                self.id,
+                err,
+                )
         except TelegramError as err:
             LOGGER.debug(
                 'Set looking for partner. Can\'t notify stranger. %s',
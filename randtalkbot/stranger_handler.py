@@ -10,8 +10,8 @@ import sys
 import telepot
 import telepot.aio
 from telepot.exception import TelegramError
-from .errors import MissingPartnerError, PartnerObtainingError, \
-    StrangerError, StrangerServiceError, UnknownCommandError, UnsupportedContentError
+from .errors import MissingPartnerError, PartnerObtainingError, StrangerError, \
+    StrangerServiceError, TransientSendingError, UnknownCommandError, UnsupportedContentError
 from .message import Message
 from .stranger_sender_service import StrangerSenderService
 from .stranger_service import StrangerService
@@ -29,6 +29,8 @@ class StrangerHandler(telepot.aio.helper.UserHandler):
     HOUR_TIMEDELTA = datetime.timedelta(hours=1)
     LONG_WAITING_TIMEDELTA = datetime.timedelta(minutes=10)
     COORDINATOR_CLASS = telepot.aio.helper.CallbackQueryCoordinator
+    # Invitation article doesn't depend on the query, so Telegram may reuse answers for a while.
+    INLINE_QUERY_CACHE_TIME = 15 * 60
 
     def __init__(self, seed_tuple, *args, **kwargs):
         super(StrangerHandler, self).__init__(seed_tuple, *args, **kwargs)
@@ -111,12 +113,18 @@ class StrangerHandler(telepot.aio.helper.UserHandler):
     async def _handle_command_setup(self, unused_message):
         LOGGER.debug('/setup: %d', self._stranger.id)
         self._stranger.prevent_advertising()
-        await self._stranger.end_talk()
-        await self._stranger_setup_wizard.activate()
+
+        try:
+            async with self._sender.coalescing():
+                await self._stranger.end_talk()
+                await self._stranger_setup_wizard.activate()
+        except TelegramError as err:
+            LOGGER.warning('Handle /setup command. Can\'t notify stranger. %s', err)
 
     async def _handle_command_start(self, message):
         LOGGER.debug('/start: %d', self._stranger.id)
-        if message.command_args and not self._stranger.invited_by:
+        # Inviter is loaded only to be rewarded, so just its ID is checked here.
+        if message.command_args and self._stranger.invited_by_id is None:
             try:
                 command_args = message.decode_command_args()
             except UnsupportedContentError as err:
@@ -147,17 +155,16 @@ class StrangerHandler(telepot.aio.helper.UserHandler):
                                 err,
                                 )
                     else:
+                        stranger_service = StrangerService.get_instance()
+
                         try:
-                            invited_by = StrangerService.get_instance() \
-                                .get_stranger_by_invitation(invitation)
+                            invited_by = stranger_service.get_stranger_by_invitation(invitation)
+                            stranger_service.set_inviter(self._stranger, invited_by)
                         except StrangerServiceError as err:
                             LOGGER.info(
-                                '/start error. Can\'t obtain stranger who did invite: %s',
+                                '/start error. Can\'t set stranger who did invite: %s',
                                 err,
                                 )
-                        else:
-                            self._stranger.invited_by = invited_by
-                            self._stranger.save()
         if self._stranger.wizard == 'none':
             try:
                 await self._sender.send_notification(
@@ -174,12 +181,27 @@ class StrangerHandler(telepot.aio.helper.UserHandler):
     async def on_close(self, error):
         pass
 
+    def _refresh_stranger(self):
+        """Stranger who isn't searching, talking or setting up may be evicted from strangers' cache
+        while the handler is alive. Puts the stranger back to the cache or switches to the cached
+        instance, so matching and the handler change the same one.
+        """
+        stranger = StrangerService.get_instance().get_cached_stranger(self._stranger)
+        sender = StrangerSenderService.get_instance().get_or_create_stranger_sender(stranger)
+
+        if stranger is not self._stranger or sender is not self._sender:
+            self._stranger = stranger
+            self._sender = sender
+            self._stranger_setup_wizard = StrangerSetupWizard(stranger)
+
     async def on_chat_message(self, message_json):
         unused_content_type, chat_type, unused_chat_id = telepot.glance(message_json)
 
         if chat_type != 'private':
             return
 
+        self._refresh_stranger()
+
         try:
             message = Message(message_json)
         except UnsupportedContentError:
@@ -203,6 +225,17 @@ class StrangerHandler(telepot.aio.helper.UserHandler):
                 pass
             except StrangerError:
                 await self._sender.send_notification(_('Messages of this type aren\'t supported.'))
+            except TransientSendingError as err:
+                LOGGER.warning(
+                    'Send message. Can\'t deliver to partner now: %d -> %d. %s',
+                    self._stranger.id,
+                    self._stranger.get_partner().id,
+                    err,
+                    )
+                await self._sender.send_notification(
+                    _('Your message wasn\'t delivered because of temporary troubles. Please try'
+                      ' again later.'),
+                    )
             except TelegramError:
                 LOGGER.warning(
                     'Send message. Can\'t send to partned: %d -> %d',
@@ -216,12 +249,14 @@ class StrangerHandler(telepot.aio.helper.UserHandler):
 
     async def on_edited_chat_message(self, unused_message_json):
         LOGGER.info('User tried to edit their message.')
+        self._refresh_stranger()
         await self._sender.send_notification(
             _('Messages editing isn\'t supported'),
             )
 
     async def on_inline_query(self, query):
         query_id, unused_from_id, query_string = telepot.glance(query, flavor='inline_query')
+        self._refresh_stranger()
         LOGGER.debug('Inline query from %d: \"%s\"', self._stranger.id, query_string)
         response = [{
             'type': 'article',
@@ -239,4 +274,8 @@ class StrangerHandler(telepot.aio.helper.UserHandler):
                 ),
             'parse_mode': 'Markdown',
             }]
-        await self._sender.answer_inline_query(query_id, response)
+        await self._sender.answer_inline_query(
+            query_id,
+            response,
+            cache_time=type(self).INLINE_QUERY_CACHE_TIME,
+            )
@@ -4,13 +4,89 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import asyncio
 import logging
-import re
+import time
 import telepot
+from .cache import Cache
 from .errors import StrangerSenderError
-from .i18n import get_translation
+from .i18n import get_translation, get_translation_languages
+from .metrics import INLINE_QUERY_ANSWERS, NOTIFICATIONS_COALESCED, TELEGRAM_REQUEST_ERRORS, \
+    TELEGRAM_REQUEST_SECONDS, TELEGRAM_REQUESTS_IN_FLIGHT, TELEGRAM_SEND_SECONDS
+from .notification_catalog import get_notification_catalog
+from .outbound_queue import get_error_code
+from .rate_limiter import PRIORITY_NOTIFICATION, PRIORITY_RELAY
 
 LOGGER = logging.getLogger('randtalkbot.stranger_sender')
+# Telegram's limit of message text length.
+MAX_MESSAGE_LENGTH = 4096
+NOTIFICATIONS_SEPARATOR = '\n\n'
+ARTICLE_TEXTS_KEYS = ('title', 'description', 'message_text')
+
+
+class NotificationsBatch:
+    """Notifications with the same delivery options which are sent as one message."""
+
+    def __init__(self, text, priority, options):
+        self.priority = priority
+        self.options = options
+        self._texts = [text]
+        self._length = len(text)
+
+    def add(self, text, priority, options):
+        """Keyboard of the notification can be attached to the batch which has no keyboard.
+
+        Returns:
+            bool: `True` if the notification was joined to the batch.
+        """
+        length = self._length + len(NOTIFICATIONS_SEPARATOR) + len(text)
+
+        if priority != self.priority or length > MAX_MESSAGE_LENGTH:
+            return False
+
+        if options != self.options:
+            if self.options['reply_markup'] is not None or \
+                    dict(options, reply_markup=None) != self.options:
+                return False
+
+            self.options = options
+
+        self._texts.append(text)
+        self._length = length
+        return True
+
+    def get_text(self):
+        return NOTIFICATIONS_SEPARATOR.join(self._texts)
+
+
+class NotificationsCoalescing:
+    """Async context manager returned by `StrangerSender.coalescing()`."""
+
+    # pylint: disable=protected-access
+
+    def __init__(self, sender):
+        self._sender = sender
+        self._is_outermost = False
+
+    async def __aenter__(self):
+        if self._sender._notifications_batches is None:
+            self._sender._notifications_batches = []
+            self._is_outermost = True
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        if not self._is_outermost:
+            return
+
+        try:
+            await self._sender._send_notifications_batches()
+        except Exception as err: # pylint: disable=broad-except
+            if exc_type is None:
+                raise
+
+            LOGGER.warning('Can\'t send coalesced notifications after error. %s', err)
+        finally:
+            self._sender._notifications_batches = None
+
 
 class StrangerSender(telepot.helper.Sender):
     MESSAGE_TYPE_TO_METHOD_NAME = {
@@ -23,40 +99,127 @@ class StrangerSender(telepot.helper.Sender):
         'video': 'sendVideo',
         'voice': 'sendVoice',
         }
-    MARKDOWN_RE = re.compile(r'([\[\*_`])')
 
-    def __init__(self, bot, stranger):
+    def __init__(self, bot, stranger, outbound_queue=None):
+        """Args:
+            bot (telepot.aio.Bot): Bot sending the messages.
+            stranger (Stranger): Recipient of the messages.
+            outbound_queue (OutboundQueue): Queue pacing and retrying sent messages. Messages are
+                sent directly if it's `None`.
+        """
         super(StrangerSender, self).__init__(bot, stranger.telegram_id)
         self._bot = bot
         self._stranger = stranger
+        self._outbound_queue = outbound_queue
+        # Notifications batches which are sent at the end of `coalescing()` block.
+        self._notifications_batches = None
         self.update_translation()
 
-    @classmethod
-    def _escape_markdown(cls, string_instance):
-        """Escapes string to prevent injecting Markdown into notifications.
-        @see https://core.telegram.org/bots/api#using-markdown
-        """
-        if string_instance is not str:
-            string_instance = str(string_instance)
+    async def _call(self, method_name, method, *args, **kwargs):
+        """Performs Bot API request measuring its latency and counting errors by code."""
+        TELEGRAM_REQUESTS_IN_FLIGHT.inc(method=method_name)
+        start = time.monotonic()
+
+        try:
+            return await method(*args, **kwargs)
+        except asyncio.CancelledError:
+            raise
+        except Exception as err:
+            TELEGRAM_REQUEST_ERRORS.inc(method=method_name, code=get_error_code(err))
+            raise
+        finally:
+            TELEGRAM_REQUEST_SECONDS.observe(time.monotonic() - start, method=method_name)
+            TELEGRAM_REQUESTS_IN_FLIGHT.dec(method=method_name)
+
+    async def _send(self, kind, priority, method_name, *args, **kwargs):
+        method = getattr(self, method_name)
+
+        async def request():
+            await self._call(method_name, method, *args, **kwargs)
+
+        await self._send_request(kind, priority, request)
+
+    async def _send_request(self, kind, priority, request):
+        async def send_function():
+            start = time.monotonic()
+            await request()
+            TELEGRAM_SEND_SECONDS.observe(time.monotonic() - start, kind=kind)
+
+        if self._outbound_queue is None:
+            await send_function()
+        else:
+            await self._outbound_queue.send(self._stranger.telegram_id, send_function, priority)
 
-        string_instance = cls.MARKDOWN_RE.sub(r'\\\1', string_instance)
-        return string_instance
+    async def answer_inline_query(self, query_id, answers, cache_time=None):
+        """Args:
+            cache_time (int): Number of seconds Telegram may answer the same query by itself.
+        """
+        await self._call(
+            'answerInlineQuery',
+            self._bot.answerInlineQuery,
+            query_id,
+            self._translate_answers(answers),
+            cache_time=cache_time,
+            is_personal=True,
+            )
 
-    async def answer_inline_query(self, query_id, answers):
-        def translate(item):
-            return self._(item) if isinstance(item, str) else self._(item[0]).format(*item[1:])
+    def _translate_answers(self, answers):
+        languages = get_translation_languages(self._languages)
+        translated_answers = []
 
         for answer in answers:
             if answer['type'] == 'article':
-                answer['title'] = translate(answer['title'])
-                answer['description'] = translate(answer['description'])
-                answer['message_text'] = translate(answer['message_text'])
-        await self._bot.answerInlineQuery(query_id, answers, is_personal=True)
+                answer = dict(answer, **self._translate_article(languages, answer))
+
+            translated_answers.append(answer)
+
+        return translated_answers
+
+    def _translate_article(self, languages, article):
+        """Texts are translated once per languages and are shared by all senders. Texts can be
+        templates followed by their arguments, e.g. stranger's invitation link, so they're
+        formatted every time.
+
+        Returns:
+            dict: Translated texts of the article.
+        """
+        items = [article[key] for key in ARTICLE_TEXTS_KEYS]
+        texts = tuple(item if isinstance(item, str) else item[0] for item in items)
+        cache_key = languages, texts
+
+        try:
+            translated_texts = TRANSLATED_ARTICLES[cache_key]
+        except KeyError:
+            translated_texts = [self._(text) for text in texts]
+            TRANSLATED_ARTICLES[cache_key] = translated_texts
+            INLINE_QUERY_ANSWERS.inc(cache='miss')
+        else:
+            INLINE_QUERY_ANSWERS.inc(cache='hit')
+
+        return {
+            key: text if isinstance(item, str) else text.format(*item[1:])
+            for key, item, text in zip(ARTICLE_TEXTS_KEYS, items, translated_texts)
+            }
+
+    def coalescing(self):
+        """Notifications sent inside `async with sender.coalescing():` block aren't sent right
+        away. Subsequent notifications with the same priority and delivery options are joined
+        into one message while it fits Telegram's length limit. They are sent when the block
+        ends, so sending errors are raised there.
+
+        Returns:
+            NotificationsCoalescing: Async context manager.
+        """
+        return NotificationsCoalescing(self)
+
+    def get_stranger(self):
+        return self._stranger
 
     async def send(self, message):
         """Raises:
             StrangerSenderError: If message's content type is not supported.
             TelegramError: If stranger has blocked the bot.
+            TransientSendingError: If the message can't be delivered now.
         """
         if message.is_reply:
             raise StrangerSenderError('Reply can\'t be sent.')
@@ -66,7 +229,9 @@ class StrangerSender(telepot.helper.Sender):
         except KeyError:
             raise StrangerSenderError('Unsupported content_type: {}'.format(message.type))
         else:
-            await getattr(self, method_name)(**message.sending_kwargs)
+            # Coalesced notifications shouldn't be overtaken by the message.
+            await self._send_notifications_batches()
+            await self._send(message.type, PRIORITY_RELAY, method_name, **message.sending_kwargs)
 
     async def send_notification(
             self,
@@ -75,12 +240,17 @@ class StrangerSender(telepot.helper.Sender):
             disable_notification=None,
             disable_web_page_preview=None,
             reply_markup=None,
+            priority=PRIORITY_NOTIFICATION,
         ):
-        """Raises:
+        """Args:
+            priority (int): Rate limiter priority of the notification.
+
+        Raises:
             TelegramError: If stranger has blocked the bot.
+            TransientSendingError: If the notification can't be delivered now.
         """
-        args = [StrangerSender._escape_markdown(arg) for arg in args]
-        message = self._(message).format(*args)
+        # pylint: disable=unsubscriptable-object
+        message = get_notification_catalog(self._).render(message, args)
 
         if reply_markup and 'keyboard' in reply_markup:
             reply_markup = {
@@ -91,18 +261,50 @@ class StrangerSender(telepot.helper.Sender):
                 'one_time_keyboard': True,
                 }
 
-        # pylint: disable=no-member
-        await self.sendMessage(
-            '*Rand Talk:* {}'.format(message),
-            disable_notification=disable_notification,
-            disable_web_page_preview=disable_web_page_preview,
-            parse_mode='Markdown',
-            reply_markup=reply_markup,
-            )
+        options = {
+            'disable_notification': disable_notification,
+            'disable_web_page_preview': disable_web_page_preview,
+            'parse_mode': 'Markdown',
+            'reply_markup': reply_markup,
+            }
+
+        batches = self._notifications_batches
+
+        if batches is None:
+            await self._send('notification', priority, 'sendMessage', message, **options)
+        elif batches and batches[-1].add(message, priority, options):
+            NOTIFICATIONS_COALESCED.inc()
+        else:
+            batches.append(NotificationsBatch(message, priority, options))
+
+    async def _send_notifications_batches(self):
+        """Raises:
+            TelegramError: If stranger has blocked the bot.
+            TransientSendingError: If the notifications can't be delivered now.
+        """
+        while self._notifications_batches:
+            batch = self._notifications_batches.pop(0)
+            await self._send(
+                'notification',
+                batch.priority,
+                'sendMessage',
+                batch.get_text(),
+                **batch.options
+                )
+
+    def reload_translation(self):
+        """Obtains the translation for the same languages again after translations reload."""
+        # pylint: disable=attribute-defined-outside-init
+        self._ = get_translation(self._languages)
 
     def update_translation(self, partner=None):
         if partner:
             languages = self._stranger.get_common_languages(partner)
         else:
             languages = self._stranger.get_languages()
+        self._languages = languages
         self._ = get_translation(languages)
+
+
+# Translated texts of inline query articles keyed by languages and untranslated texts.
+TRANSLATED_ARTICLES = Cache(capacity=1000, ttl=60 * 60)
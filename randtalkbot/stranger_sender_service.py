@@ -5,18 +5,39 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import logging
+from .cache import Cache
 from .errors import StrangerSenderServiceError
+from .metrics import CACHE_EVICTIONS, CACHE_HITS, CACHE_MISSES, CACHE_SIZE
 from .stranger_sender import StrangerSender
 
 LOGGER = logging.getLogger('randtalkbot.stranger_sender_service')
 
 
+def is_stranger_sender_pinned(stranger_sender):
+    return stranger_sender.get_stranger().is_active()
+
+
 class StrangerSenderService:
+    CACHE_CAPACITY = 10000
+    CACHE_TTL = 60 * 60
     _instance = None
 
-    def __init__(self, bot):
+    def __init__(self, bot, cache_capacity=None, cache_ttl=None, outbound_queue=None):
         self._bot = bot
-        self._stranger_senders = {}
+        self._outbound_queue = outbound_queue
+        self._stranger_senders = Cache(
+            capacity=type(self).CACHE_CAPACITY if cache_capacity is None else cache_capacity,
+            ttl=type(self).CACHE_TTL if cache_ttl is None else cache_ttl,
+            is_pinned=is_stranger_sender_pinned,
+            )
+        CACHE_EVICTIONS.set_function(
+            lambda: self._stranger_senders.evictions_count,
+            cache='senders',
+            )
+        CACHE_HITS.set_function(lambda: self._stranger_senders.hits_count, cache='senders')
+        CACHE_MISSES.set_function(lambda: self._stranger_senders.misses_count, cache='senders')
+        CACHE_SIZE.set_function(self.get_cache_size, cache='senders')
+        type(self)._instance = self
 
     @classmethod
     def get_instance(cls, bot=None):
@@ -33,10 +54,38 @@ class StrangerSenderService:
     def get_cache_size(self):
         return len(self._stranger_senders)
 
+    def get_cache_stats(self):
+        return self._stranger_senders.get_stats()
+
     def get_or_create_stranger_sender(self, stranger):
         try:
-            return self._stranger_senders[stranger.telegram_id]
+            stranger_sender = self._stranger_senders[stranger.telegram_id]
         except KeyError:
-            stranger_sender = StrangerSender(self._bot, stranger)
-            self._stranger_senders[stranger.telegram_id] = stranger_sender
-            return stranger_sender
+            pass
+        else:
+            # Sender bound to another instance of the stranger (e.g. evicted one) would use its
+            # stale state, so let's replace it.
+            if stranger_sender.get_stranger() is stranger:
+                return stranger_sender
+
+        stranger_sender = StrangerSender(
+            self._bot,
+            stranger,
+            outbound_queue=self._outbound_queue,
+            )
+        self._stranger_senders[stranger.telegram_id] = stranger_sender
+        return stranger_sender
+
+    def reload_translations(self):
+        """Lets cached senders use reloaded translations."""
+        for stranger_sender in self._stranger_senders.values():
+            stranger_sender.reload_translation()
+
+    def remove_stranger_sender(self, stranger):
+        """Forgets the sender of the stranger who is being evicted from strangers' cache to not let
+        the sender keep the stranger alive.
+        """
+        stranger_sender = self._stranger_senders.peek(stranger.telegram_id)
+
+        if stranger_sender is not None and stranger_sender.get_stranger() is stranger:
+            self._stranger_senders.discard(stranger.telegram_id)
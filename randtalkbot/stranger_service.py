@@ -5,19 +5,66 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import logging
+import time
 from peewee import DatabaseError, DoesNotExist
-from .errors import PartnerObtainingError, StrangerError, StrangerServiceError
-from .stranger import INVITATION_LENGTH, Stranger
+from pymysql.connections import Connection as MySQLConnection
+from pymysql.cursors import SSCursor
+from .cache import Cache
+from .stats_service import StatsService
+from .errors import PartnerObtainingError, StrangerError, StrangerSenderServiceError, \
+    StrangerServiceError, TransientSendingError
+from .metrics import CACHE_EVICTIONS, CACHE_HITS, CACHE_MISSES, CACHE_SIZE, STRANGERS_WAITING, \
+    TALKS_ACTIVE
+from .stranger import get_languages, INVITATION_LENGTH, Stranger
+from .stranger_sender_service import StrangerSenderService
 
 LOGGER = logging.getLogger('randtalkbot.stranger_service')
 
 
+def iterate_unbuffered(query):
+    """Iterates over raw rows of the query result. Uses server-side cursor for MySQL to not load
+    the whole result into the memory. Result should be consumed completely before making other
+    queries through the same connection.
+    """
+    connection = query.database.get_conn()
+
+    if isinstance(connection, MySQLConnection):
+        cursor = connection.cursor(SSCursor)
+    else:
+        cursor = connection.cursor()
+
+    try:
+        cursor.execute(*query.sql())
+        yield from cursor
+    finally:
+        cursor.close()
+
+
 class StrangerService:
-    def __init__(self):
+    CACHE_CAPACITY = 10000
+    CACHE_TTL = 60 * 60
+
+    def __init__(self, cache_capacity=None, cache_ttl=None):
         # We need to lock strangers for matching to prevent attempts to create
         # second conversation with single partner.
         self._locked_strangers_ids = set()
-        self._strangers_cache = {}
+        # Maps Telegram IDs of cached strangers to their IDs.
+        self._strangers_ids = {}
+        self._strangers_cache = Cache(
+            capacity=type(self).CACHE_CAPACITY if cache_capacity is None else cache_capacity,
+            ttl=type(self).CACHE_TTL if cache_ttl is None else cache_ttl,
+            is_pinned=self._is_stranger_pinned,
+            on_evict=self._on_stranger_evicted,
+            )
+        CACHE_EVICTIONS.set_function(
+            lambda: self._strangers_cache.evictions_count,
+            cache='strangers',
+            )
+        CACHE_HITS.set_function(lambda: self._strangers_cache.hits_count, cache='strangers')
+        CACHE_MISSES.set_function(lambda: self._strangers_cache.misses_count, cache='strangers')
+        CACHE_SIZE.set_function(self.get_cache_size, cache='strangers')
+        STRANGERS_WAITING.set_function(self.get_looking_for_partner_count)
+        TALKS_ACTIVE.set_function(self.get_talks_count)
         type(self)._instance = self
 
     @classmethod
@@ -34,28 +81,99 @@ class StrangerService:
             if stranger.is_full():
                 yield stranger
 
+    @classmethod
+    def get_full_strangers_profiles(cls):
+        """Obtains only the columns needed for stats in a single pass over the strangers table.
+
+        Yields:
+            tuple: Stats profile of full stranger. See `Stranger.get_stats_profile()`.
+        """
+        # pylint: disable=singleton-comparison
+        query = Stranger.select(Stranger.sex, Stranger.partner_sex, Stranger.languages) \
+            .where(
+                (Stranger.languages != None) &
+                (Stranger.sex != None) &
+                (Stranger.partner_sex != None),
+                ) \
+            .tuples()
+
+        for sex, partner_sex, languages in iterate_unbuffered(query):
+            yield (sex, partner_sex, tuple(get_languages(languages)))
+
     def get_cached_stranger(self, stranger):
         try:
             return self._strangers_cache[stranger.id]
         except KeyError:
+            # Inviter isn't obtained here to not load (and cache) the whole invitation chain.
+            # See `get_inviter()`.
+            self._strangers_ids[stranger.telegram_id] = stranger.id
             self._strangers_cache[stranger.id] = stranger
+            return stranger
 
-            if stranger.invited_by is not None:
-                if stranger.invited_by.invited_by_id == stranger.id:
-                    LOGGER.error(
-                        'Circular reference between invited strangers %d and %d',
-                        stranger.id,
-                        stranger.invited_by_id,
-                        )
-                else:
-                    stranger.invited_by = self.get_cached_stranger(stranger.invited_by)
+    def _get_cached_stranger_by_telegram_id(self, telegram_id):
+        """Returns:
+            Stranger: Cached stranger or `None` if the stranger isn't cached.
+        """
+        try:
+            stranger_id = self._strangers_ids[telegram_id]
+        except KeyError:
+            return None
 
-            return stranger
+        try:
+            return self._strangers_cache[stranger_id]
+        except KeyError:
+            del self._strangers_ids[telegram_id]
+            return None
 
     def get_cache_size(self):
         return len(self._strangers_cache)
 
+    def get_looking_for_partner_count(self):
+        """Counts cached strangers which are looking for partner. All of them are cached since they
+        are loaded at startup and are never evicted.
+        """
+        return sum(
+            1
+            for stranger in self._strangers_cache.values()
+            if stranger.looking_for_partner_from is not None
+            )
+
+    def get_talks_count(self):
+        """Counts talks between cached strangers."""
+        return sum(1 for stranger in self._strangers_cache.values() if stranger.is_talking()) // 2
+
+    def get_cache_stats(self):
+        return self._strangers_cache.get_stats()
+
+    def get_inviter(self, stranger):
+        """Lazily obtains the stranger who has invited specified stranger.
+
+        Raises:
+            StrangerServiceError: If the stranger wasn't invited or if the inviter can't be
+                obtained.
+
+        Returns:
+            Stranger
+        """
+        if stranger.invited_by_id is None:
+            raise StrangerServiceError(f'Stranger {stranger.id} wasn\'t invited')
+
+        try:
+            try:
+                return self._strangers_cache[stranger.invited_by_id]
+            except KeyError:
+                inviter = Stranger.get(Stranger.id == stranger.invited_by_id)
+        except (DatabaseError, DoesNotExist) as err:
+            raise StrangerServiceError('Database problems during `get_inviter`') from err
+
+        return self.get_cached_stranger(inviter)
+
     def get_or_create_stranger(self, telegram_id):
+        stranger = self._get_cached_stranger_by_telegram_id(telegram_id)
+
+        if stranger is not None:
+            return stranger
+
         try:
             try:
                 stranger = Stranger.get(Stranger.telegram_id == telegram_id)
@@ -64,12 +182,21 @@ class StrangerService:
                     invitation=Stranger.get_invitation(),
                     telegram_id=telegram_id,
                     )
+                StatsService.get_instance().update_stranger_stats(
+                    None,
+                    stranger.get_stats_profile(),
+                    )
         except DatabaseError as err:
             raise StrangerServiceError('Database problems during `get_or_create_stranger`') from err
 
         return self.get_cached_stranger(stranger)
 
     def get_stranger(self, telegram_id):
+        stranger = self._get_cached_stranger_by_telegram_id(telegram_id)
+
+        if stranger is not None:
+            return stranger
+
         try:
             stranger = Stranger.get(Stranger.telegram_id == telegram_id)
         except (DatabaseError, DoesNotExist) as err:
@@ -91,6 +218,139 @@ class StrangerService:
 
         return self.get_cached_stranger(stranger)
 
+    def set_inviter(self, stranger, inviter):
+        """Saves the stranger as invited by the inviter. Invitation chains are checked only here,
+        so they can't become circular and `get_inviter()` doesn't need to walk them.
+
+        Raises:
+            StrangerServiceError: If the invitation would make the chain circular or if there're
+                some database troubles.
+        """
+        try:
+            if self._is_invitation_chain_circular(stranger, inviter):
+                raise StrangerServiceError(
+                    f'Invitation of stranger {stranger.id} by {inviter.id} makes chain circular',
+                    )
+
+            stranger.invited_by = inviter
+            stranger.save()
+        except DatabaseError as err:
+            raise StrangerServiceError('Database problems during `set_inviter`') from err
+
+    def warm_up(self):
+        """Loads all talking and searching strangers together with their talks using two queries
+        to prevent lots of small queries for each of them during processing of the updates
+        received while the bot was down.
+
+        Raises:
+            StrangerServiceError: If there're some database troubles.
+        """
+        from .talk import Talk
+
+        start_time = time.monotonic()
+
+        try:
+            talks = list(Talk.get_not_ended_talks())
+            talking_strangers_ids = set()
+
+            for talk in talks:
+                talking_strangers_ids.add(talk.partner1_id)
+                talking_strangers_ids.add(talk.partner2_id)
+
+            # pylint: disable=singleton-comparison
+            condition = Stranger.looking_for_partner_from != None
+
+            if talking_strangers_ids:
+                condition |= Stranger.id << list(talking_strangers_ids)
+
+            strangers = list(Stranger.select().where(condition))
+        except DatabaseError as err:
+            raise StrangerServiceError('Database problems during `warm_up`') from err
+
+        strangers_by_ids = {stranger.id: stranger for stranger in strangers}
+
+        for talk in talks:
+            try:
+                partner1 = strangers_by_ids[talk.partner1_id]
+                partner2 = strangers_by_ids[talk.partner2_id]
+            except KeyError:
+                LOGGER.warning('Talk %d refers to missing stranger', talk.id)
+                continue
+
+            if partner1.has_talk_loaded() or partner2.has_talk_loaded():
+                LOGGER.warning('Talk %d isn\'t the only not ended talk of its partners', talk.id)
+                continue
+
+            talk.partner1 = partner1
+            talk.partner2 = partner2
+            partner1.set_loaded_talk(talk, partner2)
+            partner2.set_loaded_talk(talk, partner1)
+
+        for stranger in strangers:
+            if not stranger.has_talk_loaded():
+                stranger.set_loaded_talk(None, None)
+
+            # Strangers are cached only after setting their talks to let the cache know that they
+            # are active and shouldn't be evicted.
+            self.get_cached_stranger(stranger)
+
+        LOGGER.info(
+            'Cache was warmed up in %.3f s: %d strangers, %d talks',
+            time.monotonic() - start_time,
+            len(strangers),
+            len(talks),
+            )
+
+    def _is_invitation_chain_circular(self, stranger, inviter):
+        """Walks up the invitation chain of any length starting from the inviter using only
+        inviters' IDs.
+
+        Raises:
+            DatabaseError: If some inviter's ID can't be obtained.
+
+        Returns:
+            bool: `True` if the stranger or some of the inviters are met in the chain twice.
+        """
+        chain_ids = [stranger.id]
+        inviter_id = inviter.id
+
+        while inviter_id is not None:
+            if inviter_id in chain_ids:
+                LOGGER.error(
+                    'Circular invitation chain was found: %s -> %d',
+                    ' -> '.join(str(chain_id) for chain_id in chain_ids),
+                    inviter_id,
+                    )
+                return True
+
+            chain_ids.append(inviter_id)
+            inviter = self._strangers_cache.peek(inviter_id)
+
+            if inviter is None:
+                inviter_id = Stranger.select(Stranger.invited_by) \
+                    .where(Stranger.id == inviter_id) \
+                    .scalar()
+            else:
+                inviter_id = inviter.invited_by_id
+
+        return False
+
+    def _is_stranger_pinned(self, stranger):
+        """Strangers who are matched right now or are active can't be evicted from the cache
+        because other objects hold and mutate exactly their instances.
+        """
+        return stranger.id in self._locked_strangers_ids or stranger.is_active()
+
+    def _on_stranger_evicted(self, unused_stranger_id, stranger):
+        self._strangers_ids.pop(stranger.telegram_id, None)
+
+        try:
+            stranger_sender_service = StrangerSenderService.get_instance()
+        except StrangerSenderServiceError:
+            return
+
+        stranger_sender_service.remove_stranger_sender(stranger)
+
     def _match_partner(self, stranger):
         """Tries to find a partner for obtained stranger.
 
@@ -152,31 +412,44 @@ class StrangerService:
 
     async def match_partner(self, stranger):
         """Finds partner for the stranger. Does handling of strangers who have blocked the bot.
+        Potential partners who can't be notified now because of temporary troubles are skipped
+        but keep looking for partner.
 
         Raises:
             PartnerObtainingError: If there's no proper partners.
-            StrangerServiceError: If the stranger has blocked the bot.
+            StrangerServiceError: If the stranger has blocked the bot or can't be notified now.
         """
-        while True:
-            partner = self._match_partner(stranger)
-
-            try:
-                await partner.notify_partner_found(stranger)
-            except StrangerError as err:
-                # Potential partner has blocked the bot. Let's look for next
-                # potential partner.
-                LOGGER.info('Bad potential partner for %d. %s', stranger.id, err)
-                await partner.end_talk()
-                self._locked_strangers_ids.discard(partner.id)
-                continue
+        unreachable_partners_ids = set()
 
-            break
+        try:
+            while True:
+                partner = self._match_partner(stranger)
+
+                try:
+                    await partner.notify_partner_found(stranger)
+                except StrangerError as err:
+                    # Potential partner has blocked the bot. Let's look for next
+                    # potential partner.
+                    LOGGER.info('Bad potential partner for %d. %s', stranger.id, err)
+                    await partner.end_talk()
+                    self._locked_strangers_ids.discard(partner.id)
+                    continue
+                except TransientSendingError as err:
+                    # Keeps the potential partner locked to not match them again.
+                    LOGGER.info('Unreachable potential partner for %d. %s', stranger.id, err)
+                    unreachable_partners_ids.add(partner.id)
+                    continue
+
+                break
+        finally:
+            for partner_id in unreachable_partners_ids:
+                self._locked_strangers_ids.discard(partner_id)
 
         try:
             await stranger.notify_partner_found(partner)
-        except StrangerError as err:
+        except (StrangerError, TransientSendingError) as err:
             self._locked_strangers_ids.discard(partner.id)
-            # Stranger has blocked the bot.
+            # Stranger has blocked the bot or is unreachable now.
             raise StrangerServiceError('Can\'t notify seeking for partner stranger') from err
 
         await stranger.set_partner(partner)
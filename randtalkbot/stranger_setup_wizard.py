@@ -9,6 +9,7 @@ from telepot.exception import TelegramError
 from .errors import EmptyLanguagesError, SexError, StrangerError
 from .i18n import get_languages_codes, get_languages_names, LanguageNotFoundError, \
     SUPPORTED_LANGUAGES_NAMES
+from .stats_service import StatsService
 from .stranger import SEX_NAMES
 from .stranger_sender_service import StrangerSenderService
 from .wizard import Wizard
@@ -66,6 +67,8 @@ class StrangerSetupWizard(Wizard):
         elif self._stranger.wizard != 'setup':
             return False
 
+        stats_profile = self._stranger.get_stats_profile()
+
         try:
             if self._stranger.wizard_step == 'languages':
                 try:
@@ -134,6 +137,11 @@ class StrangerSetupWizard(Wizard):
         except TelegramError as err:
             LOGGER.warning('handle() Can not notify stranger. %s', err)
 
+        # Stranger's parameters could be saved on any step.
+        StatsService.get_instance().update_stranger_stats(
+            stats_profile,
+            self._stranger.get_stats_profile(),
+            )
         return True
 
     async def handle_command(self, message):
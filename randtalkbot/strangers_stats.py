@@ -0,0 +1,152 @@
+# RandTalkBot Bot matching you with a random person on Telegram.
+# Copyright (C) 2016 quasiyoke
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+
+LOGGER = logging.getLogger('randtalkbot.strangers_stats')
+
+def decrement(dictionary, key):
+    dictionary[key] -= 1
+
+    if not dictionary[key]:
+        del dictionary[key]
+
+def first(iterable):
+    return iterable[0]
+
+def increment(dictionary, key):
+    try:
+        dictionary[key] += 1
+    except KeyError:
+        dictionary[key] = 1
+
+def second(iterable):
+    return iterable[1]
+
+class StrangersStats:
+    """Distributions of full strangers' parameters which can be updated incrementally when some
+    stranger changes her parameters, so we don't need to scan the whole strangers table to obtain
+    them.
+    """
+
+    def __init__(self):
+        self.total_count = 0
+        self._sex_distribution = {}
+        self._partner_sex_distribution = {}
+        self._languages_count_distribution = {}
+        self._languages_popularity = {}
+        # Orientations are counted for all languages. Unpopular languages are skipped only in
+        # `get_data()` because popularity threshold changes over time.
+        self._languages_to_orientation = {}
+
+    @classmethod
+    def from_profiles(cls, profiles):
+        """Args:
+            profiles (iterable): `(sex, partner_sex, languages)` tuples of full strangers.
+
+        Returns:
+            StrangersStats: Stats of the strangers.
+        """
+        strangers_stats = cls()
+
+        for profile in profiles:
+            strangers_stats.add(profile)
+
+        return strangers_stats
+
+    def add(self, profile):
+        sex, partner_sex, languages = profile
+        orientation = '{} {}'.format(sex, partner_sex)
+        self.total_count += 1
+        increment(self._sex_distribution, sex)
+        increment(self._partner_sex_distribution, partner_sex)
+        increment(self._languages_count_distribution, len(languages))
+
+        for language in languages:
+            increment(self._languages_popularity, language)
+
+            try:
+                orientation_distribution = self._languages_to_orientation[language]
+            except KeyError:
+                orientation_distribution = {}
+                self._languages_to_orientation[language] = orientation_distribution
+
+            increment(orientation_distribution, orientation)
+
+    def remove(self, profile):
+        """Raises:
+            KeyError: If such profile wasn't counted.
+        """
+        if not self._is_counted(profile):
+            raise KeyError(profile)
+
+        sex, partner_sex, languages = profile
+        orientation = '{} {}'.format(sex, partner_sex)
+        self.total_count -= 1
+        decrement(self._sex_distribution, sex)
+        decrement(self._partner_sex_distribution, partner_sex)
+        decrement(self._languages_count_distribution, len(languages))
+
+        for language in languages:
+            decrement(self._languages_popularity, language)
+            orientation_distribution = self._languages_to_orientation[language]
+            decrement(orientation_distribution, orientation)
+
+            if not orientation_distribution:
+                del self._languages_to_orientation[language]
+
+    def _is_counted(self, profile):
+        sex, partner_sex, languages = profile
+        orientation = '{} {}'.format(sex, partner_sex)
+        return sex in self._sex_distribution and \
+            partner_sex in self._partner_sex_distribution and \
+            len(languages) in self._languages_count_distribution and \
+            all(
+                orientation in self._languages_to_orientation.get(language, {})
+                for language in languages
+                )
+
+    def update(self, old_profile, new_profile):
+        """Replaces stranger's old profile with the new one. Any of them can be `None` if the
+        stranger wasn't full before or isn't full now.
+        """
+        if old_profile is not None:
+            try:
+                self.remove(old_profile)
+            except KeyError:
+                LOGGER.warning('Stranger\'s profile %s wasn\'t counted', old_profile)
+
+        if new_profile is not None:
+            self.add(new_profile)
+
+    def get_sex_distribution(self):
+        return dict(self._sex_distribution)
+
+    def get_data(self):
+        """Returns:
+            dict: Strangers' part of stats' data.
+        """
+        langs_count_distribution_items = list(self._languages_count_distribution.items())
+        langs_count_distribution_items.sort(key=first)
+        valuable_count = self.total_count / 100
+        languages_popularity_items = [
+            (language, popularity)
+            for language, popularity in self._languages_popularity.items()
+            if popularity >= valuable_count
+            ]
+        languages_popularity_items.sort(key=second, reverse=True)
+        languages_to_orientation_items = [
+            (language, dict(self._languages_to_orientation[language]))
+            for language, popularity in languages_popularity_items
+            ]
+        return {
+            'languages_count_distribution': langs_count_distribution_items,
+            'languages_popularity': languages_popularity_items,
+            'languages_to_orientation': languages_to_orientation_items,
+            'partner_sex_distribution': dict(self._partner_sex_distribution),
+            'sex_distribution': dict(self._sex_distribution),
+            'total_count': self.total_count,
+            }
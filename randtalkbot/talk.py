@@ -80,7 +80,8 @@ class Talk(Model):
         Returns:
             Stranger
         """
-        return Stranger.get(id=self.get_partner_id(stranger))
+        partner = Stranger.get(id=self.get_partner_id(stranger))
+        return StrangerService.get_instance().get_cached_stranger(partner)
 
     def get_partner_id(self, stranger):
         if stranger.id == self.partner1_id:
@@ -0,0 +1,104 @@
+# RandTalkBot Bot matching you with a random person on Telegram.
+# Copyright (C) 2016 quasiyoke
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import logging
+import aiohttp
+from telepot.aio import api
+
+LOGGER = logging.getLogger('randtalkbot.telegram_session')
+API_URL = 'https://api.telegram.org'
+
+
+class TelegramSession:
+    """HTTP session shared by all Bot API requests. telepot creates its own session with 10
+    connections at import and doesn't let to tune it, so the session replaces telepot's default
+    one. Requests uploading files still use telepot's one-time sessions.
+    """
+
+    POOL_SIZE = 100
+    # Unlimited, i.e. bounded by the pool size only.
+    PER_HOST_LIMIT = 0
+    KEEPALIVE_TIMEOUT = 60
+    DNS_CACHE_TTL = 300
+    CONNECT_TIMEOUT = 10
+    # Timeout of the whole request. telepot extends it for long polling.
+    TIMEOUT = 30
+
+    def __init__(
+            self,
+            api_url=None,
+            pool_size=None,
+            per_host_limit=None,
+            keepalive_timeout=None,
+            dns_cache_ttl=None,
+            connect_timeout=None,
+            timeout=None,
+        ):
+        """Every knob mirrors the property of `telegram` configuration section. Defaults are taken
+        from the class constants if it's `None`.
+
+        Args:
+            api_url (str): Bot API URL without trailing slash, e.g. URL of local stand-in server
+                in tests and benchmarks.
+            pool_size (int): Number of connections to Bot API kept in the pool.
+            per_host_limit (int): Number of connections to the single host. `0` means no limit.
+            keepalive_timeout (float): Number of seconds idle connection is kept alive.
+            dns_cache_ttl (int): Number of seconds resolved addresses are cached.
+            connect_timeout (float): Number of seconds to wait for connection.
+            timeout (float): Number of seconds to wait for the whole request except long polling.
+        """
+        # pylint: disable=too-many-arguments
+        self._api_url = API_URL if api_url is None else api_url
+        self._pool_size = type(self).POOL_SIZE if pool_size is None else pool_size
+        self._per_host_limit = \
+            type(self).PER_HOST_LIMIT if per_host_limit is None else per_host_limit
+        self._keepalive_timeout = \
+            type(self).KEEPALIVE_TIMEOUT if keepalive_timeout is None else keepalive_timeout
+        self._dns_cache_ttl = type(self).DNS_CACHE_TTL if dns_cache_ttl is None else dns_cache_ttl
+        self._connect_timeout = \
+            type(self).CONNECT_TIMEOUT if connect_timeout is None else connect_timeout
+        self._timeout = type(self).TIMEOUT if timeout is None else timeout
+        self._session = None
+
+    def get_method_url(self, req, **unused_user_kw):
+        token, method, unused_params, unused_files = req
+        return '{}/bot{}/{}'.format(self._api_url, token, method)
+
+    def install(self):
+        """Creates the session and makes telepot use it. Should be called within the event loop
+        which will run the bot.
+        """
+        connector = aiohttp.TCPConnector(
+            limit=self._pool_size,
+            limit_per_host=self._per_host_limit,
+            keepalive_timeout=self._keepalive_timeout,
+            ttl_dns_cache=self._dns_cache_ttl,
+            )
+        self._session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(connect=self._connect_timeout),
+            )
+        # pylint: disable=protected-access
+        telepot_session = api._pools['default']
+        api._pools['default'] = self._session
+        api._timeout = self._timeout
+
+        if self._api_url != API_URL:
+            api._methodurl = self.get_method_url
+
+        asyncio.ensure_future(telepot_session.close())
+        LOGGER.info(
+            'Telegram session: pool %d, per host %d, keep-alive %s s, timeout %s s',
+            self._pool_size,
+            self._per_host_limit,
+            self._keepalive_timeout,
+            self._timeout,
+            )
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
@@ -0,0 +1,87 @@
+# RandTalkBot Bot matching you with a random person on Telegram.
+# Copyright (C) 2016 quasiyoke
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+class TrieNode:
+    __slots__ = ('children', 'key', 'value')
+
+    def __init__(self):
+        self.children = {}
+        self.key = None
+        self.value = None
+
+
+class Trie:
+    """Prefix tree which looks for keys within bounded Levenshtein distance from the given word.
+    Distances are computed row by row while descending the tree, so branches which can't be
+    closer than the bound are cut off.
+    """
+
+    def __init__(self):
+        self._root = TrieNode()
+
+    def __setitem__(self, key, value):
+        node = self._root
+
+        for char in key:
+            try:
+                node = node.children[char]
+            except KeyError:
+                child = TrieNode()
+                node.children[char] = child
+                node = child
+
+        node.key = key
+        node.value = value
+
+    def __getitem__(self, key):
+        """Raises:
+            KeyError: If there's no such key.
+
+        Returns:
+            Value of the key.
+        """
+        node = self._root
+
+        for char in key:
+            node = node.children[char]
+
+        if node.key is None:
+            raise KeyError(key)
+
+        return node.value
+
+    def search(self, word, max_distance):
+        """Returns:
+            list: Tuples (distance, key, value) for all keys within `max_distance` from the word
+                sorted by distance.
+        """
+        results = []
+        first_row = list(range(len(word) + 1))
+
+        for char, child in self._root.children.items():
+            self._search(child, char, word, first_row, max_distance, results)
+
+        results.sort(key=lambda result: result[:2])
+        return results
+
+    def _search(self, node, char, word, previous_row, max_distance, results):
+        # pylint: disable=too-many-arguments
+        current_row = [previous_row[0] + 1]
+
+        for i, word_char in enumerate(word, 1):
+            current_row.append(min(
+                current_row[i - 1] + 1,
+                previous_row[i] + 1,
+                previous_row[i - 1] + (word_char != char),
+                ))
+
+        if node.key is not None and current_row[-1] <= max_distance:
+            results.append((current_row[-1], node.key, node.value))
+
+        if min(current_row) <= max_distance:
+            for child_char, child in node.children.items():
+                self._search(child, child_char, word, current_row, max_distance, results)
@@ -0,0 +1,193 @@
+# RandTalkBot Bot matching you with a random person on Telegram.
+# Copyright (C) 2016 quasiyoke
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import hmac
+import json
+import logging
+from .metrics import WEBHOOK_UPDATES
+
+LOGGER = logging.getLogger('randtalkbot.webhook_server')
+CONTENT_TYPE = 'text/plain; charset=utf-8'
+SECRET_TOKEN_HEADER = 'x-telegram-bot-api-secret-token'
+
+def parse_update(body):
+    """Raises:
+        ValueError: If the body isn't JSON of an update.
+
+    Returns:
+        dict: Update.
+    """
+    update = json.loads(body.decode('utf-8'))
+
+    if not isinstance(update, dict) or 'update_id' not in update:
+        raise ValueError('Update ID is missing')
+
+    return update
+
+
+class WebhookServer:
+    """Minimal HTTP listener which accepts updates POSTed by Telegram and puts them to the bounded
+    queue consumed by the bot's message loop. It's meant to be bound to a local address behind
+    TLS-terminating reverse proxy, so it doesn't try to be a complete HTTP server.
+    """
+
+    HOST = '127.0.0.1'
+    PORT = 8080
+    PATH = '/webhook'
+    QUEUE_SIZE = 1000
+    MAX_BODY_SIZE = 1024 * 1024
+    # Telegram keeps connections alive, so it's the timeout of idle connection too.
+    REQUEST_TIMEOUT = 60
+
+    def __init__(self, host=None, port=None, path=None, secret_token=None, queue_size=None):
+        """Args:
+            host (str): Address to listen on.
+            port (int): Port to listen on.
+            path (str): Path the reverse proxy forwards updates to.
+            secret_token (str): Value of `X-Telegram-Bot-Api-Secret-Token` header which Telegram
+                sends with every update. Updates aren't checked if it's `None`.
+            queue_size (int): Number of updates which can wait for processing. Telegram gets
+                "429 Too Many Requests" above it and retries the update later.
+        """
+        # pylint: disable=too-many-arguments
+        self._host = type(self).HOST if host is None else host
+        self._port = type(self).PORT if port is None else port
+        self._path = type(self).PATH if path is None else path
+        self._secret_token = secret_token
+        self.queue = asyncio.Queue(
+            maxsize=type(self).QUEUE_SIZE if queue_size is None else queue_size,
+            )
+        self._server = None
+        self._handlers = set()
+
+    async def run(self):
+        self._server = await asyncio.start_server(self._handle_connection, self._host, self._port)
+
+        if self._secret_token is None:
+            LOGGER.warning('Webhook secret token isn\'t specified. Updates won\'t be checked')
+
+        LOGGER.info('Accepting updates on %s:%d%s', self._host, self._port, self._path)
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+        # Telegram keeps connections alive, so they should be dropped explicitly.
+        for handler in self._handlers:
+            handler.cancel()
+
+        await asyncio.gather(*self._handlers, return_exceptions=True)
+
+    async def _handle_connection(self, reader, writer):
+        handler = asyncio.Task.current_task()
+        self._handlers.add(handler)
+
+        try:
+            while True:
+                request_line = await asyncio.wait_for(reader.readline(), self.REQUEST_TIMEOUT)
+
+                if not request_line:
+                    break
+
+                headers = {}
+
+                while True:
+                    header_line = await asyncio.wait_for(reader.readline(), self.REQUEST_TIMEOUT)
+
+                    if header_line in (b'\r\n', b'\n', b''):
+                        break
+
+                    name, unused_separator, value = header_line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                try:
+                    content_length = int(headers.get('content-length', 0))
+                except ValueError:
+                    content_length = -1
+
+                if not 0 <= content_length <= self.MAX_BODY_SIZE:
+                    # The body can't be skipped, so the connection is closed.
+                    await self._write_response(writer, '413 Payload Too Large', keep_alive=False)
+                    break
+
+                body = await asyncio.wait_for(
+                    reader.readexactly(content_length),
+                    self.REQUEST_TIMEOUT,
+                    )
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                status = self._get_response(request_line, headers, body)
+                await self._write_response(writer, status, keep_alive)
+
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError) as err:
+            LOGGER.debug('Troubles with serving webhook request. %s', err)
+        finally:
+            writer.close()
+            self._handlers.discard(handler)
+
+    async def _write_response(self, writer, status, keep_alive):
+        body = (status.split(' ', 1)[1] + '\n').encode('utf-8')
+        writer.write(
+            'HTTP/1.1 {}\r\nContent-Type: {}\r\nContent-Length: {}\r\nConnection: {}\r\n\r\n'
+            .format(status, CONTENT_TYPE, len(body), 'keep-alive' if keep_alive else 'close')
+            .encode('ascii')
+            )
+        writer.write(body)
+        await writer.drain()
+
+    def _check_request(self, request_line, headers):
+        """Returns:
+            str: HTTP status if the request isn't an update from Telegram, `None` otherwise.
+        """
+        try:
+            method, path, unused_version = request_line.decode('ascii').split()
+        except ValueError:
+            # `UnicodeDecodeError` is `ValueError` too.
+            WEBHOOK_UPDATES.inc(outcome='malformed')
+            return '400 Bad Request'
+
+        if path.split('?')[0] != self._path:
+            return '404 Not Found'
+        elif method != 'POST':
+            return '405 Method Not Allowed'
+        elif self._secret_token is not None and not hmac.compare_digest(
+                headers.get(SECRET_TOKEN_HEADER, '').encode('latin-1'),
+                self._secret_token.encode('utf-8'),
+            ):
+            WEBHOOK_UPDATES.inc(outcome='unauthorized')
+            LOGGER.warning('Update with wrong secret token was received')
+            return '403 Forbidden'
+
+        return None
+
+    def _get_response(self, request_line, headers, body):
+        """Returns:
+            str: HTTP status.
+        """
+        status = self._check_request(request_line, headers)
+
+        if status is not None:
+            return status
+
+        try:
+            update = parse_update(body)
+        except ValueError as err:
+            WEBHOOK_UPDATES.inc(outcome='malformed')
+            LOGGER.debug('Can\'t parse update. %s', err)
+            return '400 Bad Request'
+
+        try:
+            self.queue.put_nowait(update)
+        except asyncio.QueueFull:
+            WEBHOOK_UPDATES.inc(outcome='rejected')
+            LOGGER.warning('Updates queue is full. Update %d was rejected', update['update_id'])
+            return '429 Too Many Requests'
+
+        WEBHOOK_UPDATES.inc(outcome='accepted')
+        return '200 OK'
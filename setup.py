@@ -103,6 +103,7 @@ setup(
         'Topic :: Communications :: Chat',
         ],
     install_requires=[
+        'aiohttp>=3.3,<4.0',
         'docopt>=0.6.2,<0.7',
         'peewee>=2.7.4,<3.0',
         'pycountry>=1.19,<2.0',
@@ -76,6 +76,7 @@ class DelegatorBot:
         'sendGame',
         'sendChatAction',
         'sendMediaGroup',
+        'deleteWebhook',
         ]
 
     def __init__(self, unused_token, delegate_records):
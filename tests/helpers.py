@@ -10,8 +10,9 @@ from functools import wraps
 import logging
 from asynctest.mock import patch, Mock
 from peewee import SqliteDatabase
-from randtalkbot import stats, stranger, talk
+from randtalkbot import broadcast, stats, stranger, talk
 from randtalkbot.bot import Bot
+from randtalkbot.broadcast import Broadcast
 from randtalkbot.stats import Stats
 from randtalkbot.stranger import Stranger
 from randtalkbot.stranger_service import StrangerService
@@ -57,9 +58,27 @@ def assert_db(db_dict):
         else:
             raise AssertionError(f'Unknown model name: `{model_name}`')
 
+class CoalescingMock:
+    """Stand-in for the result of `StrangerSender.coalescing()`."""
+
+    async def __aenter__(self):
+        pass
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        pass
+
 def get_configuration_mock():
     configuration = Mock()
     configuration.admins_telegram_ids = []
+    configuration.broadcast_rate = None
+    # Scenarios exchange messages faster than Telegram allows, so pacing is relaxed.
+    configuration.chat_burst_limit = 1000
+    configuration.chat_rate_limit = 1000
+    configuration.global_rate_limit = 1000
+    configuration.senders_cache_capacity = None
+    configuration.senders_cache_ttl = None
+    configuration.sending_max_attempts = None
+    configuration.webhook_url = None
     return configuration
 
 def run(ctx):
@@ -76,10 +95,11 @@ def run(ctx):
     ctx.task = loop.create_task(bot.run())
 
     ctx.database = SqliteDatabase(':memory:')
+    broadcast.DATABASE_PROXY.initialize(ctx.database)
     stats.DATABASE_PROXY.initialize(ctx.database)
     stranger.DATABASE_PROXY.initialize(ctx.database)
     talk.DATABASE_PROXY.initialize(ctx.database)
-    ctx.database.create_tables([Stats, Stranger, Talk])
+    ctx.database.create_tables([Broadcast, Stats, Stranger, Talk])
 
     StatsService()
     StrangerService.get_instance() \
@@ -0,0 +1,112 @@
+# RandTalkBot Bot matching you with a random person on Telegram.
+# Copyright (C) 2016 quasiyoke
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Local stand-in for Bot API server. It keeps connections alive like Telegram does, so it can be
+used to check and benchmark HTTP connections pooling without the real network.
+"""
+
+import asyncio
+import json
+import logging
+from urllib.parse import parse_qsl
+
+LOGGER = logging.getLogger('tests.telegram_stand_in')
+STATUSES_REASONS = {
+    200: 'OK',
+    400: 'Bad Request',
+    403: 'Forbidden',
+    429: 'Too Many Requests',
+    500: 'Internal Server Error',
+    }
+
+def get_ok_response(unused_method, params):
+    return 200, {
+        'ok': True,
+        'result': {
+            'chat': {'id': params.get('chat_id')},
+            'message_id': 1,
+            'text': params.get('text'),
+            },
+        }
+
+
+class TelegramStandIn:
+    """Answers every Bot API request after `latency` seconds with the response obtained from
+    `get_response(method, params)` which returns tuple (HTTP status, JSON).
+    """
+
+    def __init__(self, latency=0, get_response=get_ok_response):
+        self._latency = latency
+        self._get_response = get_response
+        self._server = None
+        self._handlers = set()
+        self.connections_count = 0
+        self.requests = []
+
+    def get_api_url(self):
+        host, port = self._server.sockets[0].getsockname()[:2]
+        return 'http://{}:{}'.format(host, port)
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_connection, '127.0.0.1', 0)
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+        for handler in self._handlers:
+            handler.cancel()
+
+        await asyncio.gather(*self._handlers, return_exceptions=True)
+
+    async def _handle_connection(self, reader, writer):
+        self.connections_count += 1
+        handler = asyncio.Task.current_task()
+        self._handlers.add(handler)
+
+        try:
+            while True:
+                request_line = await reader.readline()
+
+                if not request_line:
+                    break
+
+                content_length = 0
+
+                while True:
+                    header_line = await reader.readline()
+
+                    if header_line in (b'\r\n', b'\n', b''):
+                        break
+
+                    name, unused_separator, value = header_line.decode('ascii').partition(':')
+
+                    if name.strip().lower() == 'content-length':
+                        content_length = int(value)
+
+                body = await reader.readexactly(content_length)
+                method = request_line.decode('ascii').split()[1].rsplit('/', 1)[-1]
+                params = dict(parse_qsl(body.decode('utf-8')))
+                self.requests.append((method, params))
+
+                if self._latency:
+                    await asyncio.sleep(self._latency)
+
+                status, response_json = self._get_response(method, params)
+                response_body = json.dumps(response_json).encode('utf-8')
+                writer.write(
+                    'HTTP/1.1 {} {}\r\nContent-Type: application/json\r\n'
+                    'Content-Length: {}\r\nConnection: keep-alive\r\n\r\n'
+                    .format(status, STATUSES_REASONS.get(status, ''), len(response_body))
+                    .encode('ascii')
+                    )
+                writer.write(response_body)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError) as err:
+            LOGGER.debug('Connection was dropped. %s', err)
+        finally:
+            writer.close()
+            self._handlers.discard(handler)
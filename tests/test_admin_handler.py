@@ -8,7 +8,7 @@ from unittest.mock import create_autospec
 import asynctest
 from asynctest.mock import call, patch, Mock, CoroutineMock
 from randtalkbot.admin_handler import AdminHandler
-from randtalkbot.admin_handler import StrangerServiceError
+from randtalkbot.admin_handler import BroadcastServiceError, StrangerServiceError
 from randtalkbot.stranger_setup_wizard import StrangerSetupWizard
 
 
@@ -41,6 +41,64 @@ class TestAdminHandler(asynctest.TestCase):
             )
         self.stranger_sender_service = stranger_sender_service
 
+    @patch('randtalkbot.admin_handler.BroadcastService', Mock())
+    async def test_handle_command_broadcast(self):
+        from randtalkbot.admin_handler import BroadcastService
+        broadcast_service = BroadcastService.get_instance.return_value
+        broadcast_service.start = CoroutineMock()
+        broadcast_service.start.return_value.id = 42
+        message = Mock()
+        message.command_args = 'Hello\neveryone'
+        await self.admin_handler._handle_command_broadcast(message)
+        broadcast_service.start.assert_called_once_with(
+            'Hello\neveryone',
+            self.stranger.telegram_id,
+            )
+        self.sender.send_notification.assert_called_once_with(
+            'Broadcast {0} was started. Send /broadcast to see its progress.',
+            42,
+            )
+
+    @patch('randtalkbot.admin_handler.BroadcastService', Mock())
+    async def test_handle_command_broadcast__in_progress(self):
+        from randtalkbot.admin_handler import BroadcastService
+        broadcast_service = BroadcastService.get_instance.return_value
+        error = BroadcastServiceError('Broadcast 42 is in progress already')
+        broadcast_service.start = CoroutineMock(side_effect=error)
+        message = Mock()
+        message.command_args = 'Hello'
+        await self.admin_handler._handle_command_broadcast(message)
+        self.sender.send_notification.assert_called_once_with(
+            'Can\'t start broadcast: {0}',
+            error,
+            )
+
+    @patch('randtalkbot.admin_handler.BroadcastService', Mock())
+    async def test_handle_command_broadcast__progress(self):
+        from randtalkbot.admin_handler import BroadcastService
+        broadcast_service = BroadcastService.get_instance.return_value
+        broadcast_service.get_progress_report.return_value = 'foo_report'
+        message = Mock()
+        message.command_args = ''
+        await self.admin_handler._handle_command_broadcast(message)
+        broadcast_service.start.assert_not_called()
+        broadcast_service.get_progress_report \
+            .assert_called_once_with(broadcast_service.get_broadcast.return_value)
+        self.sender.send_notification.assert_called_once_with('{0}', 'foo_report')
+
+    @patch('randtalkbot.admin_handler.BroadcastService', Mock())
+    async def test_handle_command_broadcast__no_broadcast(self):
+        from randtalkbot.admin_handler import BroadcastService
+        broadcast_service = BroadcastService.get_instance.return_value
+        broadcast_service.get_broadcast.return_value = None
+        message = Mock()
+        message.command_args = None
+        await self.admin_handler._handle_command_broadcast(message)
+        broadcast_service.start.assert_not_called()
+        self.sender.send_notification.assert_called_once_with(
+            'Use it this way: `/broadcast Hello everyone!` Markdown is supported.',
+            )
+
     @patch('randtalkbot.admin_handler.StrangerService', Mock())
     async def test_handle_command_clear(self):
         from randtalkbot.admin_handler import StrangerService
@@ -0,0 +1,205 @@
+# RandTalkBot Bot matching you with a random person on Telegram.
+# Copyright (C) 2016 quasiyoke
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from unittest.mock import ANY
+import asynctest
+from asynctest.mock import call, patch, Mock, CoroutineMock
+from peewee import DatabaseError, SqliteDatabase
+from telepot.exception import TelegramError
+from randtalkbot import broadcast, stranger
+from randtalkbot.broadcast import Broadcast
+from randtalkbot.broadcast_service import get_outcome, BroadcastService
+from randtalkbot.errors import BroadcastServiceError, TransientSendingError
+from randtalkbot.rate_limiter import PRIORITY_BROADCAST, PRIORITY_NOTIFICATION
+from randtalkbot.stranger import Stranger
+
+BLOCKED_ERROR = TelegramError('Forbidden: bot was blocked by the user', 403, {})
+
+class TestBroadcastService(asynctest.TestCase):
+    def __init__(self, *args, **kwargs):
+        super(TestBroadcastService, self).__init__(*args, **kwargs)
+        self.database = SqliteDatabase(':memory:')
+
+    def setUp(self):
+        broadcast.DATABASE_PROXY.initialize(self.database)
+        stranger.DATABASE_PROXY.initialize(self.database)
+        self.database.create_tables([Broadcast, Stranger])
+        self.strangers = [
+            Stranger.create(invitation='foo', telegram_id=27183),
+            Stranger.create(invitation='bar', telegram_id=31416),
+            Stranger.create(invitation='baz', telegram_id=23571),
+            ]
+        self.bot = Mock()
+        self.bot.sendMessage = CoroutineMock()
+        self.broadcast_service = BroadcastService(self.bot, rate=1000)
+
+    def tearDown(self):
+        self.database.drop_tables([Broadcast, Stranger])
+
+    @asynctest.ignore_loop
+    def test_get_instance(self):
+        self.assertEqual(BroadcastService.get_instance(), self.broadcast_service)
+
+    @asynctest.ignore_loop
+    def test_get_outcome(self):
+        self.assertEqual(get_outcome(BLOCKED_ERROR), 'blocked')
+        self.assertEqual(get_outcome(TelegramError('Bad Request', 400, {})), 'failed')
+        self.assertEqual(get_outcome(TransientSendingError('Timeout', 403, {})), 'failed')
+
+    async def test_start(self):
+        self.broadcast_service._start = Mock()
+        started_broadcast = await self.broadcast_service.start('Hello', 31416)
+        self.bot.sendMessage.assert_called_once_with(
+            31416,
+            '*Rand Talk:* Hello',
+            parse_mode='Markdown',
+            )
+        self.assertEqual(Broadcast.get_unfinished().id, started_broadcast.id)
+        self.assertEqual(started_broadcast.text, 'Hello')
+        self.assertEqual(started_broadcast.admin_telegram_id, 31416)
+        self.broadcast_service._start.assert_called_once_with(started_broadcast)
+
+    async def test_start__in_progress(self):
+        self.broadcast_service._broadcast = Broadcast.create(text='Hi', admin_telegram_id=31416)
+        self.broadcast_service._start = Mock()
+        with self.assertRaises(BroadcastServiceError):
+            await self.broadcast_service.start('Hello', 31416)
+        self.bot.sendMessage.assert_not_called()
+        self.broadcast_service._start.assert_not_called()
+
+    async def test_start__started_while_sending_to_admin(self):
+        async def send_message(*unused_args, **unused_kwargs):
+            self.broadcast_service._broadcast = \
+                Broadcast.create(text='Hi', admin_telegram_id=31416)
+
+        self.bot.sendMessage.side_effect = send_message
+        self.broadcast_service._start = Mock()
+        with self.assertRaises(BroadcastServiceError):
+            await self.broadcast_service.start('Hello', 31416)
+        self.assertEqual(Broadcast.select().count(), 1)
+        self.broadcast_service._start.assert_not_called()
+
+    async def test_start__rejected_markdown(self):
+        self.bot.sendMessage.side_effect = TelegramError(
+            'Bad Request: can\'t parse entities',
+            400,
+            {},
+            )
+        self.broadcast_service._start = Mock()
+        with self.assertRaisesRegex(BroadcastServiceError, 'can\'t parse entities'):
+            await self.broadcast_service.start('*Hello', 31416)
+        self.assertEqual(Broadcast.select().count(), 0)
+        self.broadcast_service._start.assert_not_called()
+
+    @patch('randtalkbot.broadcast_service.LOGGER', Mock())
+    async def test_start__admin_unreachable(self):
+        from randtalkbot.broadcast_service import LOGGER
+        self.bot.sendMessage.side_effect = TransientSendingError('Timeout', 400, {})
+        self.broadcast_service._start = Mock()
+        started_broadcast = await self.broadcast_service.start('Hello', 31416)
+        self.assertTrue(LOGGER.warning.called)
+        self.broadcast_service._start.assert_called_once_with(started_broadcast)
+
+    @patch('randtalkbot.broadcast_service.Broadcast.create', Mock(side_effect=DatabaseError()))
+    async def test_start__database_error(self):
+        with self.assertRaises(BroadcastServiceError):
+            await self.broadcast_service.start('Hello', 31416)
+
+    @asynctest.ignore_loop
+    def test_resume(self):
+        Broadcast.create(text='Hi', admin_telegram_id=31416, finished='1970-01-01 00:00:00')
+        unfinished_broadcast = Broadcast.create(text='Hello', admin_telegram_id=31416, cursor=1)
+        self.broadcast_service._start = Mock()
+        self.broadcast_service.resume()
+        self.assertEqual(self.broadcast_service._start.call_args[0][0].id, unfinished_broadcast.id)
+
+    @asynctest.ignore_loop
+    def test_resume__no_unfinished_broadcast(self):
+        self.broadcast_service._start = Mock()
+        self.broadcast_service.resume()
+        self.broadcast_service._start.assert_not_called()
+
+    @patch('randtalkbot.broadcast_service.BroadcastService.PAGE_SIZE', 2)
+    async def test_run(self):
+        self.bot.sendMessage.side_effect = [
+            None,
+            BLOCKED_ERROR,
+            TelegramError('Bad Request: can\'t parse entities', 400, {}),
+            None,
+            ]
+        started_broadcast = Broadcast.create(text='Hello', admin_telegram_id=31416)
+        self.broadcast_service._broadcast = started_broadcast
+        await self.broadcast_service._run(started_broadcast)
+        self.assertEqual(
+            self.bot.sendMessage.call_args_list,
+            [
+                call(27183, '*Rand Talk:* Hello', parse_mode='Markdown'),
+                call(31416, '*Rand Talk:* Hello', parse_mode='Markdown'),
+                call(23571, '*Rand Talk:* Hello', parse_mode='Markdown'),
+                call(
+                    31416,
+                    '*Rand Talk:* Broadcast {0}: 3 of 3 strangers were processed. Delivered: 1, '
+                    'failed: 1, blocked: 1. Finished.'.format(started_broadcast.id),
+                    parse_mode='Markdown',
+                    ),
+                ],
+            )
+        saved_broadcast = Broadcast.get(id=started_broadcast.id)
+        self.assertEqual(saved_broadcast.cursor, self.strangers[2].id)
+        self.assertEqual(saved_broadcast.delivered_count, 1)
+        self.assertEqual(saved_broadcast.failed_count, 1)
+        self.assertEqual(saved_broadcast.blocked_count, 1)
+        self.assertIsNotNone(saved_broadcast.finished)
+        self.assertIsNone(self.broadcast_service.get_broadcast())
+
+    async def test_run__continues_after_cursor(self):
+        started_broadcast = Broadcast.create(
+            text='Hello',
+            admin_telegram_id=31416,
+            cursor=self.strangers[1].id,
+            delivered_count=2,
+            )
+        await self.broadcast_service._run(started_broadcast)
+        self.assertEqual(
+            self.bot.sendMessage.call_args_list,
+            [
+                call(23571, '*Rand Talk:* Hello', parse_mode='Markdown'),
+                call(31416, ANY, parse_mode='Markdown'),
+                ],
+            )
+        self.assertEqual(Broadcast.get(id=started_broadcast.id).delivered_count, 3)
+
+    async def test_run__uses_outbound_queue(self):
+        outbound_queue = Mock()
+        outbound_queue.send = CoroutineMock()
+        self.broadcast_service = BroadcastService(self.bot, outbound_queue=outbound_queue)
+        started_broadcast = Broadcast.create(
+            text='Hello',
+            admin_telegram_id=31416,
+            cursor=self.strangers[1].id,
+            )
+        await self.broadcast_service._run(started_broadcast)
+        self.assertEqual(
+            outbound_queue.send.call_args_list,
+            [
+                call(23571, ANY, PRIORITY_BROADCAST),
+                call(31416, ANY, PRIORITY_NOTIFICATION),
+                ],
+            )
+
+    async def test_run__database_error(self):
+        self.broadcast_service._get_recipients = Mock(side_effect=DatabaseError())
+        started_broadcast = Broadcast.create(text='Hello', admin_telegram_id=31416)
+        self.broadcast_service._broadcast = started_broadcast
+        await self.broadcast_service._run(started_broadcast)
+        self.bot.sendMessage.assert_called_once_with(
+            31416,
+            '*Rand Talk:* Broadcast {0} was interrupted by DB troubles and will be resumed after '
+            'restart.'.format(started_broadcast.id),
+            parse_mode='Markdown',
+            )
+        self.assertIsNone(Broadcast.get(id=started_broadcast.id).finished)
+        self.assertIsNone(self.broadcast_service.get_broadcast())
@@ -0,0 +1,120 @@
+# RandTalkBot Bot matching you with a random person on Telegram.
+# Copyright (C) 2016 quasiyoke
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+from unittest.mock import patch, Mock
+from randtalkbot.cache import Cache
+
+class TestCache(unittest.TestCase):
+    def setUp(self):
+        self.on_evict = Mock()
+        self.cache = Cache(capacity=3, ttl=100, on_evict=self.on_evict)
+
+    @patch('randtalkbot.cache.time')
+    def test_getitem__hit(self, time_mock):
+        time_mock.monotonic.return_value = 0
+        self.cache['foo'] = 'foo_value'
+        self.assertEqual(self.cache['foo'], 'foo_value')
+        self.assertEqual(self.cache.hits_count, 1)
+        self.assertEqual(self.cache.misses_count, 0)
+
+    def test_getitem__miss(self):
+        with self.assertRaises(KeyError):
+            self.cache['foo'] # pylint: disable=pointless-statement
+        self.assertEqual(self.cache.hits_count, 0)
+        self.assertEqual(self.cache.misses_count, 1)
+
+    @patch('randtalkbot.cache.time')
+    def test_setitem__evicts_least_recently_used(self, time_mock):
+        time_mock.monotonic.return_value = 0
+        self.cache['foo'] = 'foo_value'
+        self.cache['bar'] = 'bar_value'
+        self.cache['baz'] = 'baz_value'
+        self.cache['foo'] # pylint: disable=pointless-statement
+        self.cache['zig'] = 'zig_value'
+        self.assertNotIn('bar', self.cache)
+        self.assertIn('foo', self.cache)
+        self.assertEqual(len(self.cache), 3)
+        self.assertEqual(self.cache.evictions_count, 1)
+        self.on_evict.assert_called_once_with('bar', 'bar_value')
+
+    @patch('randtalkbot.cache.time')
+    def test_setitem__evicts_expired(self, time_mock):
+        time_mock.monotonic.return_value = 0
+        self.cache['foo'] = 'foo_value'
+        time_mock.monotonic.return_value = 50
+        self.cache['bar'] = 'bar_value'
+        time_mock.monotonic.return_value = 101
+        self.cache['baz'] = 'baz_value'
+        self.assertEqual(len(self.cache), 2)
+        self.assertNotIn('foo', self.cache)
+        self.on_evict.assert_called_once_with('foo', 'foo_value')
+
+    @patch('randtalkbot.cache.time')
+    def test_setitem__keeps_pinned(self, time_mock):
+        time_mock.monotonic.return_value = 0
+        self.cache = Cache(
+            capacity=2,
+            ttl=100,
+            is_pinned=lambda value: value == 'pinned',
+            on_evict=self.on_evict,
+            )
+        self.cache['foo'] = 'pinned'
+        self.cache['bar'] = 'bar_value'
+        time_mock.monotonic.return_value = 200
+        self.cache['baz'] = 'baz_value'
+        self.assertIn('foo', self.cache)
+        self.assertIn('baz', self.cache)
+        self.on_evict.assert_called_once_with('bar', 'bar_value')
+
+    @patch('randtalkbot.cache.time')
+    def test_setitem__keeps_just_put_entry(self, time_mock):
+        time_mock.monotonic.return_value = 0
+        self.cache = Cache(
+            capacity=1,
+            ttl=100,
+            is_pinned=lambda value: value == 'pinned',
+            on_evict=self.on_evict,
+            )
+        self.cache['foo'] = 'pinned'
+        self.cache['bar'] = 'pinned'
+        self.cache['baz'] = 'baz_value'
+        self.assertEqual(len(self.cache), 3)
+        self.on_evict.assert_not_called()
+
+    @patch('randtalkbot.cache.time')
+    def test_get_stats(self, time_mock):
+        time_mock.monotonic.return_value = 0
+        self.cache['foo'] = 'foo_value'
+        self.cache['foo'] # pylint: disable=pointless-statement
+        self.assertEqual(
+            self.cache.get_stats(),
+            {
+                'evictions': 0,
+                'hits': 1,
+                'misses': 0,
+                'size': 1,
+                },
+            )
+
+    def test_pop(self):
+        self.cache['foo'] = 'foo_value'
+        self.assertEqual(self.cache.pop('foo'), 'foo_value')
+        self.assertEqual(self.cache.pop('foo'), None)
+        self.assertEqual(len(self.cache), 0)
+        self.on_evict.assert_not_called()
+
+    def test_clear(self):
+        self.cache['foo'] = 'foo_value'
+        self.cache.clear()
+        self.assertEqual(len(self.cache), 0)
+        self.on_evict.assert_not_called()
+
+    def test_values(self):
+        self.cache['foo'] = 'foo_value'
+        self.cache['bar'] = 'bar_value'
+        self.assertEqual(self.cache.values(), ['foo_value', 'bar_value'])
+        self.assertEqual(self.cache.hits_count, 0)
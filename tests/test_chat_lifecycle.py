@@ -73,8 +73,6 @@ async def test_unsuccessful_search(ratio, text):
     with patch('randtalkbot.stranger.StatsService'):
         from randtalkbot.stranger import StatsService as stats_service_mock
         stats_service_mock.get_instance \
-            .return_value \
-            .get_stats \
             .return_value \
             .get_sex_ratio \
             .return_value = ratio
@@ -95,9 +93,10 @@ async def test_unsuccessful_search(ratio, text):
                 },
             ],
         })
-    await assert_sent_message(STRANGER1_1['telegram_id'], text, disable_notification=True)
+    # Advertisement's notifications are joined.
     await assert_sent_message(
         STRANGER1_1['telegram_id'],
+        text + '\n\n'
         '*Rand Talk:* Do[\u2009](http://randtalk.ml/static/img/logo-125x125.png) you want'
         ' to talk with somebody, practice in foreign languages or you just'
         ' want to have some fun? Rand Talk will help you! It\'s a bot matching you'
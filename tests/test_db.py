@@ -7,6 +7,7 @@
 import unittest
 from unittest.mock import create_autospec, patch, Mock
 from peewee import DatabaseError
+from randtalkbot.broadcast import Broadcast
 from randtalkbot.db import DB, RetryingDB
 from randtalkbot.errors import DBError
 from randtalkbot.stats import Stats
@@ -15,11 +16,19 @@ from randtalkbot.talk import Talk
 
 class TestDB(unittest.TestCase):
     @patch('randtalkbot.db.RetryingDB', create_autospec(RetryingDB))
+    @patch('randtalkbot.db.broadcast')
     @patch('randtalkbot.db.stats')
     @patch('randtalkbot.db.stranger')
     @patch('randtalkbot.db.talk')
-    def setUp(self, stats_module_mock, stranger_module_mock, talk_module_mock):
+    def setUp(
+            self,
+            stats_module_mock,
+            stranger_module_mock,
+            talk_module_mock,
+            broadcast_module_mock,
+        ):
         from randtalkbot.db import RetryingDB as retrying_db_cls_mock
+        self.broadcast_module_mock = broadcast_module_mock
         self.stats_module_mock = stats_module_mock
         self.stranger_module_mock = stranger_module_mock
         self.talk_module_mock = talk_module_mock
@@ -41,6 +50,7 @@ class TestDB(unittest.TestCase):
             user='foo_user',
             password='foo_password',
             )
+        self.broadcast_module_mock.DATABASE_PROXY.initialize.assert_called_once_with(self.database)
         self.stats_module_mock.DATABASE_PROXY.initialize.assert_called_once_with(self.database)
         self.stranger_module_mock.DATABASE_PROXY.initialize.assert_called_once_with(self.database)
         self.talk_module_mock.DATABASE_PROXY.initialize.assert_called_once_with(self.database)
@@ -50,9 +60,26 @@ class TestDB(unittest.TestCase):
         with self.assertRaises(DBError):
             DB(self.configuration)
 
-    def test_install__ok(self):
+    @patch('randtalkbot.db.migrate')
+    def test_install__ok(self, migrate_mock):
+        period_column = Mock()
+        period_column.name = 'period'
+        self.database.get_columns.return_value = [period_column]
         self.db.install()
-        self.database.create_tables.assert_called_once_with([Stats, Stranger, Talk])
+        self.database.create_tables.assert_called_once_with(
+            [Broadcast, Stats, Stranger, Talk],
+            safe=True,
+            )
+        migrate_mock.assert_not_called()
+
+    @patch('randtalkbot.db.MySQLMigrator')
+    @patch('randtalkbot.db.migrate')
+    def test_install__adds_stats_period(self, migrate_mock, migrator_cls_mock):
+        self.database.get_columns.return_value = []
+        self.db.install()
+        migrator_cls_mock.return_value.add_column \
+            .assert_called_once_with('stats', 'period', Stats.period)
+        migrate_mock.assert_called_once_with(migrator_cls_mock.return_value.add_column.return_value)
 
     def test_install__database_error(self):
         self.database.create_tables.side_effect = DatabaseError()
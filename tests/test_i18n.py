@@ -4,12 +4,34 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import os
+import subprocess
+import sys
+import tempfile
 import unittest
-from unittest.mock import call, patch
-from randtalkbot.i18n import get_languages_names, get_languages_codes, get_translation, \
-    LanguageNotFoundError
+from unittest.mock import ANY, call, DEFAULT, Mock, patch
+from randtalkbot.errors import StrangerSenderServiceError
+from randtalkbot.i18n import get_languages_names, get_languages_codes, get_locales, \
+    get_translation, get_translation_languages, LanguageNotFoundError, reload_translations
+from randtalkbot.stranger_sender import TRANSLATED_ARTICLES
+from randtalkbot.trie import Trie
+
+IMPORT_CHECK = '''
+import gettext
+import sys
+import randtalkbot.i18n
+print(randtalkbot.i18n._get_languages_tables.cache_info().currsize)
+print(randtalkbot.i18n._get_languages_trie.cache_info().currsize)
+print(len(gettext._translations))
+print('pycountry' in sys.modules)
+'''
 
 class TestI18n(unittest.TestCase):
+    def setUp(self):
+        translations_patcher = patch('randtalkbot.i18n.TRANSLATIONS', {})
+        self.translations = translations_patcher.start()
+        self.addCleanup(translations_patcher.stop)
+
     def test_get_languages_names__supported(self):
         self.assertEqual(get_languages_names(['ru']), 'Русский')
 
@@ -42,10 +64,27 @@ class TestI18n(unittest.TestCase):
         with self.assertRaises(LanguageNotFoundError):
             get_languages_codes('Foo language')
 
+    def test_get_languages_codes__misspelt(self):
+        self.assertEqual(get_languages_codes('Englsh, Itallian, Rusian'), ['en', 'it', 'ru'])
+
+    def test_get_languages_codes__misspelt_code(self):
+        with self.assertRaises(LanguageNotFoundError):
+            get_languages_codes('ei')
+
+    def test_get_languages_codes__ambiguous(self):
+        languages_trie = Trie()
+        languages_trie['kurdish'] = 'ku'
+        languages_trie['turkish'] = 'tr'
+
+        with patch('randtalkbot.i18n._get_languages_trie', Mock(return_value=languages_trie)):
+            with self.assertRaises(LanguageNotFoundError):
+                get_languages_codes('Kurkish')
+
     def test_get_languages_codes__has_no_iso639_1_code(self):
         with self.assertRaises(LanguageNotFoundError):
             get_languages_codes('zza')
 
+    @patch('randtalkbot.i18n.get_locales', Mock(return_value=('en', 'foo')))
     @patch('randtalkbot.i18n.gettext')
     @patch('randtalkbot.i18n.LOCALE_DIR', 'foo_locale_dir')
     def test_get_translation__no_languages(self, gettext):
@@ -56,6 +95,7 @@ class TestI18n(unittest.TestCase):
             languages=['en'],
             )
 
+    @patch('randtalkbot.i18n.get_locales', Mock(return_value=('en', 'foo')))
     @patch('randtalkbot.i18n.gettext')
     @patch('randtalkbot.i18n.LOCALE_DIR', 'foo_locale_dir')
     def test_get_translation__ok(self, gettext):
@@ -66,6 +106,7 @@ class TestI18n(unittest.TestCase):
             languages=['foo'],
             )
 
+    @patch('randtalkbot.i18n.get_locales', Mock(return_value=('en', 'foo')))
     @patch('randtalkbot.i18n.gettext')
     @patch('randtalkbot.i18n.LOCALE_DIR', 'foo_locale_dir')
     def test_get_translation__not_supported_language(self, gettext):
@@ -87,3 +128,107 @@ class TestI18n(unittest.TestCase):
                     ),
                 ],
             )
+
+    @patch('randtalkbot.i18n.get_locales', Mock(return_value=('en', 'foo')))
+    @patch('randtalkbot.i18n.gettext')
+    def test_get_translation__memoized(self, gettext):
+        self.assertEqual(get_translation(['foo']), gettext.translation.return_value.gettext)
+        self.assertEqual(get_translation(('foo', )), gettext.translation.return_value.gettext)
+        gettext.translation.assert_called_once_with(
+            'randtalkbot',
+            localedir=ANY,
+            languages=['foo'],
+            )
+
+    @patch('randtalkbot.i18n.get_locales', Mock(return_value=('en', 'foo')))
+    @patch('randtalkbot.i18n.gettext')
+    def test_get_translation__not_supported_language_memoized(self, gettext):
+        gettext.translation.side_effect = [OSError, DEFAULT]
+        self.assertEqual(get_translation(['foo']), gettext.translation.return_value.gettext)
+        self.assertEqual(get_translation(['foo']), gettext.translation.return_value.gettext)
+        self.assertEqual(gettext.translation.call_count, 2)
+
+    @patch('randtalkbot.i18n.get_locales', Mock(return_value=('en', 'foo')))
+    @patch('randtalkbot.i18n.gettext')
+    def test_get_translation__normalized(self, gettext):
+        get_translation(['bar', 'en'])
+        get_translation(['en', 'en'])
+        get_translation(None)
+        get_translation(['foo', 'bar', 'foo'])
+        self.assertEqual(
+            gettext.translation.call_args_list,
+            [
+                call('randtalkbot', localedir=ANY, languages=['en']),
+                call('randtalkbot', localedir=ANY, languages=['foo']),
+                ],
+            )
+        self.assertEqual(set(self.translations), {('en', ), ('foo', )})
+
+    @patch('randtalkbot.i18n.get_locales', Mock(return_value=('de', 'en', 'ru')))
+    def test_get_translation_languages(self):
+        self.assertEqual(get_translation_languages(['fa', 'ru', 'en', 'ru']), ('ru', 'en'))
+
+    @patch('randtalkbot.i18n.get_locales', Mock(return_value=('de', 'en', 'ru')))
+    def test_get_translation_languages__no_locales(self):
+        self.assertEqual(get_translation_languages(['fa', 'same']), ('en', ))
+
+    def test_get_locales(self):
+        get_locales.cache_clear()
+        self.addCleanup(get_locales.cache_clear)
+
+        with tempfile.TemporaryDirectory() as locale_dir, \
+                patch('randtalkbot.i18n.LOCALE_DIR', locale_dir):
+            os.mkdir(os.path.join(locale_dir, 'ru'))
+            os.mkdir(os.path.join(locale_dir, 'en'))
+            open(os.path.join(locale_dir, 'README'), 'w').close()
+            self.assertEqual(get_locales(), ('en', 'ru'))
+            os.mkdir(os.path.join(locale_dir, 'de'))
+            self.assertEqual(get_locales(), ('en', 'ru'))
+
+    @patch('randtalkbot.stranger_sender_service.StrangerSenderService')
+    @patch('randtalkbot.stranger.get_sex_names_to_codes')
+    @patch('randtalkbot.i18n.load_translations')
+    @patch('randtalkbot.i18n.gettext')
+    def test_reload_translations(
+            self,
+            gettext,
+            load_translations,
+            get_sex_names_to_codes,
+            stranger_sender_service_cls,
+        ):
+        get_translation(['foo'])
+        TRANSLATED_ARTICLES[('foo', ), ('bar', )] = ['baz']
+
+        with patch('randtalkbot.i18n.get_locales') as get_locales_mock:
+            reload_translations()
+
+        self.assertEqual(self.translations, {})
+        self.assertEqual(len(TRANSLATED_ARTICLES), 0)
+        get_locales_mock.cache_clear.assert_called_once_with()
+        gettext._translations.clear.assert_called_once_with()
+        get_sex_names_to_codes.cache_clear.assert_called_once_with()
+        load_translations.assert_called_once_with()
+        stranger_sender_service_cls.get_instance.return_value \
+            .reload_translations \
+            .assert_called_once_with()
+
+    @patch('randtalkbot.stranger_sender_service.StrangerSenderService')
+    @patch('randtalkbot.i18n.load_translations', Mock())
+    @patch('randtalkbot.i18n.gettext', Mock())
+    def test_reload_translations__no_stranger_sender_service(self, stranger_sender_service_cls):
+        stranger_sender_service_cls.get_instance.side_effect = StrangerSenderServiceError()
+        reload_translations()
+        self.assertEqual(self.translations, {})
+
+    def test_import(self):
+        output = subprocess.check_output(
+            [sys.executable, '-c', IMPORT_CHECK],
+            cwd=os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir),
+            universal_newlines=True,
+            )
+        # Import time itself is tracked by `benchmarks/import_time.py`.
+        tables_count, tries_count, translations_count, is_pycountry_imported = output.split()
+        self.assertEqual(tables_count, '0')
+        self.assertEqual(tries_count, '0')
+        self.assertEqual(translations_count, '0')
+        self.assertEqual(is_pycountry_imported, 'False')
@@ -0,0 +1,51 @@
+# RandTalkBot Bot matching you with a random person on Telegram.
+# Copyright (C) 2016 quasiyoke
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asynctest
+from asynctest.mock import patch, Mock
+from randtalkbot.loop_monitor import get_task_name, LoopMonitor
+
+async def handle_foo():
+    pass
+
+class TestLoopMonitor(asynctest.TestCase):
+    def setUp(self):
+        self.loop_monitor = LoopMonitor(lag_probe_interval=1, slow_callback_threshold=0.1)
+
+    @asynctest.ignore_loop
+    def test_init__defaults(self):
+        loop_monitor = LoopMonitor()
+        self.assertEqual(loop_monitor._lag_probe_interval, LoopMonitor.LAG_PROBE_INTERVAL)
+        self.assertEqual(loop_monitor._slow_callback_threshold, None)
+
+    @asynctest.ignore_loop
+    def test_get_task_name(self):
+        task = Mock(_coro=handle_foo())
+        self.assertEqual(get_task_name(task), 'handle_foo')
+        self.assertEqual(get_task_name(None), 'callback')
+        task._coro.close()
+
+    @patch('randtalkbot.loop_monitor.threading', Mock())
+    @patch('randtalkbot.loop_monitor.EVENT_LOOP_LAG_SECONDS')
+    @patch('randtalkbot.loop_monitor.asyncio')
+    async def test_run(self, asyncio_mock, lag_mock):
+        loop = asyncio_mock.get_event_loop.return_value
+        loop.time.side_effect = [10, 11.25]
+        asyncio_mock.sleep = asynctest.CoroutineMock(side_effect=[None, RuntimeError])
+        with self.assertRaises(RuntimeError):
+            await self.loop_monitor.run()
+        lag_mock.observe.assert_called_once_with(0.25)
+        loop.call_later.assert_called_once_with(0.05, self.loop_monitor._beat)
+
+    @patch('randtalkbot.loop_monitor.LOGGER')
+    @patch('randtalkbot.loop_monitor.SLOW_CALLBACKS')
+    @patch('randtalkbot.loop_monitor.get_current_task', Mock(return_value=None))
+    @asynctest.ignore_loop
+    def test_report_slow_callback(self, slow_callbacks_mock, logger_mock):
+        self.loop_monitor._loop_thread_id = -1
+        self.loop_monitor._report_slow_callback(0.5)
+        slow_callbacks_mock.inc.assert_called_once_with(task='callback')
+        self.assertTrue(logger_mock.warning.called)
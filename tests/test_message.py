@@ -141,6 +141,14 @@ class TestMessage(unittest.TestCase):
         self.assertEqual(message.command, 'begin_chat')
         self.assertEqual(message.command_args, 'here')
 
+    @patch('randtalkbot.message.telepot')
+    def test_init__command_with_multiline_args(self, telepot):
+        telepot.glance.return_value = 'text', 'private', 31416
+        self.message_json['text'] = '/broadcast Hello\neveryone'
+        message = Message(self.message_json)
+        self.assertEqual(message.command, 'broadcast')
+        self.assertEqual(message.command_args, 'Hello\neveryone')
+
     def test_init__document(self):
         self.message_json['document'] = {
             'file_id': 'foo',
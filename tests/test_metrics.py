@@ -0,0 +1,94 @@
+# RandTalkBot Bot matching you with a random person on Telegram.
+# Copyright (C) 2016 quasiyoke
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+from unittest.mock import Mock
+from randtalkbot.metrics import Counter, Gauge, Histogram, Registry
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.registry = Registry()
+
+    def test_counter(self):
+        counter = Counter('foo_total', 'Foo.', ('kind', ), registry=self.registry)
+        counter.inc(kind='bar')
+        counter.inc(2, kind='bar')
+        counter.inc(kind='baz"')
+        self.assertEqual(
+            self.registry.render(),
+            '# HELP foo_total Foo.\n'
+            '# TYPE foo_total counter\n'
+            'foo_total{kind="bar"} 3\n'
+            'foo_total{kind="baz\\""} 1\n',
+            )
+
+    def test_counter__wrong_labels(self):
+        counter = Counter('foo_total', 'Foo.', ('kind', ), registry=self.registry)
+        with self.assertRaises(ValueError):
+            counter.inc(type='bar')
+
+    def test_counter__function(self):
+        counter = Counter('foo_total', 'Foo.', ('cache', ), registry=self.registry)
+        counter.set_function(Mock(return_value=10), cache='bar')
+        counter.set_function(Mock(side_effect=RuntimeError), cache='baz')
+        self.assertEqual(
+            self.registry.render(),
+            '# HELP foo_total Foo.\n'
+            '# TYPE foo_total counter\n'
+            'foo_total{cache="bar"} 10\n',
+            )
+
+    def test_gauge(self):
+        gauge = Gauge('foo', 'Foo.', registry=self.registry)
+        gauge.set(1.5)
+        self.assertEqual(
+            self.registry.render(),
+            '# HELP foo Foo.\n'
+            '# TYPE foo gauge\n'
+            'foo 1.5\n',
+            )
+
+    def test_gauge__inc_dec(self):
+        gauge = Gauge('foo', 'Foo.', ('method', ), registry=self.registry)
+        gauge.inc(method='bar')
+        gauge.inc(2, method='bar')
+        gauge.dec(method='bar')
+        gauge.inc(method='baz')
+        gauge.dec(method='baz')
+        self.assertEqual(
+            self.registry.render(),
+            '# HELP foo Foo.\n'
+            '# TYPE foo gauge\n'
+            'foo{method="bar"} 2\n'
+            'foo{method="baz"} 0\n',
+            )
+
+    def test_gauge__function(self):
+        gauge = Gauge('foo', 'Foo.', ('cache', ), registry=self.registry)
+        gauge.set_function(Mock(return_value=10), cache='bar')
+        gauge.set_function(Mock(side_effect=RuntimeError), cache='baz')
+        self.assertEqual(
+            self.registry.render(),
+            '# HELP foo Foo.\n'
+            '# TYPE foo gauge\n'
+            'foo{cache="bar"} 10\n',
+            )
+
+    def test_histogram(self):
+        histogram = Histogram('foo_seconds', 'Foo.', buckets=(0.1, 1), registry=self.registry)
+        histogram.observe(0.05)
+        histogram.observe(0.5)
+        histogram.observe(5)
+        self.assertEqual(
+            self.registry.render(),
+            '# HELP foo_seconds Foo.\n'
+            '# TYPE foo_seconds histogram\n'
+            'foo_seconds_bucket{le="0.1"} 1\n'
+            'foo_seconds_bucket{le="1"} 2\n'
+            'foo_seconds_bucket{le="+Inf"} 3\n'
+            'foo_seconds_sum 5.55\n'
+            'foo_seconds_count 3\n',
+            )
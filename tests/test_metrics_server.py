@@ -0,0 +1,63 @@
+# RandTalkBot Bot matching you with a random person on Telegram.
+# Copyright (C) 2016 quasiyoke
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asynctest
+from asynctest.mock import CoroutineMock, Mock
+from randtalkbot.metrics_server import MetricsServer
+
+class TestMetricsServer(asynctest.TestCase):
+    def setUp(self):
+        self.registry = Mock()
+        self.registry.render.return_value = 'foo 1\n'
+        self.metrics_server = MetricsServer('127.0.0.1', 9100, registry=self.registry)
+
+    @asynctest.ignore_loop
+    def test_get_response__ok(self):
+        self.assertEqual(
+            self.metrics_server._get_response(b'GET /metrics HTTP/1.1\r\n'),
+            ('200 OK', 'foo 1\n'),
+            )
+
+    @asynctest.ignore_loop
+    def test_get_response__not_found(self):
+        self.assertEqual(
+            self.metrics_server._get_response(b'GET / HTTP/1.1\r\n')[0],
+            '404 Not Found',
+            )
+
+    @asynctest.ignore_loop
+    def test_get_response__method_not_allowed(self):
+        self.assertEqual(
+            self.metrics_server._get_response(b'POST /metrics HTTP/1.1\r\n')[0],
+            '405 Method Not Allowed',
+            )
+
+    @asynctest.ignore_loop
+    def test_get_response__bad_request(self):
+        self.assertEqual(
+            self.metrics_server._get_response(b'\xff\r\n')[0],
+            '400 Bad Request',
+            )
+
+    async def test_handle_connection(self):
+        reader = Mock()
+        reader.readline = CoroutineMock(side_effect=[
+            b'GET /metrics HTTP/1.1\r\n',
+            b'Host: localhost\r\n',
+            b'\r\n',
+            ])
+        writer = Mock()
+        writer.drain = CoroutineMock()
+        await self.metrics_server._handle_connection(reader, writer)
+        self.assertEqual(
+            b''.join(call[0][0] for call in writer.write.call_args_list),
+            b'HTTP/1.0 200 OK\r\n'
+            b'Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n'
+            b'Content-Length: 6\r\n'
+            b'\r\n'
+            b'foo 1\n',
+            )
+        writer.close.assert_called_once_with()
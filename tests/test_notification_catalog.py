@@ -0,0 +1,74 @@
+# RandTalkBot Bot matching you with a random person on Telegram.
+# Copyright (C) 2016 quasiyoke
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+from unittest.mock import Mock
+from randtalkbot.notification_catalog import escape_markdown, get_notification_catalog, \
+    NotificationCatalog, NotificationTemplate
+
+class TestEscapeMarkdown(unittest.TestCase):
+    def test_escape_markdown(self):
+        self.assertEqual(
+            escape_markdown('*foo* _bar_ [baz](http://boo.com) `zig`'),
+            '\\*foo\\* \\_bar\\_ \\[baz](http://boo.com) \\`zig\\`',
+            )
+
+    def test_escape_markdown__not_str(self):
+        self.assertEqual(escape_markdown(42), '42')
+
+
+class TestNotificationTemplate(unittest.TestCase):
+    def test_render__constant(self):
+        template = NotificationTemplate('*Rand Talk:* Chat was finished. {{braces}}')
+        self.assertEqual(template.render(()), '*Rand Talk:* Chat was finished. {braces}')
+        self.assertEqual(template.render(('foo', )), '*Rand Talk:* Chat was finished. {braces}')
+
+    def test_render__auto_numbered(self):
+        template = NotificationTemplate('{} foo {}')
+        self.assertEqual(template.render(('*bar*', 42)), '\\*bar\\* foo 42')
+
+    def test_render__numbered(self):
+        template = NotificationTemplate('{0} {2} foo {1}{0}')
+        self.assertEqual(template.render(('zero', 'one', 2)), 'zero 2 foo onezero')
+
+    def test_render__complex_fields(self):
+        template = NotificationTemplate('{0:>5} {1!r}')
+        self.assertEqual(template.render(('_a', 'b')), '  \\_a \'b\'')
+
+    def test_render__not_enough_args(self):
+        template = NotificationTemplate('{0} {1}')
+
+        with self.assertRaises(IndexError):
+            template.render(('foo', ))
+
+
+class TestNotificationCatalog(unittest.TestCase):
+    def setUp(self):
+        self.translation = Mock(return_value='foo_translation {}')
+        self.catalog = NotificationCatalog(self.translation)
+
+    def test_render(self):
+        self.assertEqual(self.catalog.render('foo', ('bar', )), '*Rand Talk:* foo_translation bar')
+        self.assertEqual(self.catalog.render('foo', ('baz', )), '*Rand Talk:* foo_translation baz')
+        self.translation.assert_called_once_with('foo')
+
+    def test_render__bounded(self):
+        translation = Mock(side_effect=lambda message: message)
+        self.catalog = NotificationCatalog(translation, templates_capacity=2)
+        self.catalog.render('Foo {0}', ('bar', ))
+
+        # Already formatted notifications.
+        for message in ('Baz 1 min', 'Baz 2 min', 'Baz 3 min'):
+            self.catalog.render(message)
+
+        self.assertEqual(len(self.catalog._templates), 2)
+        self.assertEqual(self.catalog.render('Foo {0}', ('bar', )), '*Rand Talk:* Foo bar')
+        self.assertEqual(translation.call_count, 5)
+
+    def test_get_notification_catalog(self):
+        catalog = get_notification_catalog(self.translation)
+        self.assertIs(get_notification_catalog(self.translation), catalog)
+        self.assertIsNot(get_notification_catalog(Mock()), catalog)
@@ -0,0 +1,145 @@
+# RandTalkBot Bot matching you with a random person on Telegram.
+# Copyright (C) 2016 quasiyoke
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import aiohttp
+import asynctest
+from asynctest.mock import call, patch, CoroutineMock
+from telepot.exception import BadHTTPResponse, BotWasBlockedError, TelegramError, \
+    TooManyRequestsError
+from randtalkbot.errors import TransientSendingError
+from randtalkbot.outbound_queue import get_error_code, get_retry_after, is_transient_error, \
+    OutboundQueue
+from randtalkbot.rate_limiter import PRIORITY_RELAY
+
+def get_too_many_requests_error(retry_after):
+    return TooManyRequestsError(
+        'Too Many Requests: retry after {}'.format(retry_after),
+        429,
+        {'parameters': {'retry_after': retry_after}},
+        )
+
+class TestOutboundQueue(asynctest.TestCase):
+    def setUp(self):
+        self.rate_limiter = CoroutineMock()
+        self.outbound_queue = OutboundQueue(rate_limiter=self.rate_limiter, max_attempts=3)
+
+    @asynctest.ignore_loop
+    def test_get_error_code(self):
+        self.assertEqual(
+            get_error_code(BotWasBlockedError('Forbidden: bot was blocked by the user', 403, {})),
+            '403',
+            )
+        self.assertEqual(get_error_code(get_too_many_requests_error(5)), '429')
+        self.assertEqual(get_error_code(TelegramError('Bad Request', 400, {})), '400')
+        self.assertEqual(get_error_code(TelegramError('Response timeout', 504, {})), '5xx')
+        self.assertEqual(get_error_code(BadHTTPResponse(502, 'Bad Gateway', None)), '5xx')
+        self.assertEqual(get_error_code(TelegramError('Connection Error', 400, {})), 'network')
+        self.assertEqual(get_error_code(asyncio.TimeoutError()), 'network')
+        self.assertEqual(get_error_code(TelegramError('Foo', None, {})), 'unknown')
+        self.assertEqual(get_error_code(ValueError()), 'unknown')
+
+    @asynctest.ignore_loop
+    def test_get_retry_after(self):
+        self.assertEqual(get_retry_after(get_too_many_requests_error(5)), 5)
+        self.assertEqual(get_retry_after(TelegramError('Too Many Requests', 429, {})), 1)
+        self.assertIsNone(get_retry_after(TelegramError('Bad Request', 400, {})))
+        self.assertIsNone(get_retry_after(OSError()))
+
+    @asynctest.ignore_loop
+    def test_is_transient_error(self):
+        self.assertTrue(is_transient_error(TelegramError('Response timeout', 504, {})))
+        self.assertTrue(is_transient_error(TelegramError('Connection Error', 400, {})))
+        self.assertTrue(is_transient_error(BadHTTPResponse(502, 'Bad Gateway', None)))
+        self.assertTrue(is_transient_error(aiohttp.ClientPayloadError()))
+        self.assertTrue(is_transient_error(asyncio.TimeoutError()))
+        self.assertFalse(is_transient_error(
+            BotWasBlockedError('Forbidden: bot was blocked by the user', 403, {}),
+            ))
+        self.assertFalse(is_transient_error(
+            TelegramError('Forbidden: user is deactivated', 403, {}),
+            ))
+        self.assertFalse(is_transient_error(BadHTTPResponse(404, 'Not Found', None)))
+        self.assertFalse(is_transient_error(ValueError()))
+
+    async def test_send__ok(self):
+        send_function = CoroutineMock(return_value='foo_result')
+        self.assertEqual(
+            await self.outbound_queue.send(31416, send_function, PRIORITY_RELAY),
+            'foo_result',
+            )
+        self.rate_limiter.acquire.assert_called_once_with(31416, PRIORITY_RELAY)
+        self.assertEqual(self.outbound_queue._chats_locks, {})
+
+    @patch('randtalkbot.outbound_queue.asyncio.sleep', CoroutineMock())
+    @patch('randtalkbot.outbound_queue.random.uniform', lambda a, b: b)
+    async def test_send__retry_after(self):
+        from randtalkbot.outbound_queue import asyncio as asyncio_mock
+        send_function = CoroutineMock(side_effect=[get_too_many_requests_error(5), 'foo_result'])
+        self.assertEqual(await self.outbound_queue.send(31416, send_function), 'foo_result')
+        asyncio_mock.sleep.assert_called_once_with(5.5)
+        self.assertEqual(self.rate_limiter.acquire.call_count, 2)
+
+    @patch('randtalkbot.outbound_queue.asyncio.sleep', CoroutineMock())
+    async def test_send__retry_after_too_long(self):
+        from randtalkbot.outbound_queue import asyncio as asyncio_mock
+        send_function = CoroutineMock(side_effect=get_too_many_requests_error(3600))
+
+        with self.assertRaises(TransientSendingError):
+            await self.outbound_queue.send(31416, send_function)
+
+        asyncio_mock.sleep.assert_not_called()
+
+    @patch('randtalkbot.outbound_queue.asyncio.sleep', CoroutineMock())
+    @patch('randtalkbot.outbound_queue.random.uniform', lambda a, b: b)
+    async def test_send__transient_errors(self):
+        from randtalkbot.outbound_queue import asyncio as asyncio_mock
+        send_function = CoroutineMock(side_effect=TelegramError('Response timeout', 504, {}))
+
+        with self.assertRaises(TransientSendingError):
+            await self.outbound_queue.send(31416, send_function)
+
+        self.assertEqual(send_function.call_count, 3)
+        self.assertEqual(asyncio_mock.sleep.call_args_list, [call(0.5), call(1)])
+
+    @patch('randtalkbot.outbound_queue.asyncio.sleep', CoroutineMock())
+    async def test_send__permanent_error(self):
+        from randtalkbot.outbound_queue import asyncio as asyncio_mock
+        error = BotWasBlockedError('Forbidden: bot was blocked by the user', 403, {})
+        send_function = CoroutineMock(side_effect=error)
+
+        with self.assertRaises(BotWasBlockedError):
+            await self.outbound_queue.send(31416, send_function)
+
+        send_function.assert_called_once_with()
+        asyncio_mock.sleep.assert_not_called()
+        self.assertEqual(self.outbound_queue._chats_locks, {})
+
+    async def test_send__keeps_chat_order(self):
+        sent = []
+        first_attempt = [True]
+
+        async def send_first():
+            if first_attempt[0]:
+                first_attempt[0] = False
+                raise get_too_many_requests_error(0.01)
+
+            sent.append('first')
+
+        async def send_second():
+            sent.append('second')
+
+        async def send_other_chat():
+            sent.append('other_chat')
+
+        # Tasks are created explicitly because gather() doesn't keep the order of coroutines
+        # scheduling on Python 3.6.
+        await asyncio.gather(
+            self.loop.create_task(self.outbound_queue.send(31416, send_first)),
+            self.loop.create_task(self.outbound_queue.send(31416, send_second)),
+            self.loop.create_task(self.outbound_queue.send(27183, send_other_chat)),
+            )
+        self.assertEqual(sent, ['other_chat', 'first', 'second'])
@@ -0,0 +1,76 @@
+# RandTalkBot Bot matching you with a random person on Telegram.
+# Copyright (C) 2016 quasiyoke
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import random
+import unittest
+from randtalkbot.quantile_sketch import QuantileSketch
+
+class TestQuantileSketch(unittest.TestCase):
+    def setUp(self):
+        self.sketch = QuantileSketch()
+
+    def test_get_quantiles__empty(self):
+        self.assertEqual(
+            self.sketch.get_quantiles(),
+            {'p50': None, 'p90': None, 'p99': None, 'p999': None},
+            )
+
+    def test_get_quantiles__relative_accuracy(self):
+        random_instance = random.Random(0)
+        values = [random_instance.expovariate(1 / 300) for unused_i in range(10000)]
+
+        for value in values:
+            self.sketch.add(value)
+
+        values.sort()
+
+        for name, quantile in QuantileSketch.QUANTILES:
+            expected = values[int(quantile * (len(values) - 1))]
+            self.assertLessEqual(
+                abs(self.sketch.get_quantiles()[name] - expected),
+                expected * QuantileSketch.RELATIVE_ACCURACY,
+                )
+
+    def test_get_quantile__zeros(self):
+        for value in (0, 0, 0, 100):
+            self.sketch.add(value)
+
+        self.assertEqual(self.sketch.get_quantile(0.5), 0)
+        self.assertAlmostEqual(self.sketch.get_quantile(1), 100, delta=1)
+
+    def test_merge(self):
+        other = QuantileSketch()
+        combined = QuantileSketch()
+
+        for value in (0, 1, 5, 60):
+            self.sketch.add(value)
+            combined.add(value)
+
+        for value in (5, 300, 3600):
+            other.add(value)
+            combined.add(value)
+
+        self.sketch.merge(other)
+        self.assertEqual(self.sketch.count, 7)
+        self.assertEqual(self.sketch.get_data(), combined.get_data())
+
+    def test_get_data(self):
+        for value in (0, 1, 1.03):
+            self.sketch.add(value)
+
+        self.assertEqual(
+            self.sketch.get_data(),
+            {'counts': [1, 0, 1], 'offset': 0, 'zero_count': 1},
+            )
+
+    def test_from_data(self):
+        for value in (0, 10, 10, 3600):
+            self.sketch.add(value)
+
+        sketch = QuantileSketch.from_data(self.sketch.get_data())
+        self.assertEqual(sketch.count, 4)
+        self.assertEqual(sketch.get_data(), self.sketch.get_data())
+        self.assertEqual(sketch.get_quantiles(), self.sketch.get_quantiles())
@@ -0,0 +1,85 @@
+# RandTalkBot Bot matching you with a random person on Telegram.
+# Copyright (C) 2016 quasiyoke
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import asynctest
+from asynctest.mock import patch
+from randtalkbot.rate_limiter import PRIORITY_NOTIFICATION, PRIORITY_PROMOTION, PRIORITY_RELAY, \
+    RateLimiter
+
+class TestRateLimiter(asynctest.TestCase):
+    forbid_get_event_loop = False
+
+    async def _acquire_all(self, rate_limiter, requests):
+        """Returns:
+            list: Pairs (request, delay) in the order of acquiring.
+        """
+        start = self.loop.time()
+        acquired = []
+
+        async def acquire(request):
+            await rate_limiter.acquire(*request)
+            acquired.append((request, self.loop.time() - start))
+
+        await asyncio.gather(*[acquire(request) for request in requests])
+        return acquired
+
+    async def test_acquire__chat_burst(self):
+        rate_limiter = RateLimiter(global_rate=1000, chat_rate=20, chat_burst=2)
+        acquired = await self._acquire_all(
+            rate_limiter,
+            [(1, PRIORITY_RELAY), (1, PRIORITY_RELAY), (1, PRIORITY_RELAY), (2, PRIORITY_RELAY)],
+            )
+        delays = {request: delay for request, delay in acquired}
+        self.assertLess(delays[(2, PRIORITY_RELAY)], 0.02)
+        self.assertEqual([request for request, delay in acquired][-1], (1, PRIORITY_RELAY))
+        self.assertGreaterEqual(acquired[-1][1], 0.045)
+
+    async def test_acquire__global_rate(self):
+        rate_limiter = RateLimiter(global_rate=20, chat_rate=1000)
+        acquired = await self._acquire_all(
+            rate_limiter,
+            [(chat_id, PRIORITY_NOTIFICATION) for chat_id in range(22)],
+            )
+        self.assertGreaterEqual(acquired[-1][1], 0.095)
+
+    async def test_acquire__priorities(self):
+        rate_limiter = RateLimiter(global_rate=20, chat_rate=1000)
+        # Exhausts global bucket.
+        await self._acquire_all(
+            rate_limiter,
+            [(chat_id, PRIORITY_NOTIFICATION) for chat_id in range(20)],
+            )
+        acquired = await self._acquire_all(
+            rate_limiter,
+            [(100, PRIORITY_PROMOTION), (101, PRIORITY_NOTIFICATION), (102, PRIORITY_RELAY)],
+            )
+        self.assertEqual(
+            [request for request, unused_delay in acquired],
+            [(102, PRIORITY_RELAY), (101, PRIORITY_NOTIFICATION), (100, PRIORITY_PROMOTION)],
+            )
+
+    async def test_acquire__cancelled(self):
+        rate_limiter = RateLimiter(global_rate=20, chat_rate=1000)
+        await self._acquire_all(
+            rate_limiter,
+            [(chat_id, PRIORITY_NOTIFICATION) for chat_id in range(20)],
+            )
+        task = self.loop.create_task(rate_limiter.acquire(100, PRIORITY_RELAY))
+        await asyncio.sleep(0)
+        task.cancel()
+        acquired = await self._acquire_all(rate_limiter, [(101, PRIORITY_PROMOTION)])
+        self.assertLess(acquired[0][1], 0.075)
+
+    @patch('randtalkbot.rate_limiter.RateLimiter.CHATS_PURGE_THRESHOLD', 2)
+    @asynctest.ignore_loop
+    def test_reserve_chat__purges_chats(self):
+        rate_limiter = RateLimiter(chat_rate=1, chat_burst=1)
+        self.assertEqual(rate_limiter._reserve_chat(1, 0), 0)
+        self.assertEqual(rate_limiter._reserve_chat(1, 0), 1)
+        self.assertEqual(rate_limiter._reserve_chat(2, 0), 0)
+        self.assertEqual(rate_limiter._reserve_chat(3, 1.5), 0)
+        self.assertEqual(set(rate_limiter._chats_arrival_times), {1, 3})
@@ -4,8 +4,30 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import datetime
 import unittest
-from randtalkbot.stats import Stats
+from peewee import SqliteDatabase
+from randtalkbot import stats as stats_module
+from randtalkbot.stats import decode_data, get_period_start, merge_data, Stats
+
+def get_data(talks_count, average, sex_distribution):
+    talks_stats = {
+        'average': average,
+        'count': talks_count,
+        'distribution': {'10': 0, 'more': talks_count},
+        }
+    return {
+        'sex_distribution': sex_distribution,
+        'talks_duration': talks_stats,
+        'talks_sent': talks_stats,
+        'talks_waiting': talks_stats,
+        }
+
+def create_stats(created, period='interval', talks_count=1):
+    stats = Stats(created=created, period=period)
+    stats.set_data(get_data(talks_count, 10, {'male': talks_count}))
+    stats.save()
+    return stats
 
 class TestStats(unittest.TestCase):
     def setUp(self):
@@ -14,9 +36,14 @@ class TestStats(unittest.TestCase):
     def test_get_data(self):
         self.assertEqual(self.stats.get_data(), {'foo': 'bar'})
 
+    def test_get_data__compressed(self):
+        stats = Stats(data_json='zlib:eNqrVkrLz1eyUkpKLFKqBQAdegQ0')
+        self.assertEqual(stats.get_data(), {'foo': 'bar'})
+
     def test_set_data(self):
         self.stats.set_data({'bar': 'boo'})
-        self.assertEqual(self.stats.data_json, '{"bar": "boo"}')
+        self.assertTrue(self.stats.data_json.startswith('zlib:'))
+        self.assertEqual(decode_data(self.stats.data_json), {'bar': 'boo'})
 
     def test_get_sex_ratio(self):
         stats = Stats(data_json='{"sex_distribution": {"male": 2000, "female": 1000}}')
@@ -29,3 +56,93 @@ class TestStats(unittest.TestCase):
         self.assertEqual(stats.get_sex_ratio(), 1)
         stats = Stats(data_json='[]')
         self.assertEqual(stats.get_sex_ratio(), 1)
+
+    def test_get_period_start(self):
+        moment = datetime.datetime(2018, 1, 18, 15, 30)
+        self.assertEqual(get_period_start('day', moment), datetime.datetime(2018, 1, 18))
+        self.assertEqual(get_period_start('week', moment), datetime.datetime(2018, 1, 15))
+        with self.assertRaises(ValueError):
+            get_period_start('interval', moment)
+
+    def test_merge_data(self):
+        data = merge_data([
+            get_data(10, 100, {'male': 1}),
+            get_data(0, 0, {'male': 2}),
+            get_data(30, 20, {'male': 3}),
+            ])
+        self.assertEqual(data['sex_distribution'], {'male': 3})
+        self.assertEqual(
+            data['talks_duration'],
+            {'average': 40, 'count': 40, 'distribution': {'10': 0, 'more': 40}},
+            )
+
+    def test_merge_data__sketches(self):
+        first_data = get_data(1, 5, {})
+        first_data['talks_waiting'] = dict(
+            first_data['talks_waiting'],
+            sketch={'counts': [1], 'offset': 80, 'zero_count': 0},
+            )
+        second_data = get_data(1, 5, {})
+        second_data['talks_waiting'] = dict(
+            second_data['talks_waiting'],
+            sketch={'counts': [2], 'offset': 82, 'zero_count': 1},
+            )
+        data = merge_data([first_data, second_data])
+        self.assertEqual(
+            data['talks_waiting']['sketch'],
+            {'counts': [1, 0, 2], 'offset': 80, 'zero_count': 1},
+            )
+        self.assertIn('p99', data['talks_waiting']['quantiles'])
+        self.assertNotIn('sketch', data['talks_duration'])
+
+
+class TestStatsRollUp(unittest.TestCase):
+    def setUp(self):
+        self.database = SqliteDatabase(':memory:')
+        stats_module.DATABASE_PROXY.initialize(self.database)
+        self.database.create_tables([Stats])
+
+    def tearDown(self):
+        self.database.drop_tables([Stats])
+
+    def test_roll_up__days(self):
+        now = datetime.datetime(2018, 1, 18, 12)
+        create_stats(datetime.datetime(2018, 1, 9, 4), talks_count=1)
+        create_stats(datetime.datetime(2018, 1, 9, 8), talks_count=2)
+        create_stats(datetime.datetime(2018, 1, 10, 4), talks_count=4)
+        recent_stats = create_stats(datetime.datetime(2018, 1, 11, 4))
+        latest_stats = create_stats(now)
+        Stats.roll_up(now)
+        daily_stats = list(Stats.select().where(Stats.period == 'day').order_by(Stats.created))
+        self.assertEqual(
+            [(stats.created, stats.get_data()['talks_sent']['count']) for stats in daily_stats],
+            [(datetime.datetime(2018, 1, 9), 3), (datetime.datetime(2018, 1, 10), 4)],
+            )
+        self.assertEqual(daily_stats[0].get_data()['sex_distribution'], {'male': 2})
+        interval_stats = Stats.select() \
+            .where(Stats.period == 'interval') \
+            .order_by(Stats.created)
+        self.assertEqual(
+            [stats.id for stats in interval_stats],
+            [recent_stats.id, latest_stats.id],
+            )
+        self.assertEqual(Stats.get_latest().id, latest_stats.id)
+
+    def test_roll_up__weeks(self):
+        now = datetime.datetime(2018, 3, 30)
+        create_stats(datetime.datetime(2018, 1, 22), period='day', talks_count=1)
+        create_stats(datetime.datetime(2018, 1, 24), period='day', talks_count=2)
+        create_stats(datetime.datetime(2018, 1, 29), period='day', talks_count=4)
+        Stats.roll_up(now)
+        weekly_stats = list(Stats.select().where(Stats.period == 'week'))
+        self.assertEqual(len(weekly_stats), 1)
+        self.assertEqual(weekly_stats[0].created, datetime.datetime(2018, 1, 22))
+        self.assertEqual(weekly_stats[0].get_data()['talks_sent']['count'], 3)
+        self.assertEqual(Stats.select().where(Stats.period == 'day').count(), 1)
+
+    def test_roll_up__retention(self):
+        now = datetime.datetime(2018, 3, 30)
+        create_stats(datetime.datetime(2015, 1, 5), period='week')
+        kept_stats = create_stats(datetime.datetime(2017, 1, 2), period='week')
+        Stats.roll_up(now)
+        self.assertEqual([stats.id for stats in Stats.select()], [kept_stats.id])
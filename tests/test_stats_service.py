@@ -4,15 +4,26 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import asyncio
 import datetime
 import json
+import math
+import sqlite3
+import threading
 import types
+import unittest
 import asynctest
-from asynctest.mock import patch, Mock, CoroutineMock
-from peewee import SqliteDatabase
-from randtalkbot import stats
-from randtalkbot.stats_service import StatsService
-from randtalkbot.stats import Stats
+from asynctest.mock import patch, ANY, Mock, CoroutineMock
+from peewee import fn, MySQLDatabase, SqliteDatabase
+from randtalkbot import stats, stranger, talk
+from randtalkbot.quantile_sketch import QuantileSketch
+from randtalkbot.stats_service import begin_consistent_snapshot, COUNT_INTERVALS, \
+    DURATION_INTERVALS, get_talks_sketch, get_talks_sketch_in_db, get_talks_stats, \
+    get_talks_stats_in_db, StatsService, WAITING_INTERVALS
+from randtalkbot.stats import decode_data, Stats
+from randtalkbot.stranger import Stranger
+from randtalkbot.strangers_stats import StrangersStats
+from randtalkbot.talk import Talk
 
 # pylint: disable=line-too-long
 ENDED_TALKS = (
@@ -327,25 +338,32 @@ STRANGERS = (
     {'languages': ['de'], 'sex': 'not_specified', 'partner_sex': 'not_specified'},
     )
 
-def get_strangers():
+def get_strangers_profiles():
     for stranger_json in STRANGERS:
-        stranger = Mock()
-        stranger.sex = stranger_json['sex']
-        stranger.partner_sex = stranger_json['partner_sex']
-        stranger.get_languages = Mock(return_value=stranger_json['languages'])
-        yield stranger
+        yield (
+            stranger_json['sex'],
+            stranger_json['partner_sex'],
+            tuple(stranger_json['languages']),
+            )
+
+def is_sqlite_ln_supported():
+    try:
+        sqlite3.connect(':memory:').execute('SELECT LN(1)')
+    except sqlite3.OperationalError:
+        return False
+    return True
 
 def get_talks(talks_json):
     talks = []
     for talk_json in talks_json:
-        talk = Mock()
-        talk.partner1_sent = talk_json['partner1_sent']
-        talk.partner2_sent = talk_json['partner2_sent']
-        talk.searched_since = datetime.datetime.fromtimestamp(talk_json['searched_since'])
-        talk.begin = datetime.datetime.fromtimestamp(talk_json['begin'])
+        talk_mock = Mock()
+        talk_mock.partner1_sent = talk_json['partner1_sent']
+        talk_mock.partner2_sent = talk_json['partner2_sent']
+        talk_mock.searched_since = datetime.datetime.fromtimestamp(talk_json['searched_since'])
+        talk_mock.begin = datetime.datetime.fromtimestamp(talk_json['begin'])
         if talk_json['end'] is not None:
-            talk.end = datetime.datetime.fromtimestamp(talk_json['end'])
-        talks.append(talk)
+            talk_mock.end = datetime.datetime.fromtimestamp(talk_json['end'])
+        talks.append(talk_mock)
     return talks
 
 class TestStatsService(asynctest.TestCase):
@@ -401,23 +419,100 @@ class TestStatsService(asynctest.TestCase):
     def test_get_stats(self):
         self.assertEqual(self.stats_service.get_stats(), self.stats)
 
+    @asynctest.ignore_loop
+    def test_update_stranger_stats__ok(self):
+        self.stats_service._strangers_stats = Mock()
+        self.stats_service.update_stranger_stats(None, ('male', 'female', ('en', )))
+        self.stats_service._strangers_stats.update.assert_called_once_with(
+            None,
+            ('male', 'female', ('en', )),
+            )
+
+    @asynctest.ignore_loop
+    def test_update_stranger_stats__not_changed(self):
+        self.stats_service._strangers_stats = Mock()
+        self.stats_service.update_stranger_stats(
+            ('male', 'female', ('en', )),
+            ('male', 'female', ('en', )),
+            )
+        self.stats_service._strangers_stats.update.assert_not_called()
+
+    @asynctest.ignore_loop
+    def test_update_stranger_stats__not_reconciled(self):
+        self.stats_service._strangers_stats = None
+        self.stats_service.update_stranger_stats(None, ('male', 'female', ('en', )))
+        self.assertEqual(self.stats_service._strangers_stats, None)
+
+    @asynctest.ignore_loop
+    def test_update_stranger_stats__during_reconciliation(self):
+        self.stats_service._strangers_stats = None
+        self.stats_service._strangers_changes = []
+        self.stats_service.update_stranger_stats(None, ('male', 'female', ('en', )))
+        self.assertEqual(
+            self.stats_service._strangers_changes,
+            [(None, ('male', 'female', ('en', )))],
+            )
+
+    @asynctest.ignore_loop
+    def test_get_sex_ratio__not_reconciled(self):
+        self.stats_service._strangers_stats = None
+        self.stats.get_sex_ratio.return_value = 1.5
+        self.assertEqual(self.stats_service.get_sex_ratio(), 1.5)
+
+    @asynctest.ignore_loop
+    def test_get_sex_ratio__live(self):
+        self.stats_service._strangers_stats = StrangersStats()
+        self.stats_service.update_stranger_stats(None, ('male', 'female', ('en', )))
+        self.stats_service.update_stranger_stats(None, ('male', 'female', ('en', )))
+        self.stats_service.update_stranger_stats(None, ('female', 'male', ('en', )))
+        self.assertEqual(self.stats_service.get_sex_ratio(), 2)
+
+    @asynctest.ignore_loop
+    @patch('randtalkbot.stats_service.time')
+    def test_get_sex_ratio__smoothed(self, time_mock):
+        self.stats_service._sex_ratio_smoothing = 100
+        self.stats_service._strangers_stats = StrangersStats()
+        self.stats_service._strangers_stats.add(('male', 'female', ('en', )))
+        self.stats_service._strangers_stats.add(('female', 'male', ('en', )))
+        time_mock.monotonic.return_value = 0
+        self.assertEqual(self.stats_service.get_sex_ratio(), 1)
+        time_mock.monotonic.return_value = 100
+        self.stats_service.update_stranger_stats(None, ('male', 'female', ('en', )))
+        # Ratio was 1 during the first 100 seconds.
+        self.assertEqual(self.stats_service.get_sex_ratio(), 1)
+        time_mock.monotonic.return_value = 200
+        self.assertAlmostEqual(self.stats_service.get_sex_ratio(), 1 + (1 - math.exp(-1)))
+
+    @patch('randtalkbot.stats_service.asyncio', CoroutineMock())
+    @patch('randtalkbot.stats_service.datetime', Mock())
+    async def test_run__reconciles_strangers_stats(self):
+        from randtalkbot.stats_service import datetime as datetime_mock
+        self.stats_service._reconcile_strangers_stats_in_thread = CoroutineMock()
+        self.stats_service._update_stats_in_thread = CoroutineMock()
+        datetime_mock.datetime.utcnow.side_effect = RuntimeError
+        with self.assertRaises(RuntimeError):
+            await self.stats_service.run()
+        self.stats_service._reconcile_strangers_stats_in_thread.assert_called_once_with()
+
     @patch('randtalkbot.stats_service.asyncio', CoroutineMock())
     @patch('randtalkbot.stats_service.datetime', Mock())
     async def test_run__ok(self):
         from randtalkbot.stats_service import asyncio as asyncio_mock
         from randtalkbot.stats_service import datetime as datetime_mock
-        self.stats_service._update_stats.reset_mock()
+        self.stats_service._update_stats_in_thread = CoroutineMock()
+        self.stats_service._strangers_stats = Mock()
         datetime_mock.datetime.utcnow.side_effect = [datetime.datetime(1990, 1, 1, 3), RuntimeError]
         with self.assertRaises(RuntimeError):
             await self.stats_service.run()
         asyncio_mock.sleep.assert_called_once_with(3600)
-        self.stats_service._update_stats.assert_called_once_with()
+        self.stats_service._update_stats_in_thread.assert_called_once_with()
 
     @patch('randtalkbot.stats_service.asyncio')
     @patch('randtalkbot.stats_service.datetime', Mock())
     async def test_run__too_late(self, asyncio_mock):
         from randtalkbot.stats_service import datetime as datetime_mock
-        self.stats_service._update_stats.reset_mock()
+        self.stats_service._update_stats_in_thread = CoroutineMock()
+        self.stats_service._strangers_stats = Mock()
         datetime_mock.datetime.utcnow.side_effect = [
             datetime.datetime(1990, 1, 1, 4, 0, 1),
             RuntimeError,
@@ -425,7 +520,233 @@ class TestStatsService(asynctest.TestCase):
         with self.assertRaises(RuntimeError):
             await self.stats_service.run()
         asyncio_mock.sleep.assert_not_called()
-        self.stats_service._update_stats.assert_called_once_with()
+        self.stats_service._update_stats_in_thread.assert_called_once_with()
+
+    @asynctest.ignore_loop
+    def test_get_talks_stats_in_db__same_as_in_python(self):
+        stranger.DATABASE_PROXY.initialize(self.database)
+        talk.DATABASE_PROXY.initialize(self.database)
+        self.database.create_tables([Stranger, Talk])
+
+        for talk_json in ENDED_TALKS:
+            Talk.create(
+                partner1=1,
+                partner1_sent=talk_json['partner1_sent'],
+                partner2=2,
+                partner2_sent=talk_json['partner2_sent'],
+                searched_since=datetime.datetime.fromtimestamp(talk_json['searched_since']),
+                begin=datetime.datetime.fromtimestamp(talk_json['begin']),
+                end=datetime.datetime.fromtimestamp(talk_json['end']),
+                )
+
+        def get_seconds(field):
+            return fn.strftime('%s', field)
+
+        try:
+            cases = (
+                (
+                    get_seconds(Talk.begin) - get_seconds(Talk.searched_since),
+                    lambda instance: (instance.begin - instance.searched_since).total_seconds(),
+                    WAITING_INTERVALS,
+                    ),
+                (
+                    get_seconds(Talk.end) - get_seconds(Talk.begin),
+                    lambda instance: (instance.end - instance.begin).total_seconds(),
+                    DURATION_INTERVALS,
+                    ),
+                (
+                    Talk.partner1_sent + Talk.partner2_sent,
+                    lambda instance: instance.partner1_sent + instance.partner2_sent,
+                    COUNT_INTERVALS,
+                    ),
+                )
+
+            for value, get_value, intervals in cases:
+                self.assertEqual(
+                    json.dumps(get_talks_stats_in_db(Talk.get_ended_talks(), value, intervals)),
+                    json.dumps(get_talks_stats(get_talks(ENDED_TALKS), get_value, intervals)),
+                    )
+        finally:
+            self.database.drop_tables([Stranger, Talk])
+
+    @unittest.skipUnless(is_sqlite_ln_supported(), 'SQLite is built without math functions')
+    @asynctest.ignore_loop
+    def test_get_talks_sketch_in_db__same_as_in_python(self):
+        stranger.DATABASE_PROXY.initialize(self.database)
+        talk.DATABASE_PROXY.initialize(self.database)
+        self.database.create_tables([Stranger, Talk])
+
+        for talk_json in ENDED_TALKS:
+            Talk.create(
+                partner1=1,
+                partner1_sent=talk_json['partner1_sent'],
+                partner2=2,
+                partner2_sent=talk_json['partner2_sent'],
+                searched_since=datetime.datetime.fromtimestamp(talk_json['searched_since']),
+                begin=datetime.datetime.fromtimestamp(talk_json['begin']),
+                end=datetime.datetime.fromtimestamp(talk_json['end']),
+                )
+
+        try:
+            self.assertEqual(
+                get_talks_sketch_in_db(
+                    Talk.get_ended_talks(),
+                    fn.strftime('%s', Talk.end) - fn.strftime('%s', Talk.begin),
+                    ).get_data(),
+                get_talks_sketch(
+                    get_talks(ENDED_TALKS),
+                    lambda instance: (instance.end - instance.begin).total_seconds(),
+                    ).get_data(),
+                )
+        finally:
+            self.database.drop_tables([Stranger, Talk])
+
+    @asynctest.ignore_loop
+    def test_get_talks_stats_in_db__no_talks(self):
+        stranger.DATABASE_PROXY.initialize(self.database)
+        talk.DATABASE_PROXY.initialize(self.database)
+        self.database.create_tables([Stranger, Talk])
+
+        try:
+            self.assertEqual(
+                json.dumps(get_talks_stats_in_db(
+                    Talk.get_ended_talks(),
+                    Talk.partner1_sent + Talk.partner2_sent,
+                    COUNT_INTERVALS,
+                    )),
+                json.dumps(get_talks_stats([], None, COUNT_INTERVALS)),
+                )
+        finally:
+            self.database.drop_tables([Stranger, Talk])
+
+    async def test_reconcile_strangers_stats_in_thread__changes_during_reconciliation(self):
+        db_was_read = threading.Event()
+
+        def obtain_strangers_stats():
+            db_was_read.wait(1)
+            return StrangersStats()
+
+        self.stats_service._obtain_strangers_stats_in_thread = obtain_strangers_stats
+        reconciliation = asyncio.ensure_future(
+            self.stats_service._reconcile_strangers_stats_in_thread(),
+            )
+        await asyncio.sleep(0)
+        self.stats_service.update_stranger_stats(None, ('male', 'female', ('en', )))
+        db_was_read.set()
+        await reconciliation
+        self.assertEqual(self.stats_service._strangers_stats.total_count, 1)
+        self.assertEqual(self.stats_service._strangers_changes, None)
+        self.stats_service.update_stranger_stats(None, ('female', 'male', ('en', )))
+        self.assertEqual(self.stats_service._strangers_stats.total_count, 2)
+
+    @asynctest.ignore_loop
+    def test_begin_consistent_snapshot__mysql(self):
+        database = Mock(spec=MySQLDatabase)
+        stats.DATABASE_PROXY.initialize(database)
+
+        try:
+            begin_consistent_snapshot(Stats)
+        finally:
+            stats.DATABASE_PROXY.initialize(self.database)
+
+        database.execute_sql.assert_called_once_with(
+            'START TRANSACTION WITH CONSISTENT SNAPSHOT',
+            require_commit=False,
+            )
+
+    @asynctest.ignore_loop
+    def test_begin_consistent_snapshot__sqlite(self):
+        database = Mock(spec=SqliteDatabase)
+        stats.DATABASE_PROXY.initialize(database)
+
+        try:
+            begin_consistent_snapshot(Stats)
+        finally:
+            stats.DATABASE_PROXY.initialize(self.database)
+
+        database.execute_sql.assert_not_called()
+
+    @asynctest.ignore_loop
+    @patch('randtalkbot.stats_service.begin_consistent_snapshot')
+    def test_begin_strangers_changes_buffering(self, begin_consistent_snapshot_mock):
+        thread_ids = []
+
+        def begin(unused_model):
+            self.assertEqual(self.stats_service._strangers_changes, None)
+            thread_ids.append(threading.get_ident())
+
+        begin_consistent_snapshot_mock.side_effect = begin
+        self.stats_service._begin_strangers_changes_buffering()
+        begin_consistent_snapshot_mock.assert_called_once_with(Stats)
+        self.assertNotEqual(thread_ids, [threading.get_ident()])
+        self.assertEqual(self.stats_service._strangers_changes, [])
+
+    async def test_reconcile_strangers_stats_in_thread__error(self):
+        self.stats_service._obtain_strangers_stats_in_thread = Mock(side_effect=Exception())
+
+        with self.assertRaises(Exception):
+            await self.stats_service._reconcile_strangers_stats_in_thread()
+
+        self.assertEqual(self.stats_service._strangers_changes, None)
+
+    async def test_update_stats_in_thread__reconciliation_error(self):
+        self.stats_service._get_strangers_data = Mock(return_value=None)
+        self.stats_service._compute_stats = Mock(side_effect=Exception())
+
+        with self.assertRaises(Exception):
+            await self.stats_service._update_stats_in_thread()
+
+        self.assertEqual(self.stats_service._strangers_changes, None)
+
+    async def test_update_stats_in_thread__reconciliation(self):
+        self.stats_service._get_strangers_data = Mock(return_value=None)
+        strangers_stats = StrangersStats()
+
+        def compute_stats(*unused_args):
+            self.assertEqual(self.stats_service._strangers_changes, [])
+            return 'stats', strangers_stats
+
+        self.stats_service._compute_stats = compute_stats
+        self.stats_service._publish_stats = Mock(
+            side_effect=lambda *args: self.stats_service._set_strangers_stats(args[1]),
+            )
+        await self.stats_service._update_stats_in_thread()
+        self.assertIs(self.stats_service._strangers_stats, strangers_stats)
+        self.assertEqual(self.stats_service._strangers_changes, None)
+
+    async def test_update_stats_in_thread(self):
+        self.stats_service._get_strangers_data = Mock(return_value='strangers_data')
+        self.stats_service._compute_stats = Mock(
+            side_effect=lambda *args: (threading.get_ident(), 'strangers_stats'),
+            )
+        self.stats_service._publish_stats = Mock()
+        await self.stats_service._update_stats_in_thread()
+        self.stats_service._compute_stats.assert_called_once_with(self.stats, 'strangers_data')
+        self.stats_service._publish_stats.assert_called_once_with(ANY, 'strangers_stats', ANY)
+        worker_thread_id = self.stats_service._publish_stats.call_args[0][0]
+        self.assertNotEqual(worker_thread_id, threading.get_ident())
+
+    @asynctest.ignore_loop
+    @patch('randtalkbot.stranger_service.StrangerService', Mock())
+    @patch('randtalkbot.stranger_sender_service.StrangerSenderService', Mock())
+    def test_publish_stats__reconciled(self):
+        new_stats = Mock()
+        strangers_stats = Mock()
+        self.stats_service._publish_stats(new_stats, strangers_stats, 1.5)
+        self.assertEqual(self.stats_service.get_stats(), new_stats)
+        self.assertEqual(self.stats_service._strangers_stats, strangers_stats)
+        self.assertNotEqual(self.stats_service._strangers_stats_reconciled, None)
+
+    @asynctest.ignore_loop
+    @patch('randtalkbot.stranger_service.StrangerService', Mock())
+    @patch('randtalkbot.stranger_sender_service.StrangerSenderService', Mock())
+    def test_publish_stats__not_reconciled(self):
+        new_stats = Mock()
+        strangers_stats = Mock()
+        self.stats_service._strangers_stats = strangers_stats
+        self.stats_service._publish_stats(new_stats, None, 1.5)
+        self.assertEqual(self.stats_service.get_stats(), new_stats)
+        self.assertEqual(self.stats_service._strangers_stats, strangers_stats)
 
     @asynctest.ignore_loop
     @patch('randtalkbot.stranger_service.StrangerService', Mock())
@@ -433,19 +754,23 @@ class TestStatsService(asynctest.TestCase):
     @patch('randtalkbot.talk.Talk', Mock())
     def test_update_stats__no_stats_in_db(self):
         from randtalkbot.stranger_service import StrangerService
-        from randtalkbot.talk import Talk
+        from randtalkbot.talk import Talk as talk_cls_mock
         stranger_service = StrangerService.get_instance.return_value
-        stranger_service.get_full_strangers = get_strangers
-        Talk.get_not_ended_talks.return_value = get_talks(NOT_ENDED_TALKS)
-        Talk.get_ended_talks.return_value = get_talks(ENDED_TALKS)
+        stranger_service.get_full_strangers_profiles = get_strangers_profiles
+        talk_cls_mock.get_not_ended_talks.return_value = get_talks(NOT_ENDED_TALKS)
+        talk_cls_mock.get_ended_talks.return_value = get_talks(ENDED_TALKS)
         self.stats_service._update_stats = types.MethodType(self.update_stats, self.stats_service)
         self.stats_service._stats = None
         # pylint: disable=not-callable
         self.stats_service._update_stats()
-        Talk.get_not_ended_talks.assert_called_once_with(after=None)
-        Talk.get_ended_talks.assert_called_once_with(after=None)
-        Talk.delete_old.assert_not_called()
-        actual = json.loads(self.stats_service._stats.data_json)
+        talk_cls_mock.get_not_ended_talks.assert_called_once_with(after=None)
+        talk_cls_mock.get_ended_talks.assert_called_once_with(after=None)
+        talk_cls_mock.delete_old.assert_not_called()
+        actual = decode_data(self.stats_service._stats.data_json)
+        waiting_sketch = QuantileSketch.from_data(actual['talks_waiting'].pop('sketch'))
+        duration_sketch = QuantileSketch.from_data(actual['talks_duration'].pop('sketch'))
+        self.assertEqual(waiting_sketch.count, 104)
+        self.assertEqual(duration_sketch.count, 100)
         # pylint: disable=bad-continuation
         expected = {
             'languages_count_distribution': [[1, 88], [2, 13]],
@@ -481,7 +806,11 @@ class TestStatsService(asynctest.TestCase):
              'sex_distribution': {'female': 33, 'male': 36, 'not_specified': 32},
              'talks_duration': {'average': 7092.79,
                                 'count': 100,
-                                'distribution': {'10': 0, '60': 0, '1800': 8, '300': 4, 'more': 88}},
+                                'distribution': {'10': 0, '60': 0, '1800': 8, '300': 4, 'more': 88},
+                                'quantiles': {'p50': 6837.957456114528,
+                                              'p90': 12968.332240425656,
+                                              'p99': 14332.271425086345,
+                                              'p999': 14332.271425086345}},
              'talks_sent': {'average': 210.6,
                             'count': 100,
                             'distribution': {'4': 0, '16': 1, '256': 63, '64': 7, 'more': 29}},
@@ -492,7 +821,11 @@ class TestStatsService(asynctest.TestCase):
                                                 '300': 3,
                                                 '60': 0,
                                                 '10': 0,
-                                                'more': 21}},
+                                                'more': 21},
+                               'quantiles': {'p50': 7407.490635987729,
+                                             'p90': 12213.090936098068,
+                                             'p99': 13770.276662804754,
+                                             'p999': 13770.276662804754}},
              'total_count': 101,
             }
         self.assertEqual(actual, expected)
@@ -504,19 +837,21 @@ class TestStatsService(asynctest.TestCase):
     def test_update_stats__some_stats_in_db(self):
         from randtalkbot.stranger_service import StrangerService
         from randtalkbot.stranger_sender_service import StrangerSenderService
-        from randtalkbot.talk import Talk
+        from randtalkbot.talk import Talk as talk_cls_mock
         stranger_service = StrangerService.get_instance.return_value
-        stranger_service.get_full_strangers = get_strangers
+        stranger_service.get_full_strangers_profiles = get_strangers_profiles
         stranger_sender_service = StrangerSenderService.get_instance.return_value
-        Talk.get_not_ended_talks.return_value = get_talks(NOT_ENDED_TALKS)
-        Talk.get_ended_talks.return_value = get_talks(ENDED_TALKS)
+        talk_cls_mock.get_not_ended_talks.return_value = get_talks(NOT_ENDED_TALKS)
+        talk_cls_mock.get_ended_talks.return_value = get_talks(ENDED_TALKS)
         self.stats_service._update_stats = types.MethodType(self.update_stats, self.stats_service)
         # self.stats_service._stats is not None now.
         # pylint: disable=not-callable
         self.stats_service._update_stats()
-        Talk.get_not_ended_talks.assert_called_once_with(after=datetime.datetime(1990, 1, 1))
-        Talk.get_ended_talks.assert_called_once_with(after=datetime.datetime(1990, 1, 1))
-        Talk.delete_old.assert_called_once_with(before=datetime.datetime(1990, 1, 1))
+        talk_cls_mock.get_not_ended_talks.assert_called_once_with(
+            after=datetime.datetime(1990, 1, 1),
+            )
+        talk_cls_mock.get_ended_talks.assert_called_once_with(after=datetime.datetime(1990, 1, 1))
+        talk_cls_mock.delete_old.assert_called_once_with(before=datetime.datetime(1990, 1, 1))
         stranger_service.get_cache_size.assert_called_once_with()
         stranger_sender_service.get_cache_size.assert_called_once_with()
 
@@ -526,17 +861,17 @@ class TestStatsService(asynctest.TestCase):
     @patch('randtalkbot.talk.Talk', Mock())
     def test_update_stats__no_talks(self):
         from randtalkbot.stranger_service import StrangerService
-        from randtalkbot.talk import Talk
+        from randtalkbot.talk import Talk as talk_cls_mock
         stranger_service = StrangerService.get_instance.return_value
-        stranger_service.get_full_strangers.return_value = []
-        Talk.get_not_ended_talks.return_value = []
-        Talk.get_ended_talks.return_value = []
+        stranger_service.get_full_strangers_profiles.return_value = []
+        talk_cls_mock.get_not_ended_talks.return_value = []
+        talk_cls_mock.get_ended_talks.return_value = []
         self.stats_service._update_stats = types.MethodType(self.update_stats, self.stats_service)
         # self.stats_service._stats is not None now.
         # pylint: disable=not-callable
         self.stats_service._update_stats()
         self.assertEqual(
-            json.loads(self.stats_service._stats.data_json),
+            decode_data(self.stats_service._stats.data_json),
             {'languages_count_distribution': [],
              'languages_popularity': [],
              'languages_to_orientation': [],
@@ -548,7 +883,12 @@ class TestStatsService(asynctest.TestCase):
                                                  '1800': 0,
                                                  '300': 0,
                                                  '60': 0,
-                                                 'more': 0}},
+                                                 'more': 0},
+                                'quantiles': {'p50': None,
+                                              'p90': None,
+                                              'p99': None,
+                                              'p999': None},
+                                'sketch': {'counts': [], 'offset': 0, 'zero_count': 0}},
              'talks_sent': {'average': 0,
                             'count': 0,
                             'distribution': {'16': 0,
@@ -563,6 +903,55 @@ class TestStatsService(asynctest.TestCase):
                                                 '1800': 0,
                                                 '300': 0,
                                                 '60': 0,
-                                                'more': 0}},
+                                                'more': 0},
+                               'quantiles': {'p50': None,
+                                             'p90': None,
+                                             'p99': None,
+                                             'p999': None},
+                               'sketch': {'counts': [], 'offset': 0, 'zero_count': 0}},
              'total_count': 0},
             )
+
+    @asynctest.ignore_loop
+    @patch('randtalkbot.stranger_service.StrangerService', Mock())
+    @patch('randtalkbot.stranger_sender_service.StrangerSenderService', Mock())
+    @patch('randtalkbot.talk.Talk', Mock())
+    def test_update_stats__incremental(self):
+        from randtalkbot.stranger_service import StrangerService
+        from randtalkbot.talk import Talk as talk_cls_mock
+        stranger_service = StrangerService.get_instance.return_value
+        stranger_service.get_full_strangers_profiles = Mock(side_effect=get_strangers_profiles)
+        talk_cls_mock.get_not_ended_talks.return_value = []
+        talk_cls_mock.get_ended_talks.return_value = []
+        self.stats_service._update_stats = types.MethodType(self.update_stats, self.stats_service)
+        # pylint: disable=not-callable
+        self.stats_service._update_stats()
+        self.stats_service.update_stranger_stats(None, ('female', 'male', ('de', )))
+        self.stats_service.update_stranger_stats(
+            ('not_specified', 'not_specified', ('de', )),
+            ('female', 'male', ('de', )),
+            )
+        self.stats_service._update_stats()
+        self.assertEqual(stranger_service.get_full_strangers_profiles.call_count, 1)
+        actual = decode_data(self.stats_service._stats.data_json)
+        self.assertEqual(actual['total_count'], 102)
+        self.assertEqual(actual['sex_distribution'], {'female': 35, 'male': 36, 'not_specified': 31})
+        self.assertIn(['de', 2], actual['languages_popularity'])
+
+    @asynctest.ignore_loop
+    @patch('randtalkbot.stranger_service.StrangerService', Mock())
+    @patch('randtalkbot.stranger_sender_service.StrangerSenderService', Mock())
+    @patch('randtalkbot.talk.Talk', Mock())
+    def test_update_stats__reconciliation(self):
+        from randtalkbot.stranger_service import StrangerService
+        from randtalkbot.talk import Talk as talk_cls_mock
+        stranger_service = StrangerService.get_instance.return_value
+        stranger_service.get_full_strangers_profiles = Mock(side_effect=get_strangers_profiles)
+        talk_cls_mock.get_not_ended_talks.return_value = []
+        talk_cls_mock.get_ended_talks.return_value = []
+        self.stats_service._update_stats = types.MethodType(self.update_stats, self.stats_service)
+        # pylint: disable=not-callable
+        self.stats_service._update_stats()
+        self.stats_service._strangers_stats_reconciled -= StatsService.RECONCILIATION_INTERVAL
+        self.stats_service._update_stats()
+        self.assertEqual(stranger_service.get_full_strangers_profiles.call_count, 2)
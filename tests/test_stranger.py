@@ -8,13 +8,16 @@ import datetime
 from unittest.mock import create_autospec
 import asynctest
 from asynctest.mock import call, patch, Mock, CoroutineMock
-from peewee import SqliteDatabase
+from peewee import DatabaseError, SqliteDatabase
 from randtalkbot import stranger
-from randtalkbot.errors import MissingPartnerError, StrangerError
+from randtalkbot.errors import MissingPartnerError, StrangerError, StrangerServiceError, \
+    TransientSendingError
+from randtalkbot.rate_limiter import PRIORITY_PROMOTION
 from randtalkbot.stranger import Stranger
 from randtalkbot.stranger_sender import StrangerSenderError
 from randtalkbot.stranger_sender_service import StrangerSenderService
 from telepot.exception import TelegramError
+from .helpers import CoalescingMock
 
 DATABASE = SqliteDatabase(':memory:')
 stranger.DATABASE_PROXY.initialize(DATABASE)
@@ -79,6 +82,7 @@ class TestStranger(asynctest.TestCase):
     async def test_advertise__people_are_searching_chat_lacks_males(self, stats_service_mock):
         from randtalkbot.stranger import asyncio as asyncio_mock
         sender = CoroutineMock()
+        sender.coalescing = Mock(return_value=CoalescingMock())
         self.stranger.get_sender = Mock(return_value=sender)
         self.stranger.get_start_args = Mock(return_value='foo_start_args')
         self.stranger.looking_for_partner_from = datetime.datetime.utcnow()
@@ -86,8 +90,6 @@ class TestStranger(asynctest.TestCase):
         self.stranger2.looking_for_partner_from = datetime.datetime.utcnow()
         self.stranger2.save()
         stats_service_mock.get_instance \
-            .return_value \
-            .get_stats \
             .return_value \
             .get_sex_ratio \
             .return_value = 0.9
@@ -107,6 +109,8 @@ class TestStranger(asynctest.TestCase):
                     3,
                     1,
                     disable_notification=True,
+                    disable_web_page_preview=True,
+                    priority=PRIORITY_PROMOTION,
                     ),
                 call(
                     'Do you want to talk with somebody, practice in foreign languages or you just'
@@ -115,6 +119,7 @@ class TestStranger(asynctest.TestCase):
                     'https://telegram.me/RandTalkBot?start=foo_start_args',
                     disable_notification=True,
                     disable_web_page_preview=True,
+                    priority=PRIORITY_PROMOTION,
                     ),
                 ],
             )
@@ -124,6 +129,7 @@ class TestStranger(asynctest.TestCase):
     async def test_advertise__people_are_searching_chat_lacks_females(self, stats_service_mock):
         from randtalkbot.stranger import asyncio as asyncio_mock
         sender = CoroutineMock()
+        sender.coalescing = Mock(return_value=CoalescingMock())
         self.stranger.get_sender = Mock(return_value=sender)
         self.stranger.get_invitation_link = Mock(return_value='foo_invitation_link')
         self.stranger.looking_for_partner_from = datetime.datetime.utcnow()
@@ -131,8 +137,6 @@ class TestStranger(asynctest.TestCase):
         self.stranger2.looking_for_partner_from = datetime.datetime.utcnow()
         self.stranger2.save()
         stats_service_mock.get_instance \
-            .return_value \
-            .get_stats \
             .return_value \
             .get_sex_ratio \
             .return_value = 1.1
@@ -152,6 +156,8 @@ class TestStranger(asynctest.TestCase):
                     3,
                     1,
                     disable_notification=True,
+                    disable_web_page_preview=True,
+                    priority=PRIORITY_PROMOTION,
                     ),
                 call(
                     'Do you want to talk with somebody, practice in foreign languages or you just'
@@ -160,6 +166,7 @@ class TestStranger(asynctest.TestCase):
                     'foo_invitation_link',
                     disable_notification=True,
                     disable_web_page_preview=True,
+                    priority=PRIORITY_PROMOTION,
                     ),
                 ],
             )
@@ -179,6 +186,7 @@ class TestStranger(asynctest.TestCase):
     async def test_advertise__stranger_has_blocked_the_bot(self, stats_service_mock):
         from randtalkbot.stranger import LOGGER
         self.stranger.get_sender = Mock()
+        self.stranger.get_sender.return_value.coalescing = Mock(return_value=CoalescingMock())
         self.stranger.get_sender.return_value.send_notification = CoroutineMock(
             side_effect=TelegramError({}, '', 0),
             )
@@ -188,8 +196,6 @@ class TestStranger(asynctest.TestCase):
         self.stranger2.looking_for_partner_from = datetime.datetime.utcnow()
         self.stranger2.save()
         stats_service_mock.get_instance \
-            .return_value \
-            .get_stats \
             .return_value \
             .get_sex_ratio \
             .return_value = 1.1
@@ -326,6 +332,18 @@ class TestStranger(asynctest.TestCase):
         stranger_sender_service_cls_mock.get_instance.return_value.get_or_create_stranger_sender \
             .assert_called_once_with(self.stranger)
 
+    @asynctest.ignore_loop
+    def test_get_stats_profile__full(self):
+        self.stranger.languages = '["en", "it"]'
+        self.stranger.sex = 'male'
+        self.stranger.partner_sex = 'female'
+        self.assertEqual(self.stranger.get_stats_profile(), ('male', 'female', ('en', 'it')))
+
+    @asynctest.ignore_loop
+    def test_get_stats_profile__not_full(self):
+        self.stranger.sex = 'male'
+        self.assertEqual(self.stranger.get_stats_profile(), None)
+
     @asynctest.ignore_loop
     def test_get_start_args(self):
         self.assertEqual(self.stranger.get_start_args(), 'eyJpIjoiZm9vIn0=')
@@ -342,6 +360,36 @@ class TestStranger(asynctest.TestCase):
         self.assertEqual(self.stranger.get_talk(), Talk.get_talk.return_value)
         Talk.get_talk.assert_called_once_with(self.stranger)
 
+    @asynctest.ignore_loop
+    def test_is_active__idle(self):
+        self.assertFalse(self.stranger.is_active())
+        self.stranger._partner = None
+        self.stranger._deferred_advertising = None
+        self.assertFalse(self.stranger.is_active())
+
+    @asynctest.ignore_loop
+    def test_is_active__talking(self):
+        self.stranger._partner = self.stranger2
+        self.assertTrue(self.stranger.is_active())
+
+    @asynctest.ignore_loop
+    def test_is_active__looking_for_partner(self):
+        self.stranger.looking_for_partner_from = datetime.datetime(1970, 1, 1)
+        self.assertTrue(self.stranger.is_active())
+
+    @asynctest.ignore_loop
+    def test_is_active__wizard(self):
+        self.stranger.wizard = 'setup'
+        self.assertTrue(self.stranger.is_active())
+
+    @asynctest.ignore_loop
+    def test_is_active__deferred_jobs(self):
+        self.stranger._deferred_advertising = Mock()
+        self.assertTrue(self.stranger.is_active())
+        self.stranger._deferred_advertising = None
+        self.stranger._bonuses_notifications_muted = True
+        self.assertTrue(self.stranger.is_active())
+
     @asynctest.ignore_loop
     def test_is_novice__novice(self):
         self.stranger.languages = None
@@ -431,6 +479,7 @@ class TestStranger(asynctest.TestCase):
             ' Congratulations!\n'
             'To mute this notifications, use /mute\\_bonuses.',
             1000,
+            priority=PRIORITY_PROMOTION,
             )
 
     async def test_notify_about_bonuses__many(self):
@@ -445,6 +494,7 @@ class TestStranger(asynctest.TestCase):
             'To mute this notifications, use /mute\\_bonuses.',
             2,
             1000,
+            priority=PRIORITY_PROMOTION,
             )
 
     @patch('randtalkbot.stranger.LOGGER', Mock())
@@ -871,6 +921,21 @@ class TestStranger(asynctest.TestCase):
             )
         sender.send_notification.assert_called_once_with('Your partner is here. Have a nice chat!')
 
+    async def test_notify_partner_found__transient_error(self):
+        sender = CoroutineMock()
+        sender._ = Mock(side_effect=['Your partner is here.', 'Have a nice chat!'])
+        sender.send_notification.side_effect = TransientSendingError('foo', 429, {})
+        self.stranger.get_sender = Mock(return_value=sender)
+        self.stranger.get_partner = Mock(return_value=None)
+        self.stranger.languages = '["foo"]'
+        self.stranger2.languages = '["foo"]'
+        self.stranger2.looking_for_partner_from = None
+
+        with self.assertRaises(TransientSendingError):
+            await self.stranger.notify_partner_found(self.stranger2)
+
+        sender.update_translation.assert_called_once_with()
+
     @patch('randtalkbot.stranger.datetime', Mock())
     async def test_notify_partner_found__waiting_only_a_little_bit(self):
         sender = CoroutineMock()
@@ -1002,56 +1067,100 @@ class TestStranger(asynctest.TestCase):
         self.stranger.prevent_advertising()
         self.assertEqual(self.stranger._deferred_advertising, None)
 
+    @patch('randtalkbot.stranger_service.StrangerService', Mock())
     @patch('randtalkbot.stranger.StatsService', Mock())
     async def test_reward_inviter__chat_lacks_such_user(self):
         from randtalkbot.stranger import StatsService
+        from randtalkbot.stranger_service import StrangerService
         talk = Mock()
         talk.partner1_sent = 1
         talk.partner2_sent = 1
         self.stranger.get_talk = Mock(return_value=talk)
         StatsService.get_instance \
-            .return_value \
-            .get_stats \
             .return_value \
             .get_sex_ratio \
             .return_value = 1.1
         self.stranger.invited_by = self.stranger2
+        StrangerService.get_instance.return_value.get_inviter.return_value = self.stranger2
         self.stranger2._add_bonuses = CoroutineMock()
         self.stranger.save = Mock()
         self.stranger.sex = 'female'
         await self.stranger._reward_inviter()
         StatsService.get_instance \
-            .return_value \
-            .get_stats \
             .return_value \
             .get_sex_ratio \
             .assert_called_once_with()
         self.assertEqual(self.stranger.was_invited_as, 'female')
         self.stranger.save.assert_called_once_with()
-        self.stranger.invited_by._add_bonuses.assert_called_once_with(3)
+        StrangerService.get_instance.return_value.get_inviter.assert_called_once_with(self.stranger)
+        self.stranger2._add_bonuses.assert_called_once_with(3)
 
+    @patch('randtalkbot.stranger_service.StrangerService', Mock())
     @patch('randtalkbot.stranger.StatsService', Mock())
     async def test_reward_inviter__chat_doesnt_lack_such_user(self):
         from randtalkbot.stranger import StatsService
-        from randtalkbot.stranger import StatsService
+        from randtalkbot.stranger_service import StrangerService
         talk = Mock()
         talk.partner1_sent = 1
         talk.partner2_sent = 1
         self.stranger.get_talk = Mock(return_value=talk)
         StatsService.get_instance \
-            .return_value \
-            .get_stats \
             .return_value \
             .get_sex_ratio \
             .return_value = 1.1
         self.stranger.invited_by = self.stranger2
+        StrangerService.get_instance.return_value.get_inviter.return_value = self.stranger2
         self.stranger2._add_bonuses = CoroutineMock()
         self.stranger.save = Mock()
         self.stranger.sex = 'not_specified'
         await self.stranger._reward_inviter()
         self.assertEqual(self.stranger.was_invited_as, 'not_specified')
         self.stranger.save.assert_called_once_with()
-        self.stranger.invited_by._add_bonuses.assert_called_once_with(1)
+        self.stranger2._add_bonuses.assert_called_once_with(1)
+
+    @patch('randtalkbot.stranger_service.StrangerService', Mock())
+    @patch('randtalkbot.stranger.StatsService', Mock())
+    async def test_reward_inviter__bonuses_werent_granted(self):
+        from randtalkbot.stranger import StatsService
+        from randtalkbot.stranger_service import StrangerService
+        talk = Mock()
+        talk.partner1_sent = 1
+        talk.partner2_sent = 1
+        self.stranger.get_talk = Mock(return_value=talk)
+        StatsService.get_instance \
+            .return_value \
+            .get_sex_ratio \
+            .return_value = 1.1
+        self.stranger.invited_by = self.stranger2
+        StrangerService.get_instance.return_value.get_inviter.return_value = self.stranger2
+        self.stranger2._add_bonuses = CoroutineMock(side_effect=DatabaseError())
+        self.stranger.save = Mock()
+        self.stranger.sex = 'female'
+        with self.assertRaises(DatabaseError):
+            await self.stranger._reward_inviter()
+        self.assertEqual(self.stranger.was_invited_as, None)
+        self.stranger.save.assert_not_called()
+
+    @patch('randtalkbot.stranger_service.StrangerService', Mock())
+    @patch('randtalkbot.stranger.StatsService', Mock())
+    async def test_reward_inviter__inviter_wasnt_obtained(self):
+        from randtalkbot.stranger import StatsService
+        from randtalkbot.stranger_service import StrangerService
+        talk = Mock()
+        talk.partner1_sent = 1
+        talk.partner2_sent = 1
+        self.stranger.get_talk = Mock(return_value=talk)
+        self.stranger.invited_by = self.stranger2
+        StrangerService.get_instance.return_value.get_inviter.side_effect = \
+            StrangerServiceError()
+        self.stranger2._add_bonuses = CoroutineMock()
+        self.stranger.save = Mock()
+        self.stranger.sex = 'female'
+        await self.stranger._reward_inviter()
+        self.assertEqual(self.stranger.was_invited_as, None)
+        self.stranger.save.assert_not_called()
+        StatsService.get_instance.assert_not_called()
+        self.stranger2._add_bonuses.assert_not_called()
 
     async def test_send__ok(self):
         sender = CoroutineMock()
@@ -1159,6 +1268,17 @@ class TestStranger(asynctest.TestCase):
         self.assertEqual(self.stranger.looking_for_partner_from, None)
         self.stranger.set_partner.assert_called_once_with(None)
 
+    @patch('randtalkbot.stranger.datetime')
+    async def test_set_looking_for_partner__transient_sending_error(self, datetime_mock):
+        sender = CoroutineMock()
+        sender.send_notification.side_effect = TransientSendingError('foo', 429, {})
+        self.stranger.get_sender = Mock(return_value=sender)
+        self.stranger.set_partner = CoroutineMock()
+        datetime_mock.datetime.utcnow.return_value = datetime.datetime(1980, 1, 1)
+        await self.stranger.set_looking_for_partner()
+        self.assertEqual(self.stranger.looking_for_partner_from, datetime.datetime(1980, 1, 1))
+        self.stranger.set_partner.assert_called_once_with(None)
+
     @patch('randtalkbot.stranger.datetime', Mock())
     @patch('randtalkbot.talk.Talk', Mock())
     async def test_set_partner__chatting_stranger(self):
@@ -9,10 +9,11 @@ from unittest.mock import create_autospec
 from asynctest.mock import call, patch, Mock, CoroutineMock
 import asynctest
 from telepot.exception import TelegramError
-from randtalkbot.errors import StrangerError, StrangerServiceError, UnknownCommandError, \
-    UnsupportedContentError
+from randtalkbot.errors import StrangerError, StrangerServiceError, TransientSendingError, \
+    UnknownCommandError, UnsupportedContentError
 from randtalkbot.message import Message
 from randtalkbot.stranger_handler import StrangerHandler
+from .helpers import CoalescingMock
 
 
 class TestStrangerHandler(asynctest.TestCase):
@@ -37,6 +38,7 @@ class TestStrangerHandler(asynctest.TestCase):
             }
         self.sender = stranger_sender_service.get_or_create_stranger_sender.return_value
         self.sender.answer_inline_query = CoroutineMock()
+        self.sender.coalescing = Mock(return_value=CoalescingMock())
         self.sender.send_notification = CoroutineMock()
         self.stranger_handler = StrangerHandler(
             (Mock(), self.initial_msg, 31416),
@@ -45,6 +47,9 @@ class TestStrangerHandler(asynctest.TestCase):
             )
         self.stranger_sender_service = stranger_sender_service
         self.message_cls = Message
+        refresh_stranger_patcher = patch.object(self.stranger_handler, '_refresh_stranger')
+        self.refresh_stranger = refresh_stranger_patcher.start()
+        self.addCleanup(refresh_stranger_patcher.stop)
 
     @patch('randtalkbot.stranger_handler.LOGGER', Mock())
     @patch('randtalkbot.stranger_handler.StrangerService', Mock())
@@ -201,8 +206,18 @@ class TestStrangerHandler(asynctest.TestCase):
         message = Mock()
         await self.stranger_handler._handle_command_setup(message)
         self.stranger.prevent_advertising.assert_called_once_with()
+        self.sender.coalescing.assert_called_once_with()
+        self.stranger.end_talk.assert_called_once_with()
         self.stranger_setup_wizard.activate.assert_called_once_with()
 
+    @patch('randtalkbot.stranger_handler.LOGGER', Mock())
+    async def test_handle_command__setup_stranger_has_blocked_the_bot(self):
+        from randtalkbot.stranger_handler import LOGGER
+        message = Mock()
+        self.stranger_setup_wizard.activate.side_effect = TelegramError({}, '', 0)
+        await self.stranger_handler._handle_command_setup(message)
+        self.assertTrue(LOGGER.warning.called)
+
     @patch('randtalkbot.stranger_handler.StrangerService', Mock())
     async def test_handle_command__start_has_invitation(self):
         from randtalkbot.stranger_handler import StrangerService
@@ -213,16 +228,34 @@ class TestStrangerHandler(asynctest.TestCase):
         stranger_service = StrangerService.get_instance.return_value
         stranger_service.get_stranger_by_invitation.return_value = invited_by
         self.stranger.wizard = 'none'
-        self.stranger.invited_by = None
+        self.stranger.invited_by_id = None
+        del self.stranger.invited_by
         await self.stranger_handler._handle_command_start(message)
         stranger_service.get_stranger_by_invitation.assert_called_once_with('foo_invitation')
-        self.assertEqual(self.stranger.invited_by, invited_by)
-        self.stranger.save.assert_called_once_with()
+        stranger_service.set_inviter.assert_called_once_with(self.stranger, invited_by)
         self.sender.send_notification.assert_called_once_with(
             '*Manual*\n\nUse /begin to start looking for a conversational partner, once '
             'you\'re matched you can use /end to end the conversation.'
             )
 
+    @patch('randtalkbot.stranger_handler.StrangerService', Mock())
+    @patch('randtalkbot.stranger_handler.LOGGER', Mock())
+    async def test_handle_command__start_has_circular_invitation(self):
+        from randtalkbot.stranger_handler import LOGGER, StrangerService
+        message = Mock()
+        message.command_args = 'foo_args'
+        message.decode_command_args.return_value = {'i': 'foo_invitation'}
+        stranger_service = StrangerService.get_instance.return_value
+        stranger_service.set_inviter.side_effect = StrangerServiceError()
+        self.stranger.wizard = 'none'
+        self.stranger.invited_by_id = None
+        await self.stranger_handler._handle_command_start(message)
+        self.assertTrue(LOGGER.info.called)
+        self.sender.send_notification.assert_called_once_with(
+            '*Manual*\n\nUse /begin to start looking for a conversational partner, once'
+            ' you\'re matched you can use /end to end the conversation.'
+            )
+
     @patch('randtalkbot.stranger_handler.StrangerService', Mock())
     async def test_handle_command__start_has_invitation_and_already_invited_by(self):
         from randtalkbot.stranger_handler import StrangerService
@@ -233,11 +266,12 @@ class TestStrangerHandler(asynctest.TestCase):
         stranger_service = StrangerService.get_instance.return_value
         stranger_service.get_stranger_by_invitation.return_value = new_invited_by
         self.stranger.wizard = 'none'
-        invited_by = CoroutineMock()
-        self.stranger.invited_by = invited_by
+        self.stranger.invited_by_id = 27183
+        # Inviter shouldn't be loaded from the DB.
+        del self.stranger.invited_by
         await self.stranger_handler._handle_command_start(message)
         stranger_service.get_stranger_by_invitation.assert_not_called()
-        self.assertEqual(self.stranger.invited_by, invited_by)
+        stranger_service.set_inviter.assert_not_called()
         self.sender.send_notification.assert_called_once_with(
             '*Manual*\n\nUse /begin to start looking for a conversational partner, once'
             ' you\'re matched you can use /end to end the conversation.'
@@ -250,12 +284,12 @@ class TestStrangerHandler(asynctest.TestCase):
         message.command_args = 'foo_args'
         message.decode_command_args.return_value = {'i': 'foo_invitation'}
         self.stranger.wizard = 'none'
-        self.stranger.invited_by = None
+        self.stranger.invited_by_id = None
         self.stranger.invitation = 'foo_invitation'
         stranger_service = StrangerService.get_instance.return_value
         await self.stranger_handler._handle_command_start(message)
         stranger_service.get_stranger_by_invitation.assert_not_called()
-        self.assertEqual(self.stranger.invited_by, None)
+        self.assertEqual(self.stranger.invited_by_id, None)
         self.assertEqual(
             self.sender.send_notification.call_args_list,
             [
@@ -277,11 +311,11 @@ class TestStrangerHandler(asynctest.TestCase):
         message.command_args = 'foo_args'
         message.decode_command_args.side_effect = UnsupportedContentError()
         self.stranger.wizard = 'none'
-        self.stranger.invited_by = None
+        self.stranger.invited_by_id = None
         stranger_service = StrangerService.get_instance.return_value
         await self.stranger_handler._handle_command_start(message)
         stranger_service.get_stranger_by_invitation.assert_not_called()
-        self.assertEqual(self.stranger.invited_by, None)
+        self.assertEqual(self.stranger.invited_by_id, None)
         self.sender.send_notification.assert_called_once_with(
             '*Manual*\n\nUse /begin to start looking for a conversational partner, once'
             ' you\'re matched you can use /end to end the conversation.'
@@ -294,11 +328,11 @@ class TestStrangerHandler(asynctest.TestCase):
         message.command_args = 'foo_args'
         message.decode_command_args.return_value = {'foo': 'bar'}
         self.stranger.wizard = 'none'
-        self.stranger.invited_by = None
+        self.stranger.invited_by_id = None
         stranger_service = StrangerService.get_instance.return_value
         await self.stranger_handler._handle_command_start(message)
         stranger_service.get_stranger_by_invitation.assert_not_called()
-        self.assertEqual(self.stranger.invited_by, None)
+        self.assertEqual(self.stranger.invited_by_id, None)
         self.sender.send_notification.assert_called_once_with(
             '*Manual*\n\nUse /begin to start looking for a conversational partner, once'
             ' you\'re matched you can use /end to end the conversation.'
@@ -311,11 +345,11 @@ class TestStrangerHandler(asynctest.TestCase):
         message.command_args = 'foo_args'
         message.decode_command_args.return_value = [1, 2, 3]
         self.stranger.wizard = 'none'
-        self.stranger.invited_by = None
+        self.stranger.invited_by_id = None
         stranger_service = StrangerService.get_instance.return_value
         await self.stranger_handler._handle_command_start(message)
         stranger_service.get_stranger_by_invitation.assert_not_called()
-        self.assertEqual(self.stranger.invited_by, None)
+        self.assertEqual(self.stranger.invited_by_id, None)
         self.sender.send_notification.assert_called_once_with(
             '*Manual*\n\nUse /begin to start looking for a conversational partner, once'
             ' you\'re matched you can use /end to end the conversation.'
@@ -330,10 +364,10 @@ class TestStrangerHandler(asynctest.TestCase):
         stranger_service = StrangerService.get_instance.return_value
         stranger_service.get_stranger_by_invitation.side_effect = StrangerServiceError()
         self.stranger.wizard = 'none'
-        self.stranger.invited_by = None
+        self.stranger.invited_by_id = None
         await self.stranger_handler._handle_command_start(message)
         stranger_service.get_stranger_by_invitation.assert_called_once_with('foo_invitation')
-        self.assertEqual(self.stranger.invited_by, None)
+        self.assertEqual(self.stranger.invited_by_id, None)
         self.sender.send_notification.assert_called_once_with(
             '*Manual*\n\nUse /begin to start looking for a conversational partner, once'
             ' you\'re matched you can use /end to end the conversation.'
@@ -343,9 +377,9 @@ class TestStrangerHandler(asynctest.TestCase):
         message = Mock()
         message.command_args = ''
         self.stranger.wizard = 'none'
-        self.stranger.invited_by = None
+        self.stranger.invited_by_id = None
         await self.stranger_handler._handle_command_start(message)
-        self.assertEqual(self.stranger.invited_by, None)
+        self.assertEqual(self.stranger.invited_by_id, None)
         self.sender.send_notification.assert_called_once_with(
             '*Manual*\n\nUse /begin to start looking for a conversational partner, once'
             ' you\'re matched you can use /end to end the conversation.'
@@ -355,9 +389,9 @@ class TestStrangerHandler(asynctest.TestCase):
         message = Mock()
         message.command_args = ''
         self.stranger.wizard = 'setup'
-        self.stranger.invited_by = None
+        self.stranger.invited_by_id = None
         await self.stranger_handler._handle_command_start(message)
-        self.assertEqual(self.stranger.invited_by, None)
+        self.assertEqual(self.stranger.invited_by_id, None)
         self.sender.send_notification.assert_not_called()
 
     @patch('randtalkbot.stranger_handler.telepot', Mock())
@@ -382,6 +416,7 @@ class TestStrangerHandler(asynctest.TestCase):
         message = message_cls_mock.return_value
         message.command = None
         await self.stranger_handler.on_chat_message(message_json)
+        self.refresh_stranger.assert_called_once_with()
         self.stranger.send_to_partner.assert_called_once_with(message_cls_mock.return_value)
         self.stranger_setup_wizard.handle.assert_called_once_with(message)
         message_cls_mock.assert_called_once_with(message_json)
@@ -457,6 +492,29 @@ class TestStrangerHandler(asynctest.TestCase):
             'Your partner has blocked me! How did you do that?!',
             )
 
+    @patch('randtalkbot.stranger_handler.LOGGER', Mock())
+    @patch('randtalkbot.stranger_handler.telepot', Mock())
+    @patch('randtalkbot.stranger_handler.Message', Mock())
+    async def test_on_chat_message__text_partner_is_unreachable(self):
+        from randtalkbot.stranger_handler import Message as message_cls_mock
+        from randtalkbot.stranger_handler import telepot
+        telepot.glance.return_value = 'text', 'private', 31416
+        self.stranger_setup_wizard.handle.return_value = False
+        message_cls_mock.return_value.command = None
+        partner = Mock()
+        partner.id = 27183
+        self.stranger.get_partner = Mock(return_value=partner)
+        self.stranger.id = 31416
+        self.stranger.end_talk = CoroutineMock()
+        self.stranger.send_to_partner = CoroutineMock(
+            side_effect=TransientSendingError('foo', 429, {}),
+            )
+        await self.stranger_handler.on_chat_message({'text': 'message_text'})
+        self.sender.send_notification.assert_called_once_with(
+            'Your message wasn\'t delivered because of temporary troubles. Please try again later.',
+            )
+        self.stranger.end_talk.assert_not_called()
+
     @patch('randtalkbot.stranger_handler.telepot', Mock())
     @patch('randtalkbot.stranger_handler.StrangerHandler.handle_command')
     @patch('randtalkbot.stranger_handler.Message', create_autospec(Message))
@@ -579,10 +637,57 @@ class TestStrangerHandler(asynctest.TestCase):
     async def test_on_edited_chat_message(self):
         message_json = 'foo_message'
         await self.stranger_handler.on_edited_chat_message(message_json)
+        self.refresh_stranger.assert_called_once_with()
         self.sender.send_notification.assert_called_once_with(
             'Messages editing isn\'t supported',
             )
 
+    @patch('randtalkbot.stranger_handler.StrangerSenderService')
+    @patch('randtalkbot.stranger_handler.StrangerService')
+    @patch('randtalkbot.stranger_handler.StrangerSetupWizard')
+    @asynctest.ignore_loop
+    def test_refresh_stranger__evicted(
+            self,
+            stranger_setup_wizard_cls_mock,
+            stranger_service_cls_mock,
+            stranger_sender_service_cls_mock,
+        ):
+        cached_stranger = Mock()
+        stranger_service_cls_mock.get_instance.return_value \
+            .get_cached_stranger.return_value = cached_stranger
+        get_or_create_stranger_sender = \
+            stranger_sender_service_cls_mock.get_instance.return_value.get_or_create_stranger_sender
+        StrangerHandler._refresh_stranger(self.stranger_handler)
+        stranger_service_cls_mock.get_instance.return_value \
+            .get_cached_stranger.assert_called_once_with(self.stranger)
+        get_or_create_stranger_sender.assert_called_once_with(cached_stranger)
+        self.assertEqual(self.stranger_handler._stranger, cached_stranger)
+        self.assertEqual(self.stranger_handler._sender, get_or_create_stranger_sender.return_value)
+        self.assertEqual(
+            self.stranger_handler._stranger_setup_wizard,
+            stranger_setup_wizard_cls_mock.return_value,
+            )
+        stranger_setup_wizard_cls_mock.assert_called_once_with(cached_stranger)
+
+    @patch('randtalkbot.stranger_handler.StrangerSenderService')
+    @patch('randtalkbot.stranger_handler.StrangerService')
+    @patch('randtalkbot.stranger_handler.StrangerSetupWizard')
+    @asynctest.ignore_loop
+    def test_refresh_stranger__cached(
+            self,
+            stranger_setup_wizard_cls_mock,
+            stranger_service_cls_mock,
+            stranger_sender_service_cls_mock,
+        ):
+        stranger_service_cls_mock.get_instance.return_value \
+            .get_cached_stranger.return_value = self.stranger
+        stranger_sender_service_cls_mock.get_instance.return_value \
+            .get_or_create_stranger_sender.return_value = self.sender
+        StrangerHandler._refresh_stranger(self.stranger_handler)
+        self.assertEqual(self.stranger_handler._stranger, self.stranger)
+        self.assertEqual(self.stranger_handler._stranger_setup_wizard, self.stranger_setup_wizard)
+        stranger_setup_wizard_cls_mock.assert_not_called()
+
     @patch('randtalkbot.stranger_handler.telepot', Mock())
     async def test_on_inline_query(self):
         from randtalkbot.stranger_handler import telepot
@@ -609,4 +714,5 @@ class TestStrangerHandler(asynctest.TestCase):
                     ),
                 'parse_mode': 'Markdown',
                 }],
+            cache_time=900,
             )
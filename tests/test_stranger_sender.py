@@ -4,10 +4,14 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+from unittest.mock import ANY
 import asynctest
 from asynctest.mock import call, patch, Mock, CoroutineMock
+from telepot.exception import TelegramError
 from randtalkbot.errors import StrangerSenderError
-from randtalkbot.stranger_sender import StrangerSender
+from randtalkbot.notification_catalog import CATALOGS
+from randtalkbot.rate_limiter import PRIORITY_NOTIFICATION, PRIORITY_PROMOTION, PRIORITY_RELAY
+from randtalkbot.stranger_sender import StrangerSender, TRANSLATED_ARTICLES
 
 class TestStrangerSender(asynctest.TestCase):
     @patch('randtalkbot.stranger_sender.get_translation', Mock())
@@ -22,6 +26,9 @@ class TestStrangerSender(asynctest.TestCase):
         self.get_translation = get_translation
         self.translation = self.get_translation.return_value
         self.translation.reset_mock()
+        # Translation mock is shared by all tests, so are its compiled templates.
+        CATALOGS.clear()
+        TRANSLATED_ARTICLES.clear()
 
     @patch('randtalkbot.stranger_sender.StrangerSender.update_translation', Mock())
     @asynctest.ignore_loop
@@ -32,16 +39,14 @@ class TestStrangerSender(asynctest.TestCase):
 
     async def test_answer_inline_query(self):
         self.translation.return_value = 'foo {} {}'
-        await self.sender.answer_inline_query(
-            31416,
-            [{
-                'type': 'article',
-                'bar': 'baz',
-                'title': 'bim',
-                'description': 'zig',
-                'message_text': ('zam', 1, 2),
-                }],
-            )
+        answers = [{
+            'type': 'article',
+            'bar': 'baz',
+            'title': 'bim',
+            'description': 'zig',
+            'message_text': ('zam', 1, 2),
+            }]
+        await self.sender.answer_inline_query(31416, answers, cache_time=900)
         self.bot.answerInlineQuery.assert_called_once_with(
             31416,
             [{
@@ -51,8 +56,59 @@ class TestStrangerSender(asynctest.TestCase):
                 'description': 'foo {} {}',
                 'message_text': 'foo 1 2',
                 }],
+            cache_time=900,
             is_personal=True,
             )
+        self.assertEqual(answers[0]['title'], 'bim')
+
+    @patch('randtalkbot.stranger_sender.INLINE_QUERY_ANSWERS')
+    @patch('randtalkbot.stranger_sender.get_translation')
+    async def test_answer_inline_query__cached(self, get_translation_mock, answers_counter_mock):
+        get_translation_mock.return_value = self.translation
+        self.translation.return_value = 'foo {}'
+        answers = [{
+            'type': 'article',
+            'title': 'bim',
+            'description': 'zig',
+            'message_text': ('zam', 1),
+            }]
+        await self.sender.answer_inline_query(31416, answers)
+        other_sender = StrangerSender(self.bot, self.stranger)
+        await other_sender.answer_inline_query(27183, [dict(answers[0], message_text=('zam', 2))])
+        self.assertEqual(self.translation.call_count, 3)
+        self.assertEqual(
+            [
+                call_args[0][1][0]['message_text']
+                for call_args in self.bot.answerInlineQuery.call_args_list
+                ],
+            ['foo 1', 'foo 2'],
+            )
+        self.assertEqual(
+            answers_counter_mock.inc.call_args_list,
+            [call(cache='miss'), call(cache='hit')],
+            )
+
+    @patch('randtalkbot.stranger_sender.get_translation')
+    async def test_answer_inline_query__other_languages(self, get_translation_mock):
+        get_translation_mock.return_value = Mock(return_value='bar')
+        self.translation.return_value = 'foo'
+        answers = [{
+            'type': 'article',
+            'title': 'bim',
+            'description': 'zig',
+            'message_text': 'zam',
+            }]
+        await self.sender.answer_inline_query(31416, answers)
+        self.stranger.get_languages.return_value = ['de']
+        self.sender.update_translation()
+        await self.sender.answer_inline_query(31416, answers)
+        self.assertEqual(
+            [
+                call_args[0][1][0]['title']
+                for call_args in self.bot.answerInlineQuery.call_args_list
+                ],
+            ['foo', 'bar'],
+            )
 
     async def test_send_notification__no_reply_markup(self):
         self.translation.return_value = 'foo_translation'
@@ -99,6 +155,30 @@ class TestStrangerSender(asynctest.TestCase):
             reply_markup=None,
             )
 
+    async def test_send_notification__catalog(self):
+        self.translation.return_value = 'foo_translation {}'
+        await self.sender.send_notification('foo', 'bar')
+        await self.sender.send_notification('foo', 'baz')
+        self.translation.assert_called_once_with('foo')
+        self.assertEqual(
+            self.sender.sendMessage.call_args_list[1][0],
+            ('*Rand Talk:* foo_translation baz', ),
+            )
+
+    async def test_send_notification__outbound_queue(self):
+        self.sender._outbound_queue = Mock()
+        self.sender._outbound_queue.send = CoroutineMock(
+            side_effect=lambda chat_id, send_function, priority: send_function(),
+            )
+        self.translation.return_value = 'foo_translation'
+        await self.sender.send_notification('foo')
+        await self.sender.send_notification('foo', priority=PRIORITY_PROMOTION)
+        self.assertEqual(
+            self.sender._outbound_queue.send.call_args_list,
+            [call(31416, ANY, PRIORITY_NOTIFICATION), call(31416, ANY, PRIORITY_PROMOTION)],
+            )
+        self.assertEqual(self.sender.sendMessage.call_count, 2)
+
     async def test_send_notification__with_reply_markup_no_keyboard(self):
         self.translation.return_value = 'foo_translation'
         await self.sender.send_notification(
@@ -159,6 +239,128 @@ class TestStrangerSender(asynctest.TestCase):
                 },
             )
 
+    async def test_send_notification__coalesced(self):
+        self.translation.return_value = '{}'
+        async with self.sender.coalescing():
+            await self.sender.send_notification('foo', 'footext')
+            await self.sender.send_notification('foo', 'bartext')
+            await self.sender.send_notification('foo', 'baztext')
+            self.sender.sendMessage.assert_not_called()
+        self.sender.sendMessage.assert_called_once_with(
+            '*Rand Talk:* footext\n\n*Rand Talk:* bartext\n\n*Rand Talk:* baztext',
+            disable_notification=None,
+            disable_web_page_preview=None,
+            parse_mode='Markdown',
+            reply_markup=None,
+            )
+
+    async def test_send_notification__not_coalesced_outside_block(self):
+        self.translation.return_value = 'foo_translation'
+        await self.sender.send_notification('foo')
+        await self.sender.send_notification('bar')
+        self.assertEqual(self.sender.sendMessage.call_count, 2)
+
+    async def test_send_notification__coalesced_with_same_options_only(self):
+        self.translation.return_value = '{}'
+        async with self.sender.coalescing():
+            await self.sender.send_notification('foo', 'footext')
+            await self.sender.send_notification('foo', 'bartext', disable_notification=True)
+            await self.sender.send_notification('foo', 'baztext', disable_notification=True)
+            await self.sender.send_notification('foo', 'bootext', priority=PRIORITY_PROMOTION)
+        self.assertEqual(
+            [call_args[0][0] for call_args in self.sender.sendMessage.call_args_list],
+            [
+                '*Rand Talk:* footext',
+                '*Rand Talk:* bartext\n\n*Rand Talk:* baztext',
+                '*Rand Talk:* bootext',
+                ],
+            )
+
+    async def test_send_notification__coalesced_with_keyboard(self):
+        self.translation.return_value = '{}'
+        async with self.sender.coalescing():
+            await self.sender.send_notification('foo', 'footext')
+            await self.sender.send_notification('foo', 'bartext', reply_markup={'keyboard': []})
+            await self.sender.send_notification('foo', 'baztext')
+        self.assertEqual(
+            self.sender.sendMessage.call_args_list,
+            [
+                call(
+                    '*Rand Talk:* footext\n\n*Rand Talk:* bartext',
+                    disable_notification=None,
+                    disable_web_page_preview=None,
+                    parse_mode='Markdown',
+                    reply_markup={'keyboard': [], 'one_time_keyboard': True},
+                    ),
+                call('*Rand Talk:* baztext', disable_notification=None,
+                     disable_web_page_preview=None, parse_mode='Markdown', reply_markup=None),
+                ],
+            )
+
+    async def test_send_notification__not_coalesced_above_length_limit(self):
+        self.translation.return_value = '{}'
+        async with self.sender.coalescing():
+            await self.sender.send_notification('foo', 'a' * 3000)
+            await self.sender.send_notification('foo', 'b' * 1100)
+        self.assertEqual(self.sender.sendMessage.call_count, 2)
+
+    async def test_send_notification__coalesced_in_nested_blocks(self):
+        self.translation.return_value = '{}'
+        async with self.sender.coalescing():
+            await self.sender.send_notification('foo', 'footext')
+            async with self.sender.coalescing():
+                await self.sender.send_notification('foo', 'bartext')
+            self.sender.sendMessage.assert_not_called()
+        self.assertEqual(self.sender.sendMessage.call_count, 1)
+
+    async def test_send_notification__coalesced_before_message(self):
+        self.translation.return_value = '{}'
+        message = Mock()
+        message.is_reply = False
+        message.type = 'text'
+        message.sending_kwargs = {'text': 'foo_message'}
+        async with self.sender.coalescing():
+            await self.sender.send_notification('foo', 'footext')
+            await self.sender.send(message)
+            await self.sender.send_notification('foo', 'bartext')
+        self.assertEqual(
+            self.sender.sendMessage.call_args_list,
+            [
+                call('*Rand Talk:* footext', disable_notification=None,
+                     disable_web_page_preview=None, parse_mode='Markdown', reply_markup=None),
+                call(text='foo_message'),
+                call('*Rand Talk:* bartext', disable_notification=None,
+                     disable_web_page_preview=None, parse_mode='Markdown', reply_markup=None),
+                ],
+            )
+
+    async def test_send_notification__coalesced_error(self):
+        self.translation.return_value = 'foo_translation'
+        self.sender.sendMessage.side_effect = TelegramError('Forbidden', 403, {})
+        with self.assertRaises(TelegramError):
+            async with self.sender.coalescing():
+                await self.sender.send_notification('foo')
+                await self.sender.send_notification('bar')
+        self.sender.sendMessage.assert_called_once_with(
+            '*Rand Talk:* foo_translation\n\n*Rand Talk:* foo_translation',
+            disable_notification=None,
+            disable_web_page_preview=None,
+            parse_mode='Markdown',
+            reply_markup=None,
+            )
+        self.sender.sendMessage.side_effect = None
+        await self.sender.send_notification('baz')
+        self.assertEqual(self.sender.sendMessage.call_count, 2)
+
+    @patch('randtalkbot.stranger_sender.LOGGER', Mock())
+    async def test_send_notification__coalesced_before_error(self):
+        self.translation.return_value = 'foo_translation'
+        with self.assertRaises(ValueError):
+            async with self.sender.coalescing():
+                await self.sender.send_notification('foo')
+                raise ValueError()
+        self.assertEqual(self.sender.sendMessage.call_count, 1)
+
     async def test_send__text(self):
         message = Mock()
         message.is_reply = False
@@ -170,6 +372,54 @@ class TestStrangerSender(asynctest.TestCase):
         await self.sender.send(message)
         self.sender.sendMessage.assert_called_once_with(**message.sending_kwargs)
 
+    async def test_send__outbound_queue(self):
+        self.sender._outbound_queue = Mock()
+        self.sender._outbound_queue.send = CoroutineMock(
+            side_effect=lambda chat_id, send_function, priority: send_function(),
+            )
+        message = Mock()
+        message.is_reply = False
+        message.type = 'text'
+        message.sending_kwargs = {'foo': 'bar'}
+        await self.sender.send(message)
+        self.sender._outbound_queue.send.assert_called_once_with(31416, ANY, PRIORITY_RELAY)
+        self.sender.sendMessage.assert_called_once_with(foo='bar')
+
+    @patch('randtalkbot.stranger_sender.TELEGRAM_REQUESTS_IN_FLIGHT')
+    @patch('randtalkbot.stranger_sender.TELEGRAM_REQUEST_SECONDS')
+    @patch('randtalkbot.stranger_sender.TELEGRAM_REQUEST_ERRORS')
+    async def test_send__instrumented(self, errors_mock, seconds_mock, in_flight_mock):
+        message = Mock()
+        message.is_reply = False
+        message.type = 'photo'
+        message.sending_kwargs = {'photo': 'foo'}
+        self.sender.sendPhoto = CoroutineMock()
+        await self.sender.send(message)
+        in_flight_mock.inc.assert_called_once_with(method='sendPhoto')
+        in_flight_mock.dec.assert_called_once_with(method='sendPhoto')
+        seconds_mock.observe.assert_called_once_with(ANY, method='sendPhoto')
+        errors_mock.inc.assert_not_called()
+
+    @patch('randtalkbot.stranger_sender.TELEGRAM_REQUESTS_IN_FLIGHT')
+    @patch('randtalkbot.stranger_sender.TELEGRAM_REQUEST_SECONDS')
+    @patch('randtalkbot.stranger_sender.TELEGRAM_REQUEST_ERRORS')
+    async def test_send__instrumented_error(self, errors_mock, seconds_mock, in_flight_mock):
+        message = Mock()
+        message.is_reply = False
+        message.type = 'text'
+        message.sending_kwargs = {'text': 'foo'}
+        self.sender.sendMessage.side_effect = TelegramError('Forbidden', 403, {})
+        with self.assertRaises(TelegramError):
+            await self.sender.send(message)
+        errors_mock.inc.assert_called_once_with(method='sendMessage', code='403')
+        seconds_mock.observe.assert_called_once_with(ANY, method='sendMessage')
+        in_flight_mock.dec.assert_called_once_with(method='sendMessage')
+
+    @patch('randtalkbot.stranger_sender.TELEGRAM_REQUEST_SECONDS')
+    async def test_answer_inline_query__instrumented(self, seconds_mock):
+        await self.sender.answer_inline_query(31416, [])
+        seconds_mock.observe.assert_called_once_with(ANY, method='answerInlineQuery')
+
     async def test_send__unknown_content_type(self):
         message = Mock()
         message.is_reply = False
@@ -186,6 +436,14 @@ class TestStrangerSender(asynctest.TestCase):
             await self.sender.send(message)
         self.sender.sendMessage.assert_not_called()
 
+    @patch('randtalkbot.stranger_sender.get_translation', Mock(return_value='foo_translation'))
+    @asynctest.ignore_loop
+    def test_reload_translation(self):
+        from randtalkbot.stranger_sender import get_translation
+        self.sender.reload_translation()
+        get_translation.assert_called_once_with('foo_languages')
+        self.assertEqual(self.sender._, 'foo_translation')
+
     @patch('randtalkbot.stranger_sender.get_translation', Mock(return_value='foo_translation'))
     @asynctest.ignore_loop
     def test_update_translation__has_partner(self):
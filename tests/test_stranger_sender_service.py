@@ -6,6 +6,7 @@
 
 import unittest
 from unittest.mock import create_autospec, patch, Mock
+from randtalkbot.metrics import CACHE_EVICTIONS, CACHE_HITS, CACHE_MISSES
 from randtalkbot.stranger_sender import StrangerSender
 from randtalkbot.stranger_sender_service import StrangerSenderService, StrangerSenderServiceError
 
@@ -18,6 +19,24 @@ class TestStrangerSenderService(unittest.TestCase):
 
     def test_init(self):
         self.assertEqual(self.stranger_sender_service._bot, self.bot)
+        stranger_sender_service = StrangerSenderService(self.bot, cache_capacity=10, cache_ttl=20)
+        self.assertEqual(StrangerSenderService._instance, stranger_sender_service)
+        self.assertEqual(stranger_sender_service._stranger_senders._capacity, 10)
+        self.assertEqual(stranger_sender_service._stranger_senders._ttl, 20)
+
+    def test_init__cache_metrics(self):
+        stranger_senders = self.stranger_sender_service._stranger_senders
+        stranger_senders.evictions_count = 3
+        stranger_senders.hits_count = 5
+        stranger_senders.misses_count = 7
+        samples = [
+            sample
+            for metric in (CACHE_EVICTIONS, CACHE_HITS, CACHE_MISSES)
+            for sample in metric.get_samples()
+            ]
+        self.assertIn('randtalkbot_cache_evictions_total{cache="senders"} 3', samples)
+        self.assertIn('randtalkbot_cache_hits_total{cache="senders"} 5', samples)
+        self.assertIn('randtalkbot_cache_misses_total{cache="senders"} 7', samples)
 
     def test_get_instance__cached(self):
         StrangerSenderService._instance = self.stranger_sender_service
@@ -44,6 +63,7 @@ class TestStrangerSenderService(unittest.TestCase):
         stranger_sender = Mock()
         stranger = Mock()
         stranger.telegram_id = 31416
+        stranger_sender.get_stranger.return_value = stranger
         self.stranger_sender_service._stranger_senders[31416] = stranger_sender
         self.assertEqual(
             self.stranger_sender_service.get_or_create_stranger_sender(stranger),
@@ -51,6 +71,24 @@ class TestStrangerSenderService(unittest.TestCase):
             )
         self.assertFalse(stranger_sender_cls_mock.called)
 
+    @patch('randtalkbot.stranger_sender_service.StrangerSender', create_autospec(StrangerSender))
+    def test_get_or_create_stranger_sender__cached_for_another_instance(self):
+        from randtalkbot.stranger_sender_service import StrangerSender as stranger_sender_cls_mock
+        stale_stranger_sender = Mock()
+        stale_stranger_sender.get_stranger.return_value = Mock()
+        stranger = Mock()
+        stranger.telegram_id = 31416
+        self.stranger_sender_service._stranger_senders[31416] = stale_stranger_sender
+        self.assertEqual(
+            self.stranger_sender_service.get_or_create_stranger_sender(stranger),
+            stranger_sender_cls_mock.return_value,
+            )
+        stranger_sender_cls_mock.assert_called_once_with(self.bot, stranger, outbound_queue=None)
+        self.assertEqual(
+            self.stranger_sender_service._stranger_senders[31416],
+            stranger_sender_cls_mock.return_value,
+            )
+
     @patch('randtalkbot.stranger_sender_service.StrangerSender', create_autospec(StrangerSender))
     def test_get_or_create_stranger_sender__not_cached(self):
         from randtalkbot.stranger_sender_service import StrangerSender as stranger_sender_cls_mock
@@ -61,5 +99,47 @@ class TestStrangerSenderService(unittest.TestCase):
             self.stranger_sender_service.get_or_create_stranger_sender(stranger),
             stranger_sender,
             )
-        stranger_sender_cls_mock.assert_called_once_with(self.bot, stranger)
+        stranger_sender_cls_mock.assert_called_once_with(self.bot, stranger, outbound_queue=None)
         self.assertEqual(self.stranger_sender_service._stranger_senders[31416], stranger_sender)
+
+    def test_get_cache_stats(self):
+        self.assertEqual(
+            self.stranger_sender_service.get_cache_stats(),
+            {
+                'evictions': 0,
+                'hits': 0,
+                'misses': 0,
+                'size': 0,
+                },
+            )
+
+    def test_reload_translations(self):
+        stranger_sender = Mock()
+        self.stranger_sender_service._stranger_senders[31416] = stranger_sender
+        self.stranger_sender_service.reload_translations()
+        stranger_sender.reload_translation.assert_called_once_with()
+
+    def test_remove_stranger_sender__ok(self):
+        stranger_sender = Mock()
+        stranger = Mock()
+        stranger.telegram_id = 31416
+        stranger_sender.get_stranger.return_value = stranger
+        self.stranger_sender_service._stranger_senders[31416] = stranger_sender
+        self.stranger_sender_service.remove_stranger_sender(stranger)
+        self.assertNotIn(31416, self.stranger_sender_service._stranger_senders)
+        self.assertEqual(self.stranger_sender_service._stranger_senders.evictions_count, 1)
+
+    def test_remove_stranger_sender__another_instance(self):
+        stranger_sender = Mock()
+        stranger = Mock()
+        stranger.telegram_id = 31416
+        stranger_sender.get_stranger.return_value = Mock()
+        self.stranger_sender_service._stranger_senders[31416] = stranger_sender
+        self.stranger_sender_service.remove_stranger_sender(stranger)
+        self.assertIn(31416, self.stranger_sender_service._stranger_senders)
+
+    def test_remove_stranger_sender__not_cached(self):
+        stranger = Mock()
+        stranger.telegram_id = 31416
+        self.stranger_sender_service.remove_stranger_sender(stranger)
+        self.assertEqual(self.stranger_sender_service.get_cache_size(), 0)
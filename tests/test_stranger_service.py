@@ -9,9 +9,10 @@ from unittest.mock import create_autospec
 import asynctest
 from asynctest.mock import call, patch, Mock, CoroutineMock
 from peewee import DatabaseError, DoesNotExist, SqliteDatabase
-from randtalkbot import stranger
-from randtalkbot.errors import StrangerError, StrangerServiceError, \
-    PartnerObtainingError
+from randtalkbot import stranger, talk
+from randtalkbot.errors import StrangerError, StrangerServiceError, PartnerObtainingError, \
+    TransientSendingError
+from randtalkbot.metrics import CACHE_EVICTIONS, CACHE_HITS, CACHE_MISSES
 from randtalkbot.stranger import Stranger
 from randtalkbot.stranger_service import StrangerService
 
@@ -24,7 +25,8 @@ class TestStrangerService(asynctest.TestCase):
     def setUp(self):
         self.stranger_service = StrangerService()
         stranger.DATABASE_PROXY.initialize(self.database)
-        self.database.create_tables([Stranger])
+        talk.DATABASE_PROXY.initialize(self.database)
+        self.database.create_tables([Stranger, talk.Talk])
         self.stranger_0 = Stranger.create(
             invitation='foo',
             languages='["foo"]',
@@ -76,7 +78,7 @@ class TestStrangerService(asynctest.TestCase):
             )
 
     def tearDown(self):
-        self.database.drop_tables([Stranger])
+        self.database.drop_tables([Stranger, talk.Talk])
 
     @patch('randtalkbot.stranger_service.StrangerService.__init__', Mock(return_value=None))
     @asynctest.ignore_loop
@@ -104,6 +106,106 @@ class TestStrangerService(asynctest.TestCase):
         self.assertEqual(self.stranger_service.get_cached_stranger(stranger_mock), stranger_mock)
         self.assertEqual(self.stranger_service._strangers_cache[31416], stranger_mock)
 
+    @asynctest.ignore_loop
+    def test_get_cached_stranger__doesnt_obtain_inviter(self):
+        self.stranger_1.invited_by = self.stranger_0
+        self.stranger_1.save()
+        stranger_instance = Stranger.get(Stranger.id == self.stranger_1.id)
+        self.stranger_service.get_cached_stranger(stranger_instance)
+        self.assertEqual(self.stranger_service.get_cache_size(), 1)
+        self.assertNotIn(self.stranger_0.id, self.stranger_service._strangers_cache)
+
+    @asynctest.ignore_loop
+    def test_get_inviter__cached(self):
+        self.stranger_1.invited_by = self.stranger_0
+        self.stranger_1.save()
+        self.stranger_service._strangers_cache[self.stranger_0.id] = self.stranger_0
+        self.assertIs(self.stranger_service.get_inviter(self.stranger_1), self.stranger_0)
+
+    @asynctest.ignore_loop
+    def test_get_inviter__not_cached(self):
+        self.stranger_1.invited_by = self.stranger_0
+        self.stranger_1.save()
+        inviter = self.stranger_service.get_inviter(self.stranger_1)
+        self.assertEqual(inviter, self.stranger_0)
+        self.assertIs(self.stranger_service._strangers_cache[self.stranger_0.id], inviter)
+
+    @asynctest.ignore_loop
+    def test_get_inviter__not_invited(self):
+        with self.assertRaises(StrangerServiceError):
+            self.stranger_service.get_inviter(self.stranger_0)
+
+    @asynctest.ignore_loop
+    def test_get_inviter__circular_chain(self):
+        self.stranger_1.invited_by = self.stranger_2
+        self.stranger_1.save()
+        self.stranger_2.invited_by = self.stranger_1
+        self.stranger_2.save()
+        # Chains aren't walked here, so legacy circular chains don't cost anything.
+        self.assertEqual(self.stranger_service.get_inviter(self.stranger_1), self.stranger_2)
+
+    @asynctest.ignore_loop
+    def test_get_inviter__long_chain(self):
+        self.stranger_1.invited_by = self.stranger_2
+        self.stranger_1.save()
+        self.stranger_2.invited_by = self.stranger_3
+        self.stranger_2.save()
+        self.stranger_3.invited_by = self.stranger_4
+        self.stranger_3.save()
+        self.assertEqual(self.stranger_service.get_inviter(self.stranger_1), self.stranger_2)
+        self.assertNotIn(self.stranger_3.id, self.stranger_service._strangers_cache)
+
+    @asynctest.ignore_loop
+    def test_set_inviter__ok(self):
+        self.stranger_2.invited_by = self.stranger_3
+        self.stranger_2.save()
+        self.stranger_service.set_inviter(self.stranger_1, self.stranger_2)
+        self.assertEqual(
+            Stranger.get(Stranger.id == self.stranger_1.id).invited_by_id,
+            self.stranger_2.id,
+            )
+
+    @asynctest.ignore_loop
+    def test_set_inviter__circular_chain(self):
+        self.stranger_2.invited_by = self.stranger_3
+        self.stranger_2.save()
+        self.stranger_3.invited_by = self.stranger_1
+        self.stranger_3.save()
+        with self.assertRaises(StrangerServiceError):
+            self.stranger_service.set_inviter(self.stranger_1, self.stranger_2)
+        self.assertEqual(Stranger.get(Stranger.id == self.stranger_1.id).invited_by_id, None)
+
+    @asynctest.ignore_loop
+    def test_set_inviter__circular_chain_of_inviters(self):
+        self.stranger_2.invited_by = self.stranger_3
+        self.stranger_2.save()
+        self.stranger_3.invited_by = self.stranger_2
+        self.stranger_3.save()
+        with self.assertRaises(StrangerServiceError):
+            self.stranger_service.set_inviter(self.stranger_1, self.stranger_2)
+
+    @asynctest.ignore_loop
+    def test_set_inviter__cached_chain(self):
+        self.stranger_2.invited_by = self.stranger_1
+        self.stranger_service._strangers_cache[self.stranger_2.id] = self.stranger_2
+        with self.assertRaises(StrangerServiceError):
+            self.stranger_service.set_inviter(self.stranger_1, self.stranger_2)
+
+    @asynctest.ignore_loop
+    def test_init__cache_metrics(self):
+        strangers_cache = self.stranger_service._strangers_cache
+        strangers_cache.evictions_count = 3
+        strangers_cache.hits_count = 5
+        strangers_cache.misses_count = 7
+        samples = [
+            sample
+            for metric in (CACHE_EVICTIONS, CACHE_HITS, CACHE_MISSES)
+            for sample in metric.get_samples()
+            ]
+        self.assertIn('randtalkbot_cache_evictions_total{cache="strangers"} 3', samples)
+        self.assertIn('randtalkbot_cache_hits_total{cache="strangers"} 5', samples)
+        self.assertIn('randtalkbot_cache_misses_total{cache="strangers"} 7', samples)
+
     @asynctest.ignore_loop
     def test_get_cache_size(self):
         self.assertEqual(self.stranger_service.get_cache_size(), 0)
@@ -113,11 +215,93 @@ class TestStrangerService(asynctest.TestCase):
             }
         self.assertEqual(self.stranger_service.get_cache_size(), 2)
 
+    @asynctest.ignore_loop
+    def test_get_looking_for_partner_count(self):
+        self.stranger_0.looking_for_partner_from = datetime.datetime(1970, 1, 1)
+        self.stranger_service.get_cached_stranger(self.stranger_0)
+        self.stranger_service.get_cached_stranger(self.stranger_1)
+        self.assertEqual(self.stranger_service.get_looking_for_partner_count(), 1)
+
+    @asynctest.ignore_loop
+    def test_get_talks_count(self):
+        self.stranger_0.set_loaded_talk(Mock(), self.stranger_1)
+        self.stranger_1.set_loaded_talk(Mock(), self.stranger_0)
+        self.stranger_service.get_cached_stranger(self.stranger_0)
+        self.stranger_service.get_cached_stranger(self.stranger_1)
+        self.stranger_service.get_cached_stranger(self.stranger_2)
+        self.assertEqual(self.stranger_service.get_talks_count(), 1)
+
+    @asynctest.ignore_loop
+    def test_get_cache_stats(self):
+        self.stranger_service.get_cached_stranger(self.stranger_0)
+        self.stranger_service.get_cached_stranger(self.stranger_0)
+        self.assertEqual(
+            self.stranger_service.get_cache_stats(),
+            {
+                'evictions': 0,
+                'hits': 1,
+                'misses': 1,
+                'size': 1,
+                },
+            )
+
+    @asynctest.ignore_loop
+    def test_get_cached_stranger__evicts_inactive_strangers(self):
+        self.stranger_service = StrangerService(cache_capacity=2)
+        self.stranger_1.looking_for_partner_from = datetime.datetime(1970, 1, 1)
+        self.stranger_service.get_cached_stranger(self.stranger_0)
+        self.stranger_service.get_cached_stranger(self.stranger_1)
+        self.stranger_service.get_cached_stranger(self.stranger_2)
+        self.stranger_service.get_cached_stranger(self.stranger_3)
+        self.assertNotIn(self.stranger_0.id, self.stranger_service._strangers_cache)
+        self.assertIn(self.stranger_1.id, self.stranger_service._strangers_cache)
+        self.assertNotIn(self.stranger_2.id, self.stranger_service._strangers_cache)
+        self.assertIn(self.stranger_3.id, self.stranger_service._strangers_cache)
+
+    @patch('randtalkbot.stranger_service.StrangerSenderService')
+    @asynctest.ignore_loop
+    def test_get_cached_stranger__evicts_sender(self, stranger_sender_service_cls_mock):
+        stranger_sender_service = stranger_sender_service_cls_mock.get_instance.return_value
+        self.stranger_service = StrangerService(cache_capacity=1)
+        self.stranger_service.get_cached_stranger(self.stranger_0)
+        self.stranger_service.get_cached_stranger(self.stranger_1)
+        stranger_sender_service.remove_stranger_sender.assert_called_once_with(self.stranger_0)
+
+    @asynctest.ignore_loop
+    def test_get_cached_stranger__keeps_locked_strangers(self):
+        self.stranger_service = StrangerService(cache_capacity=1)
+        self.stranger_service.get_cached_stranger(self.stranger_0)
+        self.stranger_service._locked_strangers_ids.add(self.stranger_0.id)
+        self.stranger_service.get_cached_stranger(self.stranger_1)
+        self.assertIn(self.stranger_0.id, self.stranger_service._strangers_cache)
+        self.assertIn(self.stranger_1.id, self.stranger_service._strangers_cache)
+
     @asynctest.ignore_loop
     def test_get_full_strangers(self):
         full_strangers = list(self.stranger_service.get_full_strangers())
         self.assertEqual(len(full_strangers), 6)
 
+    @asynctest.ignore_loop
+    def test_get_full_strangers_profiles(self):
+        self.stranger_5.languages = '["foo", "bar"]'
+        self.stranger_5.save()
+        self.stranger_6.languages = 'corrupted'
+        self.stranger_6.sex = 'female'
+        self.stranger_6.partner_sex = 'not_specified'
+        self.stranger_6.save()
+        self.assertEqual(
+            sorted(self.stranger_service.get_full_strangers_profiles()),
+            [
+                ('female', 'male', ('foo', )),
+                ('female', 'not_specified', ('en', )),
+                ('male', 'female', ('foo', )),
+                ('male', 'female', ('foo', )),
+                ('male', 'female', ('foo', )),
+                ('male', 'female', ('foo', )),
+                ('male', 'female', ('foo', 'bar')),
+                ],
+            )
+
     @patch('randtalkbot.stranger_service.Stranger', create_autospec(Stranger))
     @asynctest.ignore_loop
     def test_get_or_create_stranger__stranger_found(self):
@@ -131,10 +315,12 @@ class TestStrangerService(asynctest.TestCase):
             )
         self.stranger_service.get_cached_stranger.assert_called_once_with(self.stranger_0)
 
+    @patch('randtalkbot.stranger_service.StatsService', Mock())
     @patch('randtalkbot.stranger_service.Stranger', create_autospec(Stranger))
     @asynctest.ignore_loop
     def test_get_or_create_stranger__stranger_not_found(self):
         from randtalkbot.stranger_service import Stranger as stranger_cls_mock
+        from randtalkbot.stranger_service import StatsService as stats_service_cls_mock
         stranger_cls_mock.get.side_effect = DoesNotExist()
         stranger_cls_mock.create.return_value = self.stranger_0
         self.stranger_service.get_cached_stranger = Mock()
@@ -144,6 +330,29 @@ class TestStrangerService(asynctest.TestCase):
             'cached_stranger',
             )
         self.stranger_service.get_cached_stranger.assert_called_once_with(self.stranger_0)
+        stats_service_cls_mock.get_instance \
+            .return_value \
+            .update_stranger_stats \
+            .assert_called_once_with(None, self.stranger_0.get_stats_profile())
+
+    @patch('randtalkbot.stranger_service.Stranger', create_autospec(Stranger))
+    @asynctest.ignore_loop
+    def test_get_or_create_stranger__cached(self):
+        from randtalkbot.stranger_service import Stranger as stranger_cls_mock
+        self.stranger_service.get_cached_stranger(self.stranger_1)
+        self.assertIs(self.stranger_service.get_or_create_stranger(31416), self.stranger_1)
+        stranger_cls_mock.get.assert_not_called()
+
+    @asynctest.ignore_loop
+    def test_get_or_create_stranger__evicted(self):
+        self.stranger_service = StrangerService(cache_capacity=1)
+        self.stranger_service.get_cached_stranger(self.stranger_1)
+        self.stranger_service.get_cached_stranger(self.stranger_0)
+        self.assertNotIn(self.stranger_1.telegram_id, self.stranger_service._strangers_ids)
+        stranger_instance = self.stranger_service.get_or_create_stranger(31416)
+        self.assertIsNot(stranger_instance, self.stranger_1)
+        self.assertEqual(stranger_instance.id, self.stranger_1.id)
+        self.assertIs(self.stranger_service._strangers_cache[self.stranger_1.id], stranger_instance)
 
     @patch('randtalkbot.stranger_service.Stranger', create_autospec(Stranger))
     @asynctest.ignore_loop
@@ -167,6 +376,12 @@ class TestStrangerService(asynctest.TestCase):
             self.stranger_1.id,
             )
 
+    @patch('randtalkbot.stranger_service.Stranger.get', Mock(side_effect=DatabaseError()))
+    @asynctest.ignore_loop
+    def test_get_stranger__cached(self):
+        self.stranger_service.get_cached_stranger(self.stranger_1)
+        self.assertIs(self.stranger_service.get_stranger(31416), self.stranger_1)
+
     @patch('randtalkbot.stranger_service.Stranger.get', Mock(side_effect=DatabaseError()))
     @asynctest.ignore_loop
     def test_get_stranger__database_error(self):
@@ -749,6 +964,39 @@ class TestStrangerService(asynctest.TestCase):
             )
         stranger_mock.notify_partner_found.assert_called_once_with(partner)
 
+    async def test_match_partner__first_partner_is_unreachable(self):
+        stranger_mock = CoroutineMock()
+        partner = CoroutineMock()
+        partner.id = 31416
+        partner2 = CoroutineMock()
+        partner2.id = 27183
+        self.stranger_service._match_partner = Mock(side_effect=[partner, partner2])
+        self.stranger_service._locked_strangers_ids = Mock()
+        partner.notify_partner_found.side_effect = TransientSendingError('foo', 429, {})
+        await self.stranger_service.match_partner(stranger_mock)
+        partner.end_talk.assert_not_called()
+        self.assertEqual(
+            self.stranger_service._locked_strangers_ids.discard.call_args_list,
+            [
+                call(31416),
+                call(27183),
+                ],
+            )
+        stranger_mock.notify_partner_found.assert_called_once_with(partner2)
+        stranger_mock.set_partner.assert_called_once_with(partner2)
+
+    async def test_match_partner__stranger_is_unreachable(self):
+        stranger_mock = CoroutineMock()
+        partner = CoroutineMock()
+        partner.id = 31416
+        self.stranger_service._match_partner = Mock(return_value=partner)
+        self.stranger_service._locked_strangers_ids = Mock()
+        stranger_mock.notify_partner_found.side_effect = TransientSendingError('foo', 429, {})
+        with self.assertRaises(StrangerServiceError):
+            await self.stranger_service.match_partner(stranger_mock)
+        self.stranger_service._locked_strangers_ids.discard.assert_called_once_with(31416)
+        stranger_mock.set_partner.assert_not_called()
+
     async def test_match_partner__partner_obtaining_error(self):
         stranger_mock = CoroutineMock()
         self.stranger_service._match_partner = Mock(
@@ -756,3 +1004,37 @@ class TestStrangerService(asynctest.TestCase):
             )
         with self.assertRaises(PartnerObtainingError):
             await self.stranger_service.match_partner(stranger_mock)
+
+    @asynctest.ignore_loop
+    def test_warm_up__ok(self):
+        talk_instance = talk.Talk.create(
+            partner1=self.stranger_0,
+            partner2=self.stranger_1,
+            searched_since=datetime.datetime(1970, 1, 1),
+            )
+        talk.Talk.create(
+            partner1=self.stranger_2,
+            partner2=self.stranger_3,
+            searched_since=datetime.datetime(1970, 1, 1),
+            end=datetime.datetime(1970, 1, 2),
+            )
+        self.stranger_4.looking_for_partner_from = datetime.datetime(1970, 1, 1)
+        self.stranger_4.save()
+        self.stranger_service.warm_up()
+        self.assertEqual(self.stranger_service.get_cache_size(), 3)
+        stranger_0 = self.stranger_service._strangers_cache[self.stranger_0.id]
+        stranger_1 = self.stranger_service._strangers_cache[self.stranger_1.id]
+        stranger_4 = self.stranger_service._strangers_cache[self.stranger_4.id]
+        self.assertEqual(stranger_0.get_talk(), talk_instance)
+        self.assertIs(stranger_0.get_partner(), stranger_1)
+        self.assertIs(stranger_1.get_partner(), stranger_0)
+        self.assertIs(stranger_0.get_talk(), stranger_1.get_talk())
+        self.assertIs(stranger_0.get_talk().partner2, stranger_1)
+        self.assertEqual(stranger_4.get_talk(), None)
+        self.assertEqual(stranger_4.get_partner(), None)
+
+    @patch('randtalkbot.stranger_service.Stranger.select', Mock(side_effect=DatabaseError()))
+    @asynctest.ignore_loop
+    def test_warm_up__database_error(self):
+        with self.assertRaises(StrangerServiceError):
+            self.stranger_service.warm_up()
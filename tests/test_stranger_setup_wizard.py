@@ -12,6 +12,7 @@ from randtalkbot.i18n import LanguageNotFoundError
 from randtalkbot.stranger_setup_wizard import StrangerSetupWizard
 
 
+@patch('randtalkbot.stranger_setup_wizard.StatsService', Mock())
 class TestStrangerSetupWizard(asynctest.TestCase):
     @patch('randtalkbot.stranger_sender_service.StrangerSenderService._instance')
     def setUp(self, stranger_sender_service):
@@ -196,6 +197,21 @@ class TestStrangerSetupWizard(asynctest.TestCase):
             'foo_sex',
             )
 
+    async def test_handle__updates_stats(self):
+        from randtalkbot.stranger_setup_wizard import StatsService as stats_service_cls_mock
+        stats_service_cls_mock.reset_mock()
+        self.stranger.wizard = 'setup'
+        self.stranger.wizard_step = 'partner_sex'
+        self.stranger_setup_wizard.deactivate = CoroutineMock()
+        self.stranger.get_stats_profile.side_effect = [None, ('male', 'female', ('en', ))]
+        message = Mock()
+        message.text = 'foo_text'
+        self.assertTrue((await self.stranger_setup_wizard.handle(message)))
+        stats_service_cls_mock.get_instance \
+            .return_value \
+            .update_stranger_stats \
+            .assert_called_once_with(None, ('male', 'female', ('en', )))
+
     async def test_handle__partner_sex_ok(self):
         self.stranger.wizard = 'setup'
         self.stranger.wizard_step = 'partner_sex'
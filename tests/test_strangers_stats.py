@@ -0,0 +1,64 @@
+# RandTalkBot Bot matching you with a random person on Telegram.
+# Copyright (C) 2016 quasiyoke
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+from randtalkbot.strangers_stats import StrangersStats
+
+PROFILES = (
+    ('female', 'male', ('en', )),
+    ('male', 'female', ('en', 'it')),
+    ('male', 'not_specified', ('ru', )),
+    )
+
+class TestStrangersStats(unittest.TestCase):
+    def setUp(self):
+        self.strangers_stats = StrangersStats.from_profiles(PROFILES)
+
+    def test_get_data(self):
+        self.assertEqual(
+            self.strangers_stats.get_data(),
+            {
+                'languages_count_distribution': [(1, 2), (2, 1)],
+                'languages_popularity': [('en', 2), ('it', 1), ('ru', 1)],
+                'languages_to_orientation': [
+                    ('en', {'female male': 1, 'male female': 1}),
+                    ('it', {'male female': 1}),
+                    ('ru', {'male not_specified': 1}),
+                    ],
+                'partner_sex_distribution': {'female': 1, 'male': 1, 'not_specified': 1},
+                'sex_distribution': {'female': 1, 'male': 2},
+                'total_count': 3,
+                },
+            )
+
+    def test_update(self):
+        self.strangers_stats.update(
+            ('male', 'not_specified', ('ru', )),
+            ('female', 'female', ('it', )),
+            )
+        self.strangers_stats.update(None, ('female', 'not_specified', ('en', )))
+        expected_strangers_stats = StrangersStats.from_profiles((
+            ('female', 'male', ('en', )),
+            ('male', 'female', ('en', 'it')),
+            ('female', 'female', ('it', )),
+            ('female', 'not_specified', ('en', )),
+            ))
+        self.assertEqual(self.strangers_stats.get_data(), expected_strangers_stats.get_data())
+
+    def test_update__stranger_isnt_full_anymore(self):
+        self.strangers_stats.update(('female', 'male', ('en', )), None)
+        self.assertEqual(self.strangers_stats.total_count, 2)
+        self.assertEqual(self.strangers_stats.get_sex_distribution(), {'male': 2})
+
+    def test_update__not_counted_profile(self):
+        self.strangers_stats.update(('not_specified', 'male', ('de', )), None)
+        self.assertEqual(self.strangers_stats.total_count, 3)
+
+    def test_remove__all(self):
+        for profile in PROFILES:
+            self.strangers_stats.remove(profile)
+
+        self.assertEqual(self.strangers_stats.get_data(), StrangersStats().get_data())
@@ -0,0 +1,97 @@
+# RandTalkBot Bot matching you with a random person on Telegram.
+# Copyright (C) 2016 quasiyoke
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import asynctest
+from asynctest.mock import patch, Mock, CoroutineMock
+import telepot.aio
+from telepot.aio import api
+from randtalkbot.telegram_session import TelegramSession
+from .telegram_stand_in import TelegramStandIn
+
+class TestTelegramSession(asynctest.TestCase):
+    def setUp(self):
+        self.telepot_state = (api._pools['default'], api._timeout, api._methodurl)
+
+    def tearDown(self):
+        api._pools['default'], api._timeout, api._methodurl = self.telepot_state
+
+    @asynctest.ignore_loop
+    def test_get_method_url(self):
+        telegram_session = TelegramSession(api_url='http://127.0.0.1:8081')
+        self.assertEqual(
+            telegram_session.get_method_url(('foo_token', 'sendMessage', {}, None)),
+            'http://127.0.0.1:8081/botfoo_token/sendMessage',
+            )
+
+    @patch('randtalkbot.telegram_session.asyncio', Mock())
+    @patch('randtalkbot.telegram_session.aiohttp')
+    @asynctest.ignore_loop
+    def test_install(self, aiohttp_mock):
+        telepot_session = Mock()
+        telepot_methodurl = api._methodurl
+        api._pools['default'] = telepot_session
+        telegram_session = TelegramSession(
+            pool_size=20,
+            per_host_limit=10,
+            keepalive_timeout=30,
+            dns_cache_ttl=60,
+            connect_timeout=5,
+            timeout=15,
+            )
+        telegram_session.install()
+        aiohttp_mock.TCPConnector.assert_called_once_with(
+            limit=20,
+            limit_per_host=10,
+            keepalive_timeout=30,
+            ttl_dns_cache=60,
+            )
+        aiohttp_mock.ClientTimeout.assert_called_once_with(connect=5)
+        aiohttp_mock.ClientSession.assert_called_once_with(
+            connector=aiohttp_mock.TCPConnector.return_value,
+            timeout=aiohttp_mock.ClientTimeout.return_value,
+            )
+        self.assertEqual(api._pools['default'], aiohttp_mock.ClientSession.return_value)
+        self.assertEqual(api._timeout, 15)
+        self.assertEqual(api._methodurl, telepot_methodurl)
+        telepot_session.close.assert_called_once_with()
+
+    @patch('randtalkbot.telegram_session.asyncio', Mock())
+    @patch('randtalkbot.telegram_session.aiohttp', Mock())
+    @asynctest.ignore_loop
+    def test_install__api_url(self):
+        api._pools['default'] = Mock()
+        telegram_session = TelegramSession(api_url='http://127.0.0.1:8081')
+        telegram_session.install()
+        self.assertEqual(api._methodurl, telegram_session.get_method_url)
+
+    async def test_close(self):
+        telegram_session = TelegramSession()
+        telegram_session._session = Mock()
+        telegram_session._session.close = CoroutineMock()
+        await telegram_session.close()
+        telegram_session._session.close.assert_called_once_with()
+
+    async def test_stand_in__reuses_connections(self):
+        stand_in = TelegramStandIn(latency=0.01)
+        await stand_in.start()
+        telegram_session = TelegramSession(api_url=stand_in.get_api_url(), pool_size=2)
+        telegram_session.install()
+        bot = telepot.aio.Bot('foo_token')
+
+        try:
+            for unused_i in range(3):
+                await bot.sendMessage(31416, 'foo')
+
+            self.assertEqual(stand_in.connections_count, 1)
+            await asyncio.gather(*[bot.sendMessage(31416, 'foo') for unused_i in range(10)])
+            self.assertEqual(stand_in.connections_count, 2)
+        finally:
+            await telegram_session.close()
+            await stand_in.stop()
+
+        self.assertEqual(len(stand_in.requests), 13)
+        self.assertEqual(stand_in.requests[0], ('sendMessage', {'chat_id': '31416', 'text': 'foo'}))
@@ -0,0 +1,56 @@
+# RandTalkBot Bot matching you with a random person on Telegram.
+# Copyright (C) 2016 quasiyoke
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+from randtalkbot.trie import Trie
+
+class TestTrie(unittest.TestCase):
+    def setUp(self):
+        self.trie = Trie()
+        self.trie['english'] = 'en'
+        self.trie['en'] = 'en'
+        self.trie['italian'] = 'it'
+        self.trie['kurdish'] = 'ku'
+        self.trie['turkish'] = 'tr'
+
+    def test_getitem(self):
+        self.assertEqual(self.trie['english'], 'en')
+        self.assertEqual(self.trie['en'], 'en')
+
+    def test_getitem__prefix(self):
+        self.assertRaises(KeyError, self.trie.__getitem__, 'eng')
+
+    def test_getitem__unknown(self):
+        self.assertRaises(KeyError, self.trie.__getitem__, 'german')
+
+    def test_search__exact(self):
+        self.assertEqual(self.trie.search('italian', 0), [(0, 'italian', 'it')])
+
+    def test_search__deletion(self):
+        self.assertEqual(self.trie.search('englsh', 1), [(1, 'english', 'en')])
+
+    def test_search__insertion(self):
+        self.assertEqual(self.trie.search('itallian', 1), [(1, 'italian', 'it')])
+
+    def test_search__substitution(self):
+        self.assertEqual(self.trie.search('inglish', 1), [(1, 'english', 'en')])
+
+    def test_search__sorted_by_distance(self):
+        self.assertEqual(
+            self.trie.search('kurkish', 2),
+            [(1, 'kurdish', 'ku'), (1, 'turkish', 'tr')],
+            )
+        self.assertEqual(
+            self.trie.search('turdish', 2),
+            [(1, 'kurdish', 'ku'), (1, 'turkish', 'tr')],
+            )
+        self.assertEqual(
+            self.trie.search('kurish', 2),
+            [(1, 'kurdish', 'ku'), (2, 'turkish', 'tr')],
+            )
+
+    def test_search__too_far(self):
+        self.assertEqual(self.trie.search('englishes', 1), [])
@@ -0,0 +1,162 @@
+# RandTalkBot Bot matching you with a random person on Telegram.
+# Copyright (C) 2016 quasiyoke
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import unittest
+import aiohttp
+import asynctest
+from asynctest.mock import CoroutineMock, Mock
+from randtalkbot.webhook_server import parse_update, WebhookServer
+
+UPDATE = {
+    'update_id': 100,
+    'message': {
+        'message_id': 1,
+        'chat': {'id': 31416, 'type': 'private'},
+        'from': {'id': 31416},
+        'date': 0,
+        'text': 'Hello',
+        },
+    }
+UPDATE_BODY = json.dumps(UPDATE).encode('utf-8')
+
+class TestParseUpdate(unittest.TestCase):
+    def test_parse_update__ok(self):
+        self.assertEqual(parse_update(UPDATE_BODY), UPDATE)
+
+    def test_parse_update__malformed(self):
+        for body in (b'\xff', b'{', b'[]', b'{"message": {}}'):
+            with self.assertRaises(ValueError):
+                parse_update(body)
+
+class TestWebhookServer(asynctest.TestCase):
+    def setUp(self):
+        self.webhook_server = WebhookServer(
+            host='127.0.0.1',
+            port=0,
+            path='/foo_path',
+            secret_token='foo_secret',
+            queue_size=2,
+            )
+        self.headers = {'x-telegram-bot-api-secret-token': 'foo_secret'}
+
+    @asynctest.ignore_loop
+    def test_get_response__ok(self):
+        self.assertEqual(
+            self.webhook_server._get_response(
+                b'POST /foo_path HTTP/1.1\r\n',
+                self.headers,
+                UPDATE_BODY,
+                ),
+            '200 OK',
+            )
+        self.assertEqual(self.webhook_server.queue.get_nowait(), UPDATE)
+
+    @asynctest.ignore_loop
+    def test_get_response__no_secret_token(self):
+        self.webhook_server = WebhookServer(path='/foo_path')
+        self.assertEqual(
+            self.webhook_server._get_response(b'POST /foo_path HTTP/1.1\r\n', {}, UPDATE_BODY),
+            '200 OK',
+            )
+
+    @asynctest.ignore_loop
+    def test_get_response__wrong_secret_token(self):
+        for headers in ({}, {'x-telegram-bot-api-secret-token': 'bar_secret'}):
+            self.assertEqual(
+                self.webhook_server._get_response(
+                    b'POST /foo_path HTTP/1.1\r\n',
+                    headers,
+                    UPDATE_BODY,
+                    ),
+                '403 Forbidden',
+                )
+        self.assertTrue(self.webhook_server.queue.empty())
+
+    @asynctest.ignore_loop
+    def test_get_response__not_found(self):
+        self.assertEqual(
+            self.webhook_server._get_response(b'POST / HTTP/1.1\r\n', self.headers, UPDATE_BODY),
+            '404 Not Found',
+            )
+
+    @asynctest.ignore_loop
+    def test_get_response__method_not_allowed(self):
+        self.assertEqual(
+            self.webhook_server._get_response(b'GET /foo_path HTTP/1.1\r\n', self.headers, b''),
+            '405 Method Not Allowed',
+            )
+
+    @asynctest.ignore_loop
+    def test_get_response__bad_request(self):
+        for request_line, body in (
+                (b'\xff\r\n', UPDATE_BODY),
+                (b'POST /foo_path HTTP/1.1\r\n', b'{'),
+                (b'POST /foo_path HTTP/1.1\r\n', b'[]'),
+                (b'POST /foo_path HTTP/1.1\r\n', b'{"message": {}}'),
+            ):
+            self.assertEqual(
+                self.webhook_server._get_response(request_line, self.headers, body),
+                '400 Bad Request',
+                )
+        self.assertTrue(self.webhook_server.queue.empty())
+
+    @asynctest.ignore_loop
+    def test_get_response__queue_is_full(self):
+        for unused_i in range(2):
+            self.webhook_server._get_response(
+                b'POST /foo_path HTTP/1.1\r\n',
+                self.headers,
+                UPDATE_BODY,
+                )
+        self.assertEqual(
+            self.webhook_server._get_response(
+                b'POST /foo_path HTTP/1.1\r\n',
+                self.headers,
+                UPDATE_BODY,
+                ),
+            '429 Too Many Requests',
+            )
+        self.assertEqual(self.webhook_server.queue.qsize(), 2)
+
+    async def test_handle_connection__payload_too_large(self):
+        reader = Mock()
+        reader.readline = CoroutineMock(side_effect=[
+            b'POST /foo_path HTTP/1.1\r\n',
+            b'Content-Length: 2000000\r\n',
+            b'\r\n',
+            ])
+        writer = Mock()
+        writer.drain = CoroutineMock()
+        await self.webhook_server._handle_connection(reader, writer)
+        self.assertTrue(writer.write.call_args_list[0][0][0].startswith(
+            b'HTTP/1.1 413 Payload Too Large\r\n',
+            ))
+        writer.close.assert_called_once_with()
+
+    async def test_posted_updates_are_queued(self):
+        await self.webhook_server.run()
+        host, port = self.webhook_server._server.sockets[0].getsockname()[:2]
+        url = 'http://{}:{}/foo_path'.format(host, port)
+        statuses = []
+
+        try:
+            async with aiohttp.ClientSession() as session:
+                for update_id, headers in (
+                        (100, self.headers),
+                        (101, {}),
+                        (102, self.headers),
+                        (103, self.headers),
+                    ):
+                    update = dict(UPDATE, update_id=update_id)
+                    async with session.post(url, json=update, headers=headers) as response:
+                        statuses.append(response.status)
+        finally:
+            await self.webhook_server.stop()
+
+        self.assertEqual(statuses, [200, 403, 200, 429])
+        self.assertEqual(self.webhook_server.queue.get_nowait(), UPDATE)
+        self.assertEqual(self.webhook_server.queue.get_nowait(), dict(UPDATE, update_id=102))